@@ -0,0 +1,140 @@
+"""
+Compile many modules at once, spread over a pool of processes, writing
+each one's code as a .pyc file under an output directory.
+
+    $ python3 batchcompile.py [-j JOBS] [-o DIR] [--json FILE] PATH...
+
+Each PATH is a .py file or a directory to search for them. Prints how
+each file fared and how long it took; exits nonzero if any failed.
+"""
+
+import argparse, concurrent.futures, importlib.util, json, marshal, os, struct, sys, time
+import compiler
+
+def find_modules(paths):
+    """Return a list of (filename, module_name, relative output path),
+    with each file just once however often it's named. Raise ValueError
+    if two different files would be written to the same output path."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            # A package's modules are named from its parent directory.
+            root = path
+            if os.path.exists(os.path.join(path, '__init__.py')):
+                root = os.path.dirname(os.path.abspath(path))
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if name.endswith('.py'):
+                        filename = os.path.join(dirpath, name)
+                        found.append((filename, os.path.relpath(filename, root)))
+        else:
+            found.append((path, os.path.basename(path)))
+    modules = []
+    seen = set()                # The real paths of the files so far
+    outputs = {}                # relative output path -> filename
+    for filename, relative in found:
+        real = os.path.realpath(filename)
+        if real in seen:
+            continue
+        if relative in outputs:
+            raise ValueError("%s and %s would both be compiled to %s"
+                             % (outputs[relative], filename, relative + 'c'))
+        seen.add(real)
+        outputs[relative] = filename
+        modules.append((filename, module_name_for(relative), relative))
+    return modules
+
+def module_name_for(relative):
+    parts = os.path.splitext(relative)[0].split(os.sep)
+    if parts[-1] == '__init__' and len(parts) > 1:
+        parts.pop()
+    return '.'.join(parts)
+
+def compile_all(paths, output_dir, jobs, optimize, use_cache):
+    """Compile the modules under paths with a pool of jobs processes (all
+    the CPUs if None). Return a result dict for each module, in order."""
+    modules = find_modules(paths)
+    # Start the biggest first, so one won't be left running alone at the end.
+    by_size = sorted(modules, key=lambda m: os.path.getsize(m[0]), reverse=True)
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        futures = dict((filename, pool.submit(compile_one, filename, module_name,
+                                              os.path.join(output_dir, relative + 'c'),
+                                              optimize, use_cache))
+                       for filename, module_name, relative in by_size)
+        return [futures[filename].result() for filename, _, _ in modules]
+
+def compile_one(filename, module_name, output, optimize, use_cache):
+    "Compile one module in a worker process, writing its code to output."
+    # The code object gets written here rather than sent back, since
+    # code objects can't be pickled.
+    compiler.optimize = optimize
+    if not use_cache:
+        compiler.code_cache.directory = None
+    result = dict(filename=filename, module=module_name, output=output, ok=False, error=None)
+    start = time.perf_counter()
+    try:
+        with open(filename) as f:
+            source = f.read()
+        code, _ = compiler.code_cache.get_or_compile(module_name, filename, source,
+                                                     [optimize, compiler.tail_calls],
+                                                     compiler.compile_source)
+        write_pyc(output, code, os.stat(filename))
+        result['ok'] = True
+    except Exception as e:
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def write_pyc(output, code, source_stat):
+    "Write code in the .pyc format: magic number, source mtime and size, marshalled code."
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'wb') as f:
+        f.write(importlib.util.MAGIC_NUMBER)
+        f.write(struct.pack('<II', int(source_stat.st_mtime) & 0xFFFFFFFF,
+                            source_stat.st_size & 0xFFFFFFFF))
+        marshal.dump(code, f)
+
+def report(results, elapsed, out):
+    for r in results:
+        status = 'ok  ' if r['ok'] else 'FAIL'
+        line = '%s %8.3fs  %s' % (status, r['seconds'], r['filename'])
+        if not r['ok']:
+            line += '\n         ' + r['error']
+        print(line, file=out)
+    failed = sum(1 for r in results if not r['ok'])
+    print('%d compiled, %d failed in %.3fs (%.3fs of compiling)'
+          % (len(results) - failed, failed, elapsed, sum(r['seconds'] for r in results)),
+          file=out)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Compile modules with tailbiter in parallel.")
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help="a .py file, or a directory to compile every .py file under")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument('-o', '--output-dir', default='build',
+                        help="where to write the .pyc files (default: build)")
+    parser.add_argument('--json', metavar='FILE',
+                        help="also write the results to FILE as JSON")
+    parser.add_argument('--no-optimize', action='store_true',
+                        help="skip the optimization passes")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't read or write the code cache")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        results = compile_all(args.paths, args.output_dir, args.jobs,
+                              not args.no_optimize, not args.no_cache)
+    except ValueError as e:
+        parser.error(str(e))
+    elapsed = time.perf_counter() - start
+    report(results, elapsed, sys.stdout)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(results=results, seconds=elapsed), f, indent=2)
+    return 0 if all(r['ok'] for r in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,44 @@
+"""
+Compile time and peak memory of the compiler on compiler.py itself and
+on a 50k-line synthetic module. Each case runs in a fresh subprocess,
+so the peak RSS reported is that case's own.
+
+    $ python -m benchmarks.assembly
+"""
+
+import ast, resource, subprocess, sys, time
+import compiler
+from benchmarks import synthetic
+
+cases = {
+    'compiler.py':     lambda: read_file('compiler.py'),
+    'synthetic-50k':   lambda: synthetic.many_functions(50000),
+}
+
+def read_file(filename):
+    with open(filename) as f:
+        return f.read()
+
+def measure(case):
+    source = cases[case]()
+    start = time.perf_counter()
+    t = ast.parse(source)
+    parsed = time.perf_counter()
+    compiler.code_for_module(case, case, t)
+    compiled = time.perf_counter()
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('%d %f %f %d' % (source.count('\n'), parsed - start, compiled - parsed, peak_kb))
+
+def main():
+    print('%-16s %8s %10s %10s %12s' % ('case', 'lines', 'parse (s)', 'compile (s)', 'peak RSS (MB)'))
+    for case in cases:
+        output = subprocess.check_output([sys.executable, '-m', 'benchmarks.assembly', case])
+        lines, parse_time, compile_time, peak_kb = output.split()
+        print('%-16s %8s %10.3f %10.3f %12.1f' % (case, lines.decode(), float(parse_time),
+                                                   float(compile_time), int(peak_kb) / 1024))
+
+if __name__ == '__main__':
+    if sys.argv[1:]:
+        measure(sys.argv[1])
+    else:
+        main()
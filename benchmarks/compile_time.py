@@ -0,0 +1,91 @@
+"""
+How long the compiler takes on each module of a fixed corpus, next to
+CPython's own compile(): the repo's modules plus synthetic stress cases.
+Each case is compiled some times to warm up, then timed repeatedly;
+we report the median and spread.
+
+    $ python -m benchmarks.compile_time [--repeat N] [--warmup N] [--json FILE] [CASE...]
+
+Both timings include parsing. The code cache isn't involved.
+"""
+
+import argparse, ast, gc, json, statistics, sys, time
+import compiler
+from benchmarks import corpus, synthetic
+
+def make_cases():
+    "An ordered list of (case name, source)."
+    cases = [(filename, corpus.read_file(filename)) for filename in corpus.files]
+    cases.append(('synthetic-many-functions', synthetic.many_functions(10000)))
+    cases.append(('synthetic-deep-nesting',   synthetic.deep_nesting(40)))
+    cases.append(('synthetic-huge-dict',      synthetic.huge_dict(10000)))
+    return cases
+
+def tailbiter_compile(name, source):
+    return compiler.code_for_module(name, name, ast.parse(source))
+
+def cpython_compile(name, source):
+    return compile(source, name, 'exec')
+
+def time_runs(fn, name, source, warmup, repeat):
+    "Call fn(name, source) warmup times, then time repeat calls; summarize."
+    for _ in range(warmup):
+        fn(name, source)
+    gc.collect()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(name, source)
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+def summarize(times):
+    times = sorted(times)
+    return dict(runs=len(times), min=times[0], max=times[-1],
+                median=statistics.median(times),
+                p10=percentile(times, 10), p90=percentile(times, 90))
+
+def percentile(sorted_times, p):
+    "The nearest-rank pth percentile."
+    rank = max(1, -(-len(sorted_times) * p // 100))
+    return sorted_times[rank - 1]
+
+def run(cases, warmup, repeat):
+    "Time each (name, source) case. Return a JSON-ready dict of results."
+    results = []
+    for name, source in cases:
+        tailbiter = time_runs(tailbiter_compile, name, source, warmup, repeat)
+        cpython   = time_runs(cpython_compile,   name, source, warmup, repeat)
+        results.append(dict(case=name, lines=source.count('\n'),
+                            tailbiter=tailbiter, cpython=cpython,
+                            ratio=tailbiter['median'] / cpython['median']))
+    return dict(python=sys.version, warmup=warmup, repeat=repeat, results=results)
+
+def report(summary, out):
+    row = '%-34s %7s %10s %10s %10s %10s %7s'
+    print(row % ('case', 'lines', 'median (s)', 'p10', 'p90', 'CPython', 'ratio'), file=out)
+    for r in summary['results']:
+        tb = r['tailbiter']
+        print('%-34s %7d %10.4f %10.4f %10.4f %10.4f %6.1fx'
+              % (r['case'], r['lines'], tb['median'], tb['p10'], tb['p90'],
+                 r['cpython']['median'], r['ratio']), file=out)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark compile times.")
+    parser.add_argument('cases', nargs='*', metavar='CASE',
+                        help="the cases to run (default: all)")
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--json', metavar='FILE', help="also write the results to FILE")
+    args = parser.parse_args(argv)
+    cases = make_cases()
+    if args.cases:
+        cases = [(name, source) for name, source in cases if name in args.cases]
+    summary = run(cases, args.warmup, args.repeat)
+    report(summary, sys.stdout)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
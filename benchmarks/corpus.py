@@ -0,0 +1,19 @@
+"""The modules in this repo that the compiler can compile."""
+
+files = [
+    'compiler.py',
+    'byterun/interpreter.py',
+    'metameta.py',
+    'meta_via_parsiflage.py',
+    'article-code/greet.py',
+    'article-code/tailbiter0.py',
+    'article-code/tailbiter1.py',
+    'article-code/tailbiter1_py35.py',
+    'article-code/tailbiter2.py',
+    'article-code/tailbiter2_py35.py',
+    'article-code/tailbiter2_py36.py',
+]
+
+def read_file(filename):
+    with open(filename) as f:
+        return f.read()
@@ -0,0 +1,84 @@
+"""
+Profile which pairs of instructions byterun runs one after the other,
+to choose its superinstructions (see byterun.interpreter.superinstructions).
+The workload is byterun running the tailbiter-compiled compiler, compiling
+modules from the corpus.
+
+    $ python -m benchmarks.pairs [--top N] [--fused] [FILE...]
+
+A pair counts only where it could be fused: the second instruction
+is not a jump target, so it's only ever reached from the first. With
+--fused, the current superinstructions are in effect, and the pairs
+left over show the next candidates.
+"""
+
+import argparse, ast, collections, dis
+import compiler
+from byterun import interpreter
+from benchmarks import corpus
+
+default_files = ['article-code/tailbiter0.py', 'article-code/greet.py']
+
+def profile(filenames, fused):
+    """Return a Counter of the fusable pairs of instructions, by name,
+    that byterun runs while running the compiler on each file, and the
+    total number of instructions it dispatches. If fused, byterun's
+    current superinstructions are in effect, as single instructions."""
+    executed = collections.Counter()  # (code, offset of next instruction) -> times run
+    def counting(handler):
+        def counted(frame, *arguments):
+            executed[frame.f_code, frame.f_lasti] += 1
+            return handler(frame, *arguments)
+        return counted
+    saved = (interpreter.handlers, interpreter.super_opcodes, interpreter.decoded_code,
+             interpreter.adaptive)
+    interpreter.handlers = [counting(handler) for handler in saved[0]]
+    interpreter.decoded_code = {}
+    interpreter.adaptive = False    # Its call sites' variants are still CALL_FUNCTIONs.
+    if not fused:
+        interpreter.super_opcodes = {}
+    try:
+        module = {'__name__': 'compiler'}
+        interpreter.run(compile_file('compiler.py'), module, None)
+        for filename in filenames:
+            module['code_for_module'](filename, filename,
+                                      ast.parse(corpus.read_file(filename)))
+        pairs = tally_pairs(executed)
+    finally:
+        (interpreter.handlers, interpreter.super_opcodes, interpreter.decoded_code,
+         interpreter.adaptive) = saved
+    return pairs, sum(executed.values())
+
+def tally_pairs(executed):
+    pairs = collections.Counter()
+    for code in set([code for code, _ in executed]):
+        instructions = interpreter.decode(code)
+        targets = interpreter.jump_targets(instructions)
+        first = 0
+        while instructions[first][2] < len(instructions):
+            second = instructions[first][2]
+            opcodes = instructions[first][0], instructions[second][0]
+            if second not in targets and max(opcodes) < len(dis.opname):
+                pair = dis.opname[opcodes[0]], dis.opname[opcodes[1]]
+                pairs[pair] += executed[code, instructions[second][2]]
+            first = second
+    return pairs
+
+def compile_file(filename):
+    return compiler.code_for_module(filename, filename, ast.parse(corpus.read_file(filename)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile the pairs of instructions byterun runs.")
+    parser.add_argument('files', nargs='*', metavar='FILE', default=default_files)
+    parser.add_argument('--top', type=int, default=20, help="how many pairs to list")
+    parser.add_argument('--fused', action='store_true',
+                        help="profile with byterun's superinstructions in effect")
+    args = parser.parse_args(argv)
+    pairs, total = profile(args.files, args.fused)
+    print('%d instructions dispatched' % total)
+    print('%10s %6s  %s' % ('count', '%', 'pair'))
+    for (name1, name2), count in pairs.most_common(args.top):
+        print('%10d %5.1f%%  %s %s' % (count, 100.0 * count / total, name1, name2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Report how many instructions and bytes the peephole stage saves,
+per module of the corpus and in total.
+
+    $ python -m benchmarks.peephole
+"""
+
+import ast
+import compiler
+from benchmarks import corpus
+
+def tally(blocks):
+    instructions = [part for block in blocks for part in block.parts
+                    if isinstance(part, compiler.Instruction)]
+    return len(instructions), sum(part.length for part in instructions)
+
+def measure(filename):
+    "Compile filename, totting up the peephole stage's input and output."
+    counts = [0, 0, 0, 0]
+    def counting_peephole(blocks):
+        before = tally(blocks)  # (peephole updates the blocks in place.)
+        optimized = peephole(blocks)
+        for i, n in enumerate(before + tally(optimized)):
+            counts[i] += n
+        return optimized
+    peephole = compiler.peephole
+    compiler.peephole = counting_peephole
+    try:
+        compiler.code_for_module(filename, filename, ast.parse(corpus.read_file(filename)))
+    finally:
+        compiler.peephole = peephole
+    return counts
+
+def main():
+    row = '%-34s %8s %8s %7s %8s %8s %7s'
+    print(row % ('module', 'insns', 'after', 'saved', 'bytes', 'after', 'saved'))
+    totals = [0, 0, 0, 0]
+    for filename in corpus.files:
+        counts = measure(filename)
+        totals = [total + n for total, n in zip(totals, counts)]
+        print(row % format_row(filename, counts))
+    print(row % format_row('total', totals))
+
+def format_row(name, counts):
+    insns, bytes_, insns_after, bytes_after = counts
+    return (name, insns, insns_after, percent(insns - insns_after, insns),
+            bytes_, bytes_after, percent(bytes_ - bytes_after, bytes_))
+
+def percent(part, whole):
+    return '%.1f%%' % (100.0 * part / whole) if whole else '-'
+
+if __name__ == '__main__':
+    main()
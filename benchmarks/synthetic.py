@@ -0,0 +1,40 @@
+"""Generate large modules in the compiler's Python subset, for stress-testing."""
+
+function_template = '''\
+def f{n}(a, b):
+    x = a * {n} + b
+    if x > {n}:
+        y = [x, a, b, {n}]
+    else:
+        y = {{'x': x, 'a': a, 'n': {n}}}
+    for i in range(3):
+        x = x + i * b
+    return (x, y, len(y))
+
+r{n} = f{n}({n}, 7)
+'''
+
+def many_functions(n_lines):
+    "A module of about n_lines lines, made of many small functions."
+    n_functions = max(1, n_lines // function_template.count('\n'))
+    return ''.join(function_template.format(n=n) for n in range(n_functions))
+
+def deep_nesting(depth):
+    """A module whose functions nest depth deep, each level adding an if
+    and a term to a long expression that uses every enclosing argument."""
+    lines = []
+    for level in range(depth):
+        indent = '    ' * level
+        lines.append('%sdef f%d(a%d):' % (indent, level, level))
+        lines.append('%s    if a%d:' % (indent, level))
+        lines.append('%s        a%d = a%d - 1' % (indent, level, level))
+    terms = ' + '.join('a%d * %d' % (level, level) for level in range(depth))
+    lines.append('%sreturn %s' % ('    ' * depth, terms))
+    for level in reversed(range(1, depth)):
+        lines.append('%sreturn f%d' % ('    ' * level, level))
+    return '\n'.join(lines) + '\n'
+
+def huge_dict(n_entries):
+    "A module that builds a dict literal of n_entries entries."
+    entries = ''.join("    'key%d': (%d, 'value%d'),\n" % (n, n, n) for n in range(n_entries))
+    return 'table = {\n' + entries + '}\n'
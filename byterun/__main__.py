@@ -3,7 +3,7 @@
 import argparse
 import logging
 
-from . import execfile
+from . import closures, execfile, interpreter, jit
 
 parser = argparse.ArgumentParser(
     prog="byterun",
@@ -17,6 +17,15 @@ parser.add_argument(
     '-v', '--verbose', dest='verbose', action='store_true',
     help="trace the execution of the bytecode.",
 )
+engines = parser.add_mutually_exclusive_group()
+engines.add_argument(
+    '--closures', dest='closures', action='store_true',
+    help="run with the closure-compiling engine instead of the interpreter.",
+)
+engines.add_argument(
+    '--jit', dest='jit', action='store_true',
+    help="compile hot code to Python source as the interpreter runs it.",
+)
 parser.add_argument(
     'prog',
     help="The program to run.",
@@ -35,5 +44,9 @@ else:
 level = logging.DEBUG if args.verbose else logging.WARNING
 logging.basicConfig(level=level)
 
+engine = closures if args.closures else interpreter
+if args.jit:
+    interpreter.jit = jit.compile_code
+
 argv = [args.prog] + args.args
-run_fn(args.prog, argv)
+run_fn(args.prog, argv, run_code=engine.run)
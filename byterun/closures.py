@@ -0,0 +1,637 @@
+"""
+Run code objects by compiling them to Python closures: an execution
+engine for byterun that can stand in for the instruction loop of
+interpreter.Frame.run, with the same interface:
+
+    from byterun import closures
+    closures.run(code, f_globals, f_locals)
+
+Each code object is translated once, when first run, into a closure
+per basic block, which runs the block's statements and returns the
+number of the block to run next. Within a block the value stack is
+simulated at translation time: an instruction pushing a value yields
+a closure computing it, with its operands resolved already, and an
+instruction consuming values takes those closures as its operands. So
+`x = a + b` becomes one statement calling the closures that load a and
+b, instead of four instructions passing values through a stack. A
+value goes into the frame's stack only to cross from one block to
+another (like a for loop's iterator), or to be computed before a
+statement runs, in the order the bytecode computes it.
+
+The frames are the interpreter's, for their variables and their value
+stack. Calls from one byterun function to another nest on the host's
+stack, so interpreter.tail_calls doesn't apply here.
+"""
+
+import builtins, dis
+from . import interpreter
+from .interpreter import Frame, VirtualMachineError, per_code, unbound
+
+def run(code, f_globals, f_locals):
+    if f_globals is None: f_globals = builtins.globals()
+    if f_locals is None:  f_locals = f_globals
+    if '__builtins__' not in f_globals:
+        f_globals['__builtins__'] = builtins.__dict__
+    return run_frame(code, None, f_globals, f_locals, [])
+
+def run_frame(code, f_closure, f_globals, namespace, fast):
+    frame = Frame(code, f_closure, f_globals, namespace, fast)
+    blocks = translate(code)
+    i = 0
+    while 0 <= i:
+        i = blocks[i](frame)
+    return frame.stack[0]       # Where a RETURN_VALUE leaves its value
+
+class Function(interpreter.Function):
+    "A byterun function whose calls from the host run in this engine."
+    __slots__ = []
+
+    def _run(self, namespace, fast):
+        return run_frame(self.__code__, self.__closure__, self.__globals__,
+                         namespace, fast)
+
+def call(func, args, kwargs):
+    "Call func, running it here if it's a byterun function."
+    if isinstance(func, interpreter.Function):
+        pass
+    elif isinstance(func, interpreter.Method) and isinstance(func.__func__, interpreter.Function):
+        args.insert(0, func.__self__)
+        func = func.__func__
+    else:
+        return func(*args, **kwargs)
+    return run_frame(func.__code__, func.__closure__, func.__globals__,
+                     None, func.bind(args, kwargs))
+
+no_kwargs = {}
+
+translations = {}               # id(code) -> (code, its list of block closures)
+
+def translate(code):
+    "Return code's blocks as closures, translated once and then cached."
+    return per_code(translations, code, translate_code)
+
+def translate_code(code):
+    instructions = interpreter.decode_instructions(code)
+    leaders = find_leaders(instructions)
+    numbers = dict(zip(leaders, range(len(leaders))))
+    blocks = [None] * len(leaders)
+    depths = {0: 0}             # Offset of a block -> its stack depth on entry
+    pending = [0]
+    while pending:
+        start = pending.pop()
+        translator = BlockTranslator(code, instructions, numbers, depths[start])
+        blocks[numbers[start]] = translator.translate(start)
+        for offset, depth in translator.successors:
+            if offset in depths:
+                assert depths[offset] == depth, "Inconsistent stack depth"
+            else:
+                depths[offset] = depth
+                pending.append(offset)
+    return blocks
+
+branches = set([dis.opmap[name] for name in [
+    'JUMP_FORWARD', 'JUMP_ABSOLUTE', 'POP_JUMP_IF_FALSE', 'POP_JUMP_IF_TRUE',
+    'JUMP_IF_FALSE_OR_POP', 'JUMP_IF_TRUE_OR_POP', 'FOR_ITER',
+    'RETURN_VALUE', 'RAISE_VARARGS']])
+
+def find_leaders(instructions):
+    "The sorted offsets of the instructions that start a basic block."
+    leaders = interpreter.jump_targets(instructions)
+    leaders.add(0)
+    for opcode, arguments, next_offset in filter(None, instructions):
+        if opcode in branches and next_offset < len(instructions):
+            leaders.add(next_offset)
+    return sorted(leaders)
+
+# At translation time, each entry of the simulated stack is a Value:
+# a closure computing it, and what it is: a constant, the contents of
+# a slot of the frame's value stack, or the result of an expression.
+
+class Value:
+    def __init__(self, fn, kind, payload):
+        self.fn = fn
+        self.kind = kind
+        self.payload = payload    # The constant, the slot, or an expression's parts
+
+def const_value(value):
+    return Value(lambda frame: value, 'const', value)
+
+def slot_value(i):
+    return Value(lambda frame: frame.stack[i], 'slot', i)
+
+def expr_value(fn):
+    return Value(fn, 'expr', None)
+
+class BlockTranslator:
+    """Translate one basic block, given its stack depth on entry. Its
+    successors are the (offset, stack depth) of each block it can go
+    to next."""
+
+    def __init__(self, code, instructions, numbers, depth):
+        self.code = code
+        self.instructions = instructions
+        self.numbers = numbers
+        self.stack = [slot_value(i) for i in range(depth)]
+        self.statements = []
+        self.exit = None        # A block number, or a closure returning one
+        self.successors = []
+
+    def translate(self, offset):
+        while self.exit is None:
+            opcode, arguments, self.next_offset = self.instructions[offset]
+            name = dis.opname[opcode]
+            method = getattr(self, 'op_' + name, None)
+            if method is None:
+                self.exit = unsupported(name)
+            else:
+                method(*arguments)
+            if self.exit is None and self.next_offset in self.numbers:
+                self.go_to(self.next_offset)
+            offset = self.next_offset
+        return make_block(self.statements, self.exit)
+
+    # The simulated stack.
+
+    def push(self, value):
+        self.stack.append(value)
+
+    def pop(self):
+        return self.stack.pop()
+
+    def popn(self, n):
+        values = self.stack[slice(len(self.stack) - n, None)]
+        self.stack = self.stack[slice(0, len(self.stack) - n)]
+        return values
+
+    def push_expr(self, fn):
+        self.push(expr_value(fn))
+
+    def emit(self, statement):
+        self.statements.append(statement)
+
+    def settled(self, i, leaving):
+        """Is the stack's entry i where the bytecode would have it, so
+        that nothing needs computing or storing before a statement (or,
+        if leaving, before leaving the block)?"""
+        value = self.stack[i]
+        return ((value.kind == 'slot' and value.payload == i)
+                or (value.kind == 'const' and not leaving))
+
+    def flush(self, leaving):
+        """Compute every unsettled entry of the stack, in order from the
+        bottom, and store them all in their slots."""
+        slots = [i for i in range(len(self.stack)) if not self.settled(i, leaving)]
+        if slots:
+            self.emit(store_slots(slots, [self.stack[i].fn for i in slots]))
+            for i in slots:
+                self.stack[i] = slot_value(i)
+
+    def operands(self, n, leaving):
+        """Pop the top n entries, for a statement (or an exit) to use,
+        after flushing the rest if they need it. (If so, the n are
+        flushed too, since they come after.)"""
+        below = len(self.stack) - n
+        if not all([self.settled(i, leaving) for i in range(below)]):
+            self.flush(leaving)
+        return self.popn(n)
+
+    # Leaving the block.
+
+    def go_to(self, offset):
+        self.flush(True)
+        self.exit = self.successor(offset, len(self.stack))
+
+    def successor(self, offset, depth):
+        self.successors.append((offset, depth))
+        return self.numbers[offset]
+
+    def op_JUMP_FORWARD(self, target):
+        self.go_to(target)
+
+    def op_JUMP_ABSOLUTE(self, target):
+        self.go_to(target)
+
+    def op_POP_JUMP_IF_FALSE(self, target):
+        self.exit = branch(self.condition(), self.next_block(), self.jump_block(target))
+
+    def op_POP_JUMP_IF_TRUE(self, target):
+        self.exit = branch(self.condition(), self.jump_block(target), self.next_block())
+
+    def condition(self):
+        [value] = self.operands(1, True)
+        return value
+
+    def next_block(self):
+        return self.successor(self.next_offset, len(self.stack))
+
+    def jump_block(self, target):
+        return self.successor(target, len(self.stack))
+
+    def op_JUMP_IF_FALSE_OR_POP(self, target):
+        self.flush(True)
+        i = len(self.stack) - 1
+        jump = self.jump_block(target)
+        self.pop()
+        self.exit = branch(slot_value(i), self.next_block(), jump)
+
+    def op_JUMP_IF_TRUE_OR_POP(self, target):
+        self.flush(True)
+        i = len(self.stack) - 1
+        jump = self.jump_block(target)
+        self.pop()
+        self.exit = branch(slot_value(i), jump, self.next_block())
+
+    def op_FOR_ITER(self, target):
+        self.flush(True)
+        i = len(self.stack) - 1
+        body = self.successor(self.next_offset, i + 2)
+        done = self.successor(target, i)
+        def exit(frame):
+            element = next(frame.stack[i], unbound)
+            if element is unbound:
+                return done
+            frame.stack[i+1] = element
+            return body
+        self.exit = exit
+
+    def op_RETURN_VALUE(self):
+        [value] = self.operands(1, False)
+        if value.kind == 'const':
+            constant = value.payload
+            def exit(frame):
+                frame.stack[0] = constant
+                return -1
+        else:
+            fn = value.fn
+            def exit(frame):
+                frame.stack[0] = fn(frame)
+                return -1
+        self.exit = exit
+
+    def op_RAISE_VARARGS(self, argc):
+        if argc != 1:
+            self.exit = unsupported('RAISE_VARARGS %d' % argc)
+        else:
+            [exception] = self.operands(1, False)
+            fn = exception.fn
+            def exit(frame):
+                raise fn(frame)
+            self.exit = exit
+
+    # Rearranging the stack.
+
+    def op_POP_TOP(self):
+        [value] = self.operands(1, False)
+        if value.kind == 'expr':
+            self.emit(value.fn)
+
+    def op_DUP_TOP(self):
+        self.flush(False)
+        self.push(self.copy(len(self.stack) - 1))
+
+    def op_DUP_TOP_TWO(self):
+        self.flush(False)
+        n = len(self.stack)
+        self.push(self.copy(n - 2))
+        self.push(self.copy(n - 1))
+
+    def copy(self, i):
+        "A copy of settled stack entry i."
+        value = self.stack[i]
+        return value if value.kind == 'const' else slot_value(i)
+
+    def op_ROT_TWO(self):
+        self.flush(False)
+        top, second = self.pop(), self.pop()
+        self.push(top)
+        self.push(second)
+
+    def op_ROT_THREE(self):
+        self.flush(False)
+        top, second, third = self.pop(), self.pop(), self.pop()
+        self.push(top)
+        self.push(third)
+        self.push(second)
+
+    def op_SETUP_LOOP(self, dest):
+        pass
+
+    def op_POP_BLOCK(self):
+        pass
+
+    # Loading.
+
+    def op_LOAD_CONST(self, const):
+        self.push(const_value(const))
+
+    def op_LOAD_FAST(self, i):
+        name = self.code.co_varnames[i]
+        def load_fast(frame):
+            value = frame.fast[i]
+            if value is unbound:
+                raise UnboundLocalError("local variable '%s' referenced before assignment"
+                                        % name)
+            return value
+        self.push_expr(load_fast)
+
+    def op_LOAD_DEREF(self, i):
+        self.push_expr(lambda frame: frame.cells[i].contents)
+
+    def op_LOAD_CLOSURE(self, i):
+        self.push_expr(lambda frame: frame.cells[i])
+
+    def op_LOAD_GLOBAL(self, name):
+        def load_global(frame):
+            if name in frame.f_globals:  return frame.f_globals[name]
+            if name in frame.f_builtins: return frame.f_builtins[name]
+            raise NameError("name '%s' is not defined" % name)
+        self.push_expr(load_global)
+
+    def op_LOAD_NAME(self, name):
+        def load_name(frame):
+            if name in frame.namespace:  return frame.namespace[name]
+            if name in frame.f_globals:  return frame.f_globals[name]
+            if name in frame.f_builtins: return frame.f_builtins[name]
+            raise NameError("name '%s' is not defined" % name)
+        self.push_expr(load_name)
+
+    def op_LOAD_ATTR(self, attr):
+        obj = self.pop().fn
+        self.push_expr(lambda frame: getattr(obj(frame), attr))
+
+    def op_LOAD_BUILD_CLASS(self):
+        self.push(const_value(interpreter.build_class))
+
+    # Computing.
+
+    def unary(self, fn):
+        operand = self.pop().fn
+        self.push_expr(lambda frame: fn(operand(frame)))
+
+    def binary(self, fn):
+        left, right = self.popn(2)
+        left = left.fn
+        if right.kind == 'const':
+            constant = right.payload
+            self.push_expr(lambda frame: fn(left(frame), constant))
+        else:
+            right = right.fn
+            self.push_expr(lambda frame: fn(left(frame), right(frame)))
+
+    def op_COMPARE_OP(self, compare):
+        left, right = self.popn(2)
+        self.push(Value(compare_fn(compare, left.fn, right.fn), 'expr', None))
+
+    def op_GET_ITER(self):
+        operand = self.pop().fn
+        self.push_expr(lambda frame: iter(operand(frame)))
+
+    def op_BUILD_TUPLE(self, count):
+        items = [value.fn for value in self.popn(count)]
+        self.push_expr(lambda frame: tuple([item(frame) for item in items]))
+
+    def op_BUILD_LIST(self, count):
+        items = [value.fn for value in self.popn(count)]
+        self.push_expr(lambda frame: [item(frame) for item in items])
+
+    def op_BUILD_MAP(self, size):
+        self.push_expr(lambda frame: {})
+
+    def op_STORE_MAP(self):
+        mapping, value, key = [value.fn for value in self.popn(3)]
+        def store_map(frame):
+            result = mapping(frame)
+            v = value(frame)
+            result[key(frame)] = v
+            return result
+        self.push_expr(store_map)
+
+    def op_MAKE_FUNCTION(self, argc):
+        parts = [value.fn for value in self.popn(argc + 2)]
+        def make_function(frame):
+            values = [part(frame) for part in parts]
+            defaults, code, name = values[slice(0, argc)], values[argc], values[argc+1]
+            return Function(name, code, frame.f_globals, defaults, None)
+        self.push_expr(make_function)
+
+    def op_MAKE_CLOSURE(self, argc):
+        parts = [value.fn for value in self.popn(argc + 3)]
+        def make_closure(frame):
+            values = [part(frame) for part in parts]
+            defaults = values[slice(0, argc)]
+            closure, code, name = values[argc], values[argc+1], values[argc+2]
+            return Function(name, code, frame.f_globals, defaults, closure)
+        self.push_expr(make_closure)
+
+    def op_CALL_FUNCTION(self, arg):
+        self.call(arg, False, False)
+
+    def op_CALL_FUNCTION_VAR(self, arg):
+        self.call(arg, True, False)
+
+    def op_CALL_FUNCTION_KW(self, arg):
+        self.call(arg, False, True)
+
+    def op_CALL_FUNCTION_VAR_KW(self, arg):
+        self.call(arg, True, True)
+
+    def call(self, arg, has_varargs, has_kwargs):
+        len_kw, len_pos = divmod(arg, 256)
+        n = 1 + len_pos + 2*len_kw + has_varargs + has_kwargs
+        parts = [value.fn for value in self.popn(n)]
+        if n == 1 + len_pos:
+            self.push_expr(positional_call(parts[0], parts[slice(1, None)]))
+        else:
+            self.push_expr(general_call(parts, len_pos, len_kw, has_varargs, has_kwargs))
+
+    def op_IMPORT_NAME(self, name):
+        level, fromlist = [value.fn for value in self.popn(2)]
+        def import_name(frame):
+            level_value, fromlist_value = level(frame), fromlist(frame)
+            return __import__(name, frame.f_globals, frame.f_locals,
+                              fromlist_value, level_value)
+        self.push_expr(import_name)
+
+    def op_IMPORT_FROM(self, name):
+        self.flush(False)
+        module = self.copy(len(self.stack) - 1).fn
+        self.push_expr(lambda frame: getattr(module(frame), name))
+
+    # Storing.
+
+    def op_STORE_FAST(self, i):
+        [value] = self.operands(1, False)
+        if value.kind == 'const':
+            constant = value.payload
+            def store_fast(frame):
+                frame.fast[i] = constant
+        else:
+            fn = value.fn
+            def store_fast(frame):
+                frame.fast[i] = fn(frame)
+        self.emit(store_fast)
+
+    def op_STORE_DEREF(self, i):
+        [value] = self.operands(1, False)
+        fn = value.fn
+        def store_deref(frame):
+            frame.cells[i].contents = fn(frame)
+        self.emit(store_deref)
+
+    def op_STORE_NAME(self, name):
+        [value] = self.operands(1, False)
+        fn = value.fn
+        def store_name(frame):
+            frame.namespace[name] = fn(frame)
+        self.emit(store_name)
+
+    def op_STORE_GLOBAL(self, name):
+        [value] = self.operands(1, False)
+        fn = value.fn
+        def store_global(frame):
+            frame.f_globals[name] = fn(frame)
+        self.emit(store_global)
+
+    def op_STORE_ATTR(self, attr):
+        value, obj = [value.fn for value in self.operands(2, False)]
+        def store_attr(frame):
+            v = value(frame)
+            setattr(obj(frame), attr, v)
+        self.emit(store_attr)
+
+    def op_STORE_SUBSCR(self):
+        value, obj, key = [value.fn for value in self.operands(3, False)]
+        def store_subscr(frame):
+            v = value(frame)
+            o = obj(frame)
+            o[key(frame)] = v
+        self.emit(store_subscr)
+
+    def op_LIST_APPEND(self, count):
+        [value] = self.operands(1, False)
+        fn, target = value.fn, self.stack[len(self.stack) - count].fn
+        self.emit(lambda frame: target(frame).append(fn(frame)))
+
+    def op_UNPACK_SEQUENCE(self, count):
+        [value] = self.operands(1, False)
+        fn, start = value.fn, len(self.stack)
+        def unpack_sequence(frame):
+            frame.stack[slice(start, start + count)] = interpreter.unpacked(fn(frame), count)
+        self.emit(unpack_sequence)
+        for i in range(start, start + count):
+            self.push(slot_value(i))
+
+def make_operators():
+    "Return a dict from the name of each operator instruction to its function."
+    operators = {}
+    for prefix, table, make in interpreter.operator_handlers:
+        for name, fn in table.items():
+            operators[prefix + name] = fn
+    return operators
+
+def make_operator_methods():
+    for name, fn in make_operators().items():
+        method = 'unary' if name.startswith('UNARY_') else 'binary'
+        setattr(BlockTranslator, 'op_' + name, operator_method(method, fn))
+
+def operator_method(method, fn):
+    return lambda translator: getattr(translator, method)(fn)
+
+make_operator_methods()
+
+# Closures the translation builds from others.
+
+def store_slots(slots, fns):
+    "A statement computing fns, in order, then storing them in those slots."
+    if len(slots) == 1:
+        [i], [fn] = slots, fns
+        def store_slot(frame):
+            frame.stack[i] = fn(frame)
+        return store_slot
+    def store_slots(frame):
+        values = [fn(frame) for fn in fns]
+        stack = frame.stack
+        for i, value in zip(slots, values):
+            stack[i] = value
+    return store_slots
+
+def compare_fn(compare, left, right):
+    return lambda frame: compare(left(frame), right(frame))
+
+def branch(condition, if_true, if_false):
+    "An exit going to block if_true or if_false by the value of condition."
+    fn = condition.fn
+    return lambda frame: if_true if fn(frame) else if_false
+
+def positional_call(func, args):
+    if len(args) == 0:
+        return lambda frame: call(func(frame), [], no_kwargs)
+    if len(args) == 1:
+        [arg0] = args
+        def call1(frame):
+            f = func(frame)
+            return call(f, [arg0(frame)], no_kwargs)
+        return call1
+    if len(args) == 2:
+        arg0, arg1 = args
+        def call2(frame):
+            f = func(frame)
+            a0 = arg0(frame)
+            return call(f, [a0, arg1(frame)], no_kwargs)
+        return call2
+    def call_n(frame):
+        f = func(frame)
+        return call(f, [arg(frame) for arg in args], no_kwargs)
+    return call_n
+
+def general_call(parts, len_pos, len_kw, has_varargs, has_kwargs):
+    def call_general(frame):
+        values = [part(frame) for part in parts]
+        args = values[slice(1, 1 + len_pos)]
+        kwargs = {}
+        i = 1 + len_pos
+        while i < 1 + len_pos + 2*len_kw:
+            kwargs[values[i]] = values[i+1]
+            i = i + 2
+        if has_varargs:
+            args.extend(values[i])
+            i = i + 1
+        if has_kwargs:
+            kwargs.update(values[i])
+        return call(values[0], args, kwargs)
+    return call_general
+
+def unsupported(name):
+    def exit(frame):
+        raise VirtualMachineError("Unsupported opcode: %s" % name)
+    return exit
+
+def make_block(statements, exit):
+    """A closure running the statements and then returning the number of
+    the next block to run (or -1 to return): exit, if that's a number,
+    or else what exit returns."""
+    if isinstance(exit, int):
+        exit = constant_exit(exit)
+    if len(statements) == 0:
+        return exit
+    if len(statements) == 1:
+        [s0] = statements
+        def block1(frame):
+            s0(frame)
+            return exit(frame)
+        return block1
+    if len(statements) == 2:
+        s0, s1 = statements
+        def block2(frame):
+            s0(frame)
+            s1(frame)
+            return exit(frame)
+        return block2
+    def block(frame):
+        for statement in statements:
+            statement(frame)
+        return exit(frame)
+    return block
+
+def constant_exit(n):
+    return lambda frame: n
@@ -13,12 +13,13 @@ from .interpreter import run
 open_source = tokenize.open
 NoSource = Exception
 
-def run_python_module(modulename, args):
+def run_python_module(modulename, args, run_code=run):
     """Run a python module, as though with ``python -m name args...``.
 
     `modulename` is the name of the module, possibly a dot-separated name.
     `args` is the argument array to present as sys.argv, including the first
-    element naming the module being executed.
+    element naming the module being executed.  `run_code` is the engine's
+    run function (see run_python_file).
 
     """
     openfile = None
@@ -59,16 +60,17 @@ def run_python_module(modulename, args):
 
     # Finally, hand the file off to run_python_file for execution.
     args[0] = pathname
-    run_python_file(pathname, args, package=packagename)
+    run_python_file(pathname, args, package=packagename, run_code=run_code)
 
 
-def run_python_file(filename, args, package=None):
+def run_python_file(filename, args, package=None, run_code=run):
     """Run a python file as if it were the main program on the command line.
 
     `filename` is the path to the file to execute, it need not be a .py file.
     `args` is the argument array to present as sys.argv, including the first
     element naming the file being executed.  `package` is the name of the
-    enclosing package, if any.
+    enclosing package, if any.  `run_code` runs the compiled code: the
+    interpreter's run, by default, or byterun.closures.run.
 
     """
     try:
@@ -98,7 +100,7 @@ def run_python_file(filename, args, package=None):
 
     try:
         code = compile(source, filename, "exec")
-        run(code, main_mod.__dict__, None)
+        run_code(code, main_mod.__dict__, None)
     finally:
         # Restore the old __main__
         sys.modules['__main__'] = old_main_mod
@@ -4,10 +4,35 @@
 
 import builtins, dis, operator, types
 
+# Set this true to have a byterun function's tail calls to other byterun
+# functions take constant space: the callee's frame replaces the
+# caller's, instead of returning to it.
+tail_calls = False
+
+# Set this false to run every instruction the generic way. When true,
+# a call site specializes itself to the kind of callee it meets, once
+# it has run `warmup` times; when a specialized call meets some other
+# kind, it goes back to adapting, for `cooldown` more runs.
+adaptive = True
+warmup   = 8
+cooldown = 64
+
+# Set this to a compiler of code objects, like byterun.jit.compile_code,
+# to have code run compiled once it's hot: once it's been called, or
+# has looped back, `hot` times in all. The compiler returns a function
+# running the code, or None if it can't compile it, and then the code
+# stays interpreted. (Set it before running the code: code decoded
+# without it doesn't count its loops.)
+jit = None
+hot = 1000
+
+RETURN_VALUE  = dis.opmap['RETURN_VALUE']
+JUMP_ABSOLUTE = dis.opmap['JUMP_ABSOLUTE']
+
 class Function:
     __slots__ = [
         '__name__', '__code__', '__globals__', '__defaults__', '__closure__',
-        '__dict__', '__doc__',
+        '__dict__', '__doc__', '_plan', '_heat',
     ]
 
     def __init__(self, name, code, globs, defaults, closure):
@@ -18,6 +43,8 @@ class Function:
         self.__closure__ = closure
         self.__dict__ = {}
         self.__doc__ = code.co_consts[0] if code.co_consts else None
+        self._plan = per_code(binding_plans, code, BindingPlan)
+        self._heat = per_code(heats, code, Heat)
 
     def __repr__(self):         # pragma: no cover
         return '<Function %s at 0x%08x>' % (self.__name__, id(self))
@@ -26,40 +53,71 @@ class Function:
         return self if instance is None else Method(instance, owner, self)
 
     def __call__(self, *args, **kwargs):
-        code      = self.__code__
-        argc      = code.co_argcount
-        varargs   = 0 != (code.co_flags & 0x04)
-        varkws    = 0 != (code.co_flags & 0x08)
-        params    = code.co_varnames[slice(0, argc+varargs+varkws)]
-
-        defaults  = self.__defaults__
-        nrequired = -len(defaults) if defaults else argc
-
-        f_locals = dict(zip(params[slice(nrequired, None)], defaults))
-        f_locals.update(dict(zip(params, args)))
-        if varargs:
-            f_locals[params[argc]] = args[slice(argc, None)]
+        return self._run(None, self.bind(args, kwargs))
+
+    def _run(self, namespace, fast):
+        "Run my code in a new frame, with this namespace and fast locals."
+        return run_frame(self.__code__, self.__closure__, self.__globals__,
+                         namespace, fast)
+
+    def bind(self, args, kwargs):
+        """Return the fast locals of a call to self with these arguments:
+        a list indexed like co_varnames."""
+        plan = self._plan
+        if len(args) == plan.argc and plan.plain and not kwargs:
+            return list(args) + plan.padding
+        return plan.bind(self, args, kwargs)
+
+binding_plans = {}              # id(code) -> (code, its BindingPlan)
+
+class BindingPlan:
+    "What a code object's parameters are, worked out once for every call."
+
+    def __init__(self, code):
+        self.argc    = code.co_argcount
+        self.varargs = 0 != (code.co_flags & 0x04)
+        self.varkws  = 0 != (code.co_flags & 0x08)
+        self.plain   = not (self.varargs or self.varkws)
+        self.nlocals = code.co_nlocals
+        self.padding = [unbound] * (self.nlocals - self.argc)
+        params = code.co_varnames[slice(0, self.argc)]
+        self.params  = params
+        self.index   = dict(zip(params, range(self.argc)))
+
+    def bind(self, fn, args, kwargs):
+        "Bind the arguments of any call, the general way."
+        argc      = self.argc
+        defaults  = fn.__defaults__
+        nrequired = argc - len(defaults)
+
+        fast = [unbound] * self.nlocals
+        fast[slice(nrequired, argc)] = defaults
+        npositional = min(argc, len(args))
+        fast[slice(0, npositional)] = args[slice(0, npositional)]
+        if self.varargs:
+            fast[argc] = tuple(args[slice(argc, None)])
         elif argc < len(args):
             raise TypeError("%s() takes up to %d positional argument(s) but got %d"
-                            % (self.__name__, argc, len(args)))
-        if varkws:
-            f_locals[params[-1]] = varkw_dict = {}
+                            % (fn.__name__, argc, len(args)))
+        if self.varkws:
+            fast[argc + self.varargs] = varkw_dict = {}
         for kw, value in kwargs.items():
-            if kw in params:
-                f_locals[kw] = value
-            elif varkws:
+            i = self.index.get(kw)
+            if i is not None:
+                fast[i] = value
+            elif self.varkws:
                 varkw_dict[kw] = value
             else:
                 raise TypeError("%s() got an unexpected keyword argument %r"
-                                % (self.__name__, kw))
-        missing = [v for v in params[slice(0, nrequired)] if v not in f_locals]
-        if missing:
-            raise TypeError("%s() missing %d required positional argument%s: %s"
-                            % (code.co_name,
-                               len(missing), 's' if 1 < len(missing) else '',
-                               ', '.join(map(repr, missing))))
-
-        return run_frame(code, self.__closure__, self.__globals__, f_locals)
+                                % (fn.__name__, kw))
+        if npositional < nrequired:
+            missing = [self.params[i] for i in range(nrequired) if fast[i] is unbound]
+            if missing:
+                raise TypeError("%s() missing %d required positional argument%s: %s"
+                                % (fn.__code__.co_name,
+                                   len(missing), 's' if 1 < len(missing) else '',
+                                   ', '.join(map(repr, missing))))
+        return fast
 
 class Method:
     def __init__(self, obj, _class, func):
@@ -78,6 +136,34 @@ class Cell:
     def __init__(self, value):
         self.contents = value
 
+def make_cells(code, f_closure, fast):
+    """The cells of a frame running code: its cell variables', then its
+    closure's; or None if it has neither."""
+    if not (code.co_cellvars or code.co_freevars):
+        return None
+    cells = [Cell(initial_cell_value(code, fast, var)) for var in code.co_cellvars]
+    if code.co_freevars:
+        assert len(code.co_freevars) == len(f_closure)
+        cells.extend(f_closure)
+    return cells
+
+def initial_cell_value(code, fast, var):
+    "A cell for a parameter starts with the argument."
+    if var in code.co_varnames:
+        return fast[code.co_varnames.index(var)]
+    return None
+
+def builtins_of(f_globals):
+    "The builtins dict that code running with these globals sees."
+    f_builtins = f_globals.get('__builtins__')
+    if isinstance(f_builtins, types.ModuleType):
+        return f_builtins.__dict__
+    if f_builtins is None:
+        return {'None': None}
+    return f_builtins
+
+unbound = object()        # The value of a fast local not yet assigned
+
 class VirtualMachineError(Exception):
     "For raising errors in the operation of the VM."
 
@@ -86,147 +172,207 @@ def run(code, f_globals, f_locals):
     if f_locals is None:  f_locals = f_globals
     if '__builtins__' not in f_globals:
         f_globals['__builtins__'] = builtins.__dict__
-    return run_frame(code, None, f_globals, f_locals)
-
-def run_frame(code, f_closure, f_globals, f_locals):
-    return Frame(code, f_closure, f_globals, f_locals).run()
+    return run_frame(code, None, f_globals, f_locals, [])
+
+def run_frame(code, f_closure, f_globals, namespace, fast):
+    if jit is not None:
+        compiled = hot_compiled(per_code(heats, code, Heat), code)
+        if compiled:
+            value = compiled(fast, f_closure, f_globals, namespace, None)
+            if value.__class__ is not Deoptimized:
+                return value
+            frame = Frame(code, f_closure, f_globals, namespace, fast)
+            frame.resume(value)
+            return frame.run()
+    return Frame(code, f_closure, f_globals, namespace, fast).run()
+
+heats = {}                      # id(code) -> (code, its Heat)
+
+class Heat:
+    """How many times a code object has been called or looped back, and,
+    once that reaches `hot`, its compiled function (or False, if jit
+    couldn't compile it)."""
+
+    def __init__(self, code):
+        self.count = 0
+        self.compiled = None
+
+def hot_compiled(heat, code):
+    """Count a run of code (a call, or a loop back) towards its getting
+    hot; return its compiled function if it's hot and compiles, else a
+    false value."""
+    compiled = heat.compiled
+    if compiled is None:
+        heat.count = heat.count + 1
+        if heat.count < hot:
+            return None
+        compiled = jit(code) or False
+        heat.compiled = compiled
+    return compiled
+
+class Deoptimized:
+    """What compiled code returns when it can't go on, for the
+    interpreter to go on instead: the offset of the instruction to go
+    on from, the values on the stack, and the cells. (The compiled code
+    has stored its variables back into the fast locals.)"""
+
+    def __init__(self, offset, stack, cells):
+        self.offset = offset
+        self.stack = stack
+        self.cells = cells
 
 class Frame:
-    def __init__(self, f_code, f_closure, f_globals, f_locals):
+    """A running code object. A function's variables are in self.fast,
+    indexed like co_varnames, and self.cells, indexed like co_cellvars
+    then co_freevars; a module or class body's are in self.namespace."""
+
+    def __init__(self, f_code, f_closure, f_globals, namespace, fast):
         self.f_code = f_code
         self.f_globals = f_globals
-        self.f_locals = f_locals
+        self.namespace = namespace
+        self.fast = fast
 
-        self.f_builtins = f_globals.get('__builtins__')
-        if isinstance(self.f_builtins, types.ModuleType):
-            self.f_builtins = self.f_builtins.__dict__
-        if self.f_builtins is None:
-            self.f_builtins = {'None': None}
+        self.f_builtins = builtins_of(f_globals)
 
-        self.stack = []
+        self.stack = [None] * f_code.co_stacksize
+        self.sp = 0             # The stack's height: its values are stack[0:sp].
+        self.f_back = None      # The calling frame to return to, if run by the same loop
+        self.instructions = decode(f_code)
 
         self.f_lineno = f_code.co_firstlineno # XXX doesn't get updated
         self.f_lasti = 0
 
-        self.cells = {} if f_code.co_cellvars or f_code.co_freevars else None
-        for var in f_code.co_cellvars:
-            self.cells[var] = Cell(self.f_locals.get(var))
-        if f_code.co_freevars:
-            assert len(f_code.co_freevars) == len(f_closure)
-            self.cells.update(zip(f_code.co_freevars, f_closure))
+        self.cells = make_cells(f_code, f_closure, fast)
+
+    @property
+    def f_locals(self):
+        "The local variables as a dict: for a function's, a fresh snapshot."
+        if self.namespace is not None:
+            return self.namespace
+        f_locals = dict([(name, value)
+                         for name, value in zip(self.f_code.co_varnames, self.fast)
+                         if value is not unbound])
+        if self.cells:
+            names = self.f_code.co_cellvars + self.f_code.co_freevars
+            f_locals.update(zip(names, [cell.contents for cell in self.cells]))
+        return f_locals
 
     def __repr__(self):         # pragma: no cover
         return ('<Frame at 0x%08x: %r @ %d>'
                 % (id(self), self.f_code.co_filename, self.f_lineno))
 
     def run(self):
+        """Run this frame until it returns, along with the frames of the
+        byterun functions it calls, all in this one loop."""
+        frame = self
+        instructions = frame.instructions
         while True:
-            byte_name, arguments = self.parse_byte_and_args()
-            outcome = self.dispatch(byte_name, arguments)
+            opcode, arguments, frame.f_lasti = instructions[frame.f_lasti]
+            outcome = handlers[opcode](frame, *arguments)
             if outcome:
-                assert outcome == 'return'
-                return self.pop()
-
-    def parse_byte_and_args(self):
-        code = self.f_code
-        opcode = code.co_code[self.f_lasti]
-        self.f_lasti = self.f_lasti + 1
-        if opcode >= dis.HAVE_ARGUMENT:
-            int_arg = (   code.co_code[self.f_lasti]
-                       + (code.co_code[self.f_lasti+1] << 8))
-            self.f_lasti = self.f_lasti + 2
-            if opcode in dis.hasconst:
-                arg = code.co_consts[int_arg]
-            elif opcode in dis.hasfree:
-                if int_arg < len(code.co_cellvars):
-                    arg = code.co_cellvars[int_arg]
+                if outcome == 'return':
+                    value = frame.pop()
+                    frame = frame.f_back
+                    if frame is None:
+                        return value
+                    frame.push(value)
                 else:
-                    arg = code.co_freevars[int_arg - len(code.co_cellvars)]
-            elif opcode in dis.hasname:
-                arg = code.co_names[int_arg]
-            elif opcode in dis.haslocal:
-                arg = code.co_varnames[int_arg]
-            elif opcode in dis.hasjrel:
-                arg = self.f_lasti + int_arg
-            else:
-                arg = int_arg
-            return dis.opname[opcode], (arg,)
-        return dis.opname[opcode], ()
-
-    def dispatch(self, byte_name, arguments):
-        if byte_name.startswith('UNARY_'):
-            self.unary_operator(byte_name.replace('UNARY_', '', 1))
-        elif byte_name.startswith('BINARY_'):
-            self.binary_operator(byte_name.replace('BINARY_', '', 1))
-        else:
-            return getattr(self, 'byte_%s' % byte_name)(*arguments)
+                    frame = outcome     # A frame called by this one
+                instructions = frame.instructions
 
     def top(self):
-        return self.stack[-1]
+        return self.stack[self.sp - 1]
 
     def push(self, val):
-        self.stack.append(val)
+        self.stack[self.sp] = val
+        self.sp = self.sp + 1
 
     def pop(self):
-        return self.stack.pop()
+        self.sp = self.sp - 1
+        return self.stack[self.sp]
 
     def popn(self, n):
-        vals = [self.stack.pop() for _ in range(n)]
-        vals.reverse()
+        sp = self.sp - n
+        vals = self.stack[slice(sp, self.sp)]
+        self.sp = sp
         return vals
 
     def jump(self, jump):
         self.f_lasti = jump
 
+    def resume(self, deoptimized):
+        "Go on from where compiled code running this frame left off."
+        values = deoptimized.stack
+        self.stack[slice(0, len(values))] = values
+        self.sp = len(values)
+        if deoptimized.cells is not None:
+            self.cells = deoptimized.cells
+        self.f_lasti = deoptimized.offset
+
     def byte_POP_TOP(self):
         self.pop()
 
     def byte_DUP_TOP(self):
         self.push(self.top())
 
+    def byte_DUP_TOP_TWO(self):
+        stack, sp = self.stack, self.sp
+        stack[sp], stack[sp+1] = stack[sp-2], stack[sp-1]
+        self.sp = sp + 2
+
+    def byte_ROT_TWO(self):
+        stack, sp = self.stack, self.sp
+        stack[sp-2], stack[sp-1] = stack[sp-1], stack[sp-2]
+
+    def byte_ROT_THREE(self):
+        stack, sp = self.stack, self.sp
+        stack[sp-3], stack[sp-2], stack[sp-1] = stack[sp-1], stack[sp-3], stack[sp-2]
+
     def byte_LOAD_CONST(self, const):
         self.push(const)
 
-    def byte_LOAD_GLOBAL(self, name): # XXX not used by the compiler; just for comparison runs
+    def byte_LOAD_GLOBAL(self, name):
         if   name in self.f_globals:  val = self.f_globals[name]
         elif name in self.f_builtins: val = self.f_builtins[name]
         else: raise NameError("name '%s' is not defined" % name)
         self.push(val)
 
+    def byte_STORE_GLOBAL(self, name):
+        self.f_globals[name] = self.pop()
+
     def byte_LOAD_NAME(self, name):
-        if   name in self.f_locals:   val = self.f_locals[name]
+        if   name in self.namespace:  val = self.namespace[name]
         elif name in self.f_globals:  val = self.f_globals[name]
         elif name in self.f_builtins: val = self.f_builtins[name]
         else: raise NameError("name '%s' is not defined" % name)
         self.push(val)
 
     def byte_STORE_NAME(self, name):
-        self.f_locals[name] = self.pop()
+        self.namespace[name] = self.pop()
+
+    def byte_LOAD_FAST(self, i):
+        val = self.fast[i]
+        if val is unbound: self.unbound_local(i)
+        self.push(val)
 
-    def byte_LOAD_FAST(self, name):
-        if name not in self.f_locals:
-            raise UnboundLocalError(
-                "local variable '%s' referenced before assignment" % name)
-        self.push(self.f_locals[name])
+    def unbound_local(self, i):
+        raise UnboundLocalError("local variable '%s' referenced before assignment"
+                                % self.f_code.co_varnames[i])
 
-    def byte_STORE_FAST(self, name):
-        self.f_locals[name] = self.pop()
+    def byte_STORE_FAST(self, i):
+        self.fast[i] = self.pop()
 
-    def byte_LOAD_DEREF(self, name):
-        self.push(self.cells[name].contents)
+    def byte_LOAD_DEREF(self, i):
+        self.push(self.cells[i].contents)
 
-    def byte_STORE_DEREF(self, name):
-        self.cells[name].contents = self.pop()
+    def byte_STORE_DEREF(self, i):
+        self.cells[i].contents = self.pop()
 
     UNARY_OPERATORS = {
         'POSITIVE': operator.pos,   'NOT':    operator.not_,
         'NEGATIVE': operator.neg,   'INVERT': operator.invert,
     }
 
-    def unary_operator(self, op):
-        x = self.pop()
-        self.push(self.UNARY_OPERATORS[op](x))
-
     BINARY_OPERATORS = {
         'POWER':    pow,             'ADD':      operator.add,
         'LSHIFT':   operator.lshift, 'SUBTRACT': operator.sub,
@@ -237,9 +383,14 @@ class Frame:
         'SUBSCR':   operator.getitem,
     }
 
-    def binary_operator(self, op):
-        x, y = self.popn(2)
-        self.push(self.BINARY_OPERATORS[op](x, y))
+    INPLACE_OPERATORS = {
+        'POWER':    operator.ipow,    'ADD':      operator.iadd,
+        'LSHIFT':   operator.ilshift, 'SUBTRACT': operator.isub,
+        'RSHIFT':   operator.irshift, 'MULTIPLY': operator.imul,
+        'OR':       operator.ior,     'MODULO':   operator.imod,
+        'AND':      operator.iand,    'TRUE_DIVIDE': operator.itruediv,
+        'XOR':      operator.ixor,    'FLOOR_DIVIDE': operator.ifloordiv,
+    }
 
     COMPARE_OPERATORS = [
         operator.lt,
@@ -255,22 +406,24 @@ class Frame:
         lambda x, y: issubclass(x, Exception) and issubclass(x, y),
     ]
 
-    def byte_COMPARE_OP(self, opnum):
-        x, y = self.popn(2)
-        self.push(self.COMPARE_OPERATORS[opnum](x, y))
+    def byte_COMPARE_OP(self, compare):
+        stack, sp = self.stack, self.sp - 1
+        stack[sp-1] = compare(stack[sp-1], stack[sp])
+        self.sp = sp
 
     def byte_LOAD_ATTR(self, attr):
-        obj = self.pop()
-        val = getattr(obj, attr)
-        self.push(val)
+        stack, sp = self.stack, self.sp
+        stack[sp-1] = getattr(stack[sp-1], attr)
 
     def byte_STORE_ATTR(self, name):
-        val, obj = self.popn(2)
-        setattr(obj, name, val)
+        stack, sp = self.stack, self.sp - 2
+        setattr(stack[sp+1], name, stack[sp])
+        self.sp = sp
 
     def byte_STORE_SUBSCR(self):
-        val, obj, subscr = self.popn(3)
-        obj[subscr] = val
+        stack, sp = self.stack, self.sp - 3
+        stack[sp+1][stack[sp+2]] = stack[sp]
+        self.sp = sp
 
     def byte_BUILD_TUPLE(self, count):
         self.push(tuple(self.popn(count)))
@@ -282,18 +435,20 @@ class Frame:
         self.push({})
 
     def byte_STORE_MAP(self):
-        the_map, val, key = self.popn(3)
-        the_map[key] = val
-        self.push(the_map)
+        stack, sp = self.stack, self.sp - 2
+        stack[sp-1][stack[sp+1]] = stack[sp]
+        self.sp = sp
 
     def byte_UNPACK_SEQUENCE(self, count):
-        seq = self.pop()
-        for x in reversed(seq):
-            self.push(x)
+        self.unpack(self.pop(), count)
+
+    def unpack(self, seq, count):
+        self.stack[slice(self.sp, self.sp + count)] = unpacked(seq, count)
+        self.sp = self.sp + count
 
     def byte_LIST_APPEND(self, count):
         val = self.pop()
-        self.stack[-count].append(val)
+        self.stack[self.sp - count].append(val)
 
     def byte_JUMP_FORWARD(self, jump):
         self.jump(jump)
@@ -301,7 +456,23 @@ class Frame:
     def byte_JUMP_ABSOLUTE(self, jump):
         self.jump(jump)
 
-    def byte_POP_JUMP_IF_TRUE(self, jump): # XXX not emitted by the compiler
+    def back_edge(self, heat, jump):
+        """A JUMP_ABSOLUTE back to the start of a loop, when jit is set.
+        Once the code is hot, the rest of this run of it goes compiled,
+        from the loop's start on."""
+        self.jump(jump)
+        if jit is not None:
+            compiled = hot_compiled(heat, self.f_code)
+            if compiled:
+                value = compiled(self.fast, None, self.f_globals, self.namespace, self)
+                if value.__class__ is Deoptimized:
+                    self.resume(value)
+                    return None
+                self.stack[0] = value
+                self.sp = 1
+                return 'return'
+
+    def byte_POP_JUMP_IF_TRUE(self, jump):
         val = self.pop()
         if val:
             self.jump(jump)
@@ -351,8 +522,8 @@ class Frame:
         defaults = self.popn(argc)
         self.push(Function(name, code, self.f_globals, defaults, None))
 
-    def byte_LOAD_CLOSURE(self, name):
-        self.push(self.cells[name])
+    def byte_LOAD_CLOSURE(self, i):
+        self.push(self.cells[i])
 
     def byte_MAKE_CLOSURE(self, argc):
         name = self.pop()
@@ -378,12 +549,119 @@ class Frame:
 
     def call_function(self, oparg, varargs, kwargs):
         len_kw, len_pos = divmod(oparg, 256)
-        namedargs = dict([self.popn(2) for i in range(len_kw)])
-        namedargs.update(kwargs)
+        namedargs = kwargs
+        if len_kw:
+            namedargs = dict([self.popn(2) for i in range(len_kw)])
+            namedargs.update(kwargs)
         posargs = self.popn(len_pos)
-        posargs.extend(varargs)
+        if varargs:
+            posargs.extend(varargs)
         func = self.pop()
-        self.push(func(*posargs, **namedargs))
+        if not isinstance(func, Function):
+            if isinstance(func, Method) and isinstance(func.__func__, Function):
+                posargs.insert(0, func.__self__)
+                func = func.__func__
+            else:
+                self.push(func(*posargs, **namedargs))
+                return None
+        return self.call_frame(func, func.bind(posargs, namedargs))
+
+    def call_frame(self, func, fast):
+        """Return a frame to run func with these fast locals, for run to
+        switch to; or, if func runs compiled to the end, push its value
+        and return None."""
+        deoptimized = None
+        if jit is not None:
+            compiled = hot_compiled(func._heat, func.__code__)
+            if compiled:
+                value = compiled(fast, func.__closure__, func.__globals__, None, None)
+                if value.__class__ is not Deoptimized:
+                    self.push(value)
+                    return None
+                deoptimized = value
+        frame = Frame(func.__code__, func.__closure__, func.__globals__, None, fast)
+        if deoptimized is not None:
+            frame.resume(deoptimized)
+        if tail_calls and self.f_code.co_code[self.f_lasti] == RETURN_VALUE:
+            frame.f_back = self.f_back
+        else:
+            frame.f_back = self
+        return frame
+
+    # Adaptive call sites. A CALL_FUNCTION, alone or at the end of a
+    # superinstruction, starts out as its ADAPTIVE variant, which counts
+    # down its runs and then rewrites the instruction, in the decoded
+    # code, to the variant for the kind of callee on top of the stack:
+    #   EXACT_ARGS         a byterun function taking just that many arguments
+    #   METHOD_EXACT_ARGS  the same, bound as a method
+    #   HOST               any other callable, run by the host Python
+    # Each variant checks that the callee is still of its kind, and if
+    # not, calls it the generic way and reverts the site to ADAPTIVE.
+    # A call site's arguments are (its offset, the countdown), then
+    # those of the instruction it stands for.
+
+    def call_adaptive(self, offset, countdown, arg):
+        if countdown:
+            self.respecialize(offset, 'ADAPTIVE', countdown - 1)
+        else:
+            self.respecialize(offset, self.call_kind(arg), cooldown)
+        return self.call_function(arg, [], {})
+
+    def call_kind(self, arg):
+        "The variant to specialize a call site to, for the callee it has now."
+        if 256 <= arg: return 'ADAPTIVE'   # It passes keyword arguments.
+        func = self.stack[self.sp - arg - 1]
+        if func.__class__ is Function:
+            if func._plan.plain and func._plan.argc == arg:
+                return 'EXACT_ARGS'
+        elif func.__class__ is Method:
+            fn = func.__func__
+            if fn.__class__ is Function and fn._plan.plain and fn._plan.argc == arg + 1:
+                return 'METHOD_EXACT_ARGS'
+        else:
+            return 'HOST'
+        return 'ADAPTIVE'
+
+    def respecialize(self, offset, kind, countdown):
+        "Rewrite the call site at offset to its variant of this kind."
+        opcode, arguments, next_offset = self.instructions[offset]
+        arguments = (offset, countdown) + arguments[slice(2, None)]
+        self.instructions[offset] = (call_site_variants[opcode][kind], arguments, next_offset)
+
+    def call_missed(self, offset, arg):
+        self.respecialize(offset, 'ADAPTIVE', cooldown)
+        return self.call_function(arg, [], {})
+
+    def call_exact_args(self, offset, countdown, arg):
+        stack, sp = self.stack, self.sp - arg
+        func = stack[sp-1]
+        if (func.__class__ is not Function
+            or not func._plan.plain or func._plan.argc != arg):
+            return self.call_missed(offset, arg)
+        self.sp = sp - 1
+        return self.call_frame(func, stack[slice(sp, sp + arg)] + func._plan.padding)
+
+    def call_method_exact_args(self, offset, countdown, arg):
+        stack, sp = self.stack, self.sp - arg
+        method = stack[sp-1]
+        if method.__class__ is not Method:
+            return self.call_missed(offset, arg)
+        func = method.__func__
+        if (func.__class__ is not Function
+            or not func._plan.plain or func._plan.argc != arg + 1):
+            return self.call_missed(offset, arg)
+        self.sp = sp - 1
+        return self.call_frame(func, ([method.__self__] + stack[slice(sp, sp + arg)]
+                                      + func._plan.padding))
+
+    def call_host(self, offset, countdown, arg):
+        stack, sp = self.stack, self.sp - arg
+        func = stack[sp-1]
+        if func.__class__ is Function or func.__class__ is Method:
+            return self.call_missed(offset, arg)
+        args = stack[slice(sp, sp + arg)]
+        self.sp = sp
+        stack[sp-1] = func(*args)
 
     def byte_RETURN_VALUE(self):
         return 'return'
@@ -401,6 +679,312 @@ class Frame:
     def byte_LOAD_BUILD_CLASS(self):
         self.push(build_class)
 
+    # Superinstructions: each does the work of a pair of instructions
+    # (listed in superinstructions, below) with one dispatch.
+
+    def byte_LOAD_FAST__LOAD_FAST(self, i, j):
+        fast, stack, sp = self.fast, self.stack, self.sp
+        stack[sp], stack[sp+1] = fast[i], fast[j]
+        if stack[sp] is unbound: self.unbound_local(i)
+        if stack[sp+1] is unbound: self.unbound_local(j)
+        self.sp = sp + 2
+
+    def byte_LOAD_FAST__LOAD_ATTR(self, i, attr):
+        val = self.fast[i]
+        if val is unbound: self.unbound_local(i)
+        self.push(getattr(val, attr))
+
+    def byte_LOAD_FAST__LOAD_GLOBAL(self, i, name):
+        self.byte_LOAD_FAST(i)
+        self.byte_LOAD_GLOBAL(name)
+
+    def byte_LOAD_FAST__CALL_FUNCTION(self, i, arg):
+        self.byte_LOAD_FAST(i)
+        return self.call_function(arg, [], {})
+
+    def byte_LOAD_GLOBAL__LOAD_FAST(self, name, i):
+        self.byte_LOAD_GLOBAL(name)
+        self.byte_LOAD_FAST(i)
+
+    def byte_LOAD_GLOBAL__CALL_FUNCTION(self, name, arg):
+        self.byte_LOAD_GLOBAL(name)
+        return self.call_function(arg, [], {})
+
+    def byte_LOAD_ATTR__LOAD_FAST(self, attr, i):
+        stack, sp = self.stack, self.sp
+        stack[sp-1] = getattr(stack[sp-1], attr)
+        self.byte_LOAD_FAST(i)
+
+    def byte_STORE_FAST__LOAD_FAST(self, i, j):
+        fast, stack, sp = self.fast, self.stack, self.sp - 1
+        fast[i] = stack[sp]
+        stack[sp] = fast[j]
+        if stack[sp] is unbound: self.unbound_local(j)
+
+    def byte_STORE_FAST__STORE_FAST(self, i, j):
+        fast, stack, sp = self.fast, self.stack, self.sp - 2
+        fast[i], fast[j] = stack[sp+1], stack[sp]
+        self.sp = sp
+
+    def byte_STORE_FAST__LOAD_GLOBAL(self, i, name):
+        self.fast[i] = self.pop()
+        self.byte_LOAD_GLOBAL(name)
+
+    def byte_UNPACK_SEQUENCE__STORE_FAST(self, count, i):
+        self.unpack(self.pop(), count)
+        self.fast[i] = self.pop()
+
+    def byte_COMPARE_OP__POP_JUMP_IF_FALSE(self, compare, jump):
+        stack, sp = self.stack, self.sp - 2
+        self.sp = sp
+        if not compare(stack[sp], stack[sp+1]):
+            self.f_lasti = jump
+
+    def byte_FOR_ITER__STORE_FAST(self, jump, i):
+        void = object()
+        element = next(self.top(), void)
+        if element is void:
+            self.pop()
+            self.jump(jump)
+        else:
+            self.fast[i] = element
+
+    def byte_FOR_ITER__UNPACK_SEQUENCE(self, jump, count):
+        void = object()
+        element = next(self.top(), void)
+        if element is void:
+            self.pop()
+            self.jump(jump)
+        else:
+            self.unpack(element, count)
+
+    def byte_LOAD_CONST__RETURN_VALUE(self, const):
+        self.push(const)
+        return 'return'
+
+def unpacked(seq, count):
+    "The count values of seq, reversed, as UNPACK_SEQUENCE pushes them."
+    values = tuple(seq)
+    if len(values) != count:
+        raise ValueError("too many values to unpack (expected %d)" % count
+                         if count < len(values) else
+                         "need more than %d value%s to unpack"
+                         % (len(values), '' if len(values) == 1 else 's'))
+    return reversed(values)
+
+def per_code(cache, code, make):
+    """Return make(code), made once per code object and kept in cache.
+    (The cache is keyed by id because equal code objects can still
+    differ, in the types of their constants.)"""
+    entry = cache.get(id(code))
+    if entry is None or entry[0] is not code:
+        entry = cache[id(code)] = (code, make(code))
+    return entry[1]
+
+decoded_code = {}                 # id(code) -> (code, its decoded instructions)
+
+def decode(code):
+    """Return code's instructions, decoded once and then cached: a list
+    with, at the offset of each instruction, a tuple of its opcode, its
+    arguments as its handler takes them (a local or cell variable as its
+    index, a comparison as its function), and the offset of the next.
+    Pairs of instructions are fused into superinstructions where they
+    can be, and call sites made adaptive if adaptive is set."""
+    return per_code(decoded_code, code, prepare)
+
+def prepare(code):
+    instructions = fuse(decode_instructions(code))
+    if adaptive:
+        quicken(instructions)
+    if jit is not None:
+        count_back_edges(code, instructions)
+    return instructions
+
+def decode_instructions(code):
+    bytecode = code.co_code
+    instructions = [None] * len(bytecode)
+    i = 0
+    while i < len(bytecode):
+        start, extended_arg = i, 0
+        opcode = bytecode[i]
+        if opcode == dis.EXTENDED_ARG:
+            extended_arg = (bytecode[i+1] + (bytecode[i+2] << 8)) << 16
+            i = i + 3
+            opcode = bytecode[i]
+        i = i + 1
+        arguments = ()
+        if opcode >= dis.HAVE_ARGUMENT:
+            int_arg = extended_arg + bytecode[i] + (bytecode[i+1] << 8)
+            i = i + 2
+            if opcode in dis.hasconst:
+                arg = code.co_consts[int_arg]
+            elif opcode in dis.hasname:
+                arg = code.co_names[int_arg]
+            elif opcode in dis.hasjrel:
+                arg = i + int_arg
+            elif opcode in dis.hascompare:
+                arg = Frame.COMPARE_OPERATORS[int_arg]
+            else:
+                arg = int_arg
+            arguments = (arg,)
+        instructions[start] = (opcode, arguments, i)
+    return instructions
+
+def jump_targets(instructions):
+    "The set of offsets that the decoded instructions jump to."
+    return set([instruction[1][0] for instruction in instructions
+                if instruction and (instruction[0] in dis.hasjrel
+                                    or instruction[0] in dis.hasjabs)])
+
+def fuse(instructions):
+    """Replace each pair of consecutive instructions that has a
+    superinstruction by it, in place, unless a jump could land between
+    them. The superinstruction takes the arguments of both, and goes on
+    to the instruction after the second. (The second stays where it is,
+    but now nothing reaches it.)"""
+    targets = jump_targets(instructions)
+    i = 0
+    while i < len(instructions):
+        first = instructions[i]
+        j = first[2]
+        if j < len(instructions) and j not in targets:
+            second = instructions[j]
+            opcode = super_opcodes.get((first[0], second[0]))
+            if opcode is not None:
+                instructions[i] = (opcode, first[1] + second[1], second[2])
+                j = second[2]
+        i = j
+    return instructions
+
+def quicken(instructions):
+    "Make each call site in the decoded instructions adaptive, in place."
+    i = 0
+    while i < len(instructions):
+        opcode, arguments, next_offset = instructions[i]
+        variants = call_site_variants.get(opcode)
+        if variants is not None:
+            instructions[i] = (variants['ADAPTIVE'], (i, warmup) + arguments, next_offset)
+        i = next_offset
+
+def count_back_edges(code, instructions):
+    """Make each jump back in the decoded instructions count towards
+    code's getting hot, in place."""
+    heat = per_code(heats, code, Heat)
+    i = 0
+    while i < len(instructions):
+        opcode, arguments, next_offset = instructions[i]
+        if opcode == JUMP_ABSOLUTE and arguments[0] <= i:
+            instructions[i] = (BACK_EDGE, (heat,) + arguments, next_offset)
+        i = next_offset
+
+def make_handlers():
+    """Return a list of the function to run each opcode, indexed by opcode:
+    dis's opcodes, then the superinstructions, then the call site
+    variants, then BACK_EDGE."""
+    return ([make_handler(name) for name in dis.opname]
+            + [getattr(Frame, 'byte_%s__%s' % pair) for pair in superinstructions]
+            + [make_call_site_handler(name, method)
+               for name in call_sites for kind, method in call_kinds]
+            + [Frame.back_edge])
+
+def make_call_site_handler(name, method):
+    call = getattr(Frame, method)
+    if name == 'CALL_FUNCTION':
+        return call
+    load = getattr(Frame, 'byte_' + name.split('__')[0])
+    def handler(frame, offset, countdown, loaded, arg):
+        load(frame, loaded)
+        return call(frame, offset, countdown, arg)
+    return handler
+
+def make_handler(name):
+    for prefix, operators, make in operator_handlers:
+        if name.startswith(prefix):
+            fn = operators.get(name.replace(prefix, '', 1))
+            return unsupported(name) if fn is None else make(fn)
+    return getattr(Frame, 'byte_' + name, None) or unsupported(name)
+
+def unary_handler(fn):
+    def handler(frame):
+        stack, sp = frame.stack, frame.sp
+        stack[sp-1] = fn(stack[sp-1])
+    return handler
+
+def binary_handler(fn):
+    def handler(frame):
+        stack, sp = frame.stack, frame.sp - 1
+        stack[sp-1] = fn(stack[sp-1], stack[sp])
+        frame.sp = sp
+    return handler
+
+def unsupported(name):
+    def handler(frame, *arguments):
+        raise VirtualMachineError("Unsupported opcode: %s" % name)
+    return handler
+
+operator_handlers = [('UNARY_',   Frame.UNARY_OPERATORS,   unary_handler),
+                     ('BINARY_',  Frame.BINARY_OPERATORS,  binary_handler),
+                     ('INPLACE_', Frame.INPLACE_OPERATORS, binary_handler)]
+
+# The pairs of instructions to fuse, chosen by profiling the pairs that
+# byterun runs most often (see benchmarks/pairs.py). Each pair's handler
+# is the Frame method byte_FIRST__SECOND.
+superinstructions = [
+    ('LOAD_GLOBAL', 'LOAD_FAST'),
+    ('LOAD_FAST', 'LOAD_ATTR'),
+    ('LOAD_GLOBAL', 'CALL_FUNCTION'),
+    ('LOAD_FAST', 'CALL_FUNCTION'),
+    ('LOAD_FAST', 'LOAD_GLOBAL'),
+    ('STORE_FAST', 'LOAD_GLOBAL'),
+    ('LOAD_ATTR', 'LOAD_FAST'),
+    ('LOAD_FAST', 'LOAD_FAST'),
+    ('STORE_FAST', 'STORE_FAST'),
+    ('UNPACK_SEQUENCE', 'STORE_FAST'),
+    ('FOR_ITER', 'UNPACK_SEQUENCE'),
+    ('STORE_FAST', 'LOAD_FAST'),
+    ('COMPARE_OP', 'POP_JUMP_IF_FALSE'),
+    ('FOR_ITER', 'STORE_FAST'),
+    ('LOAD_CONST', 'RETURN_VALUE'),
+]
+
+# (opcode, opcode) -> the opcode of their superinstruction, numbered after dis's.
+super_opcodes = dict([((dis.opmap[first], dis.opmap[second]), len(dis.opname) + i)
+                      for i, (first, second) in enumerate(superinstructions)])
+
+opnames = dis.opname + ['%s__%s' % pair for pair in superinstructions]
+
+# The instructions that end in a call, whose call sites adapt, and the
+# method of Frame that runs each kind of variant.
+call_sites = ['CALL_FUNCTION', 'LOAD_GLOBAL__CALL_FUNCTION', 'LOAD_FAST__CALL_FUNCTION']
+call_kinds = [('ADAPTIVE',          'call_adaptive'),
+              ('EXACT_ARGS',        'call_exact_args'),
+              ('METHOD_EXACT_ARGS', 'call_method_exact_args'),
+              ('HOST',              'call_host')]
+
+def number_call_site_variants():
+    """Give each variant of each call site an opcode, after the
+    superinstructions', and name it in opnames. Return a dict from the
+    opcode of a call site, or of any of its variants, to a dict from
+    each kind to the opcode of that variant."""
+    result = {}
+    for name in call_sites:
+        variants = {}
+        for kind, method in call_kinds:
+            variants[kind] = len(opnames)
+            opnames.append(name + '_' + kind)
+        result[opnames.index(name)] = variants
+        for opcode in variants.values():
+            result[opcode] = variants
+    return result
+
+call_site_variants = number_call_site_variants()
+
+# A jump back that counts towards its code's getting hot (see count_back_edges).
+BACK_EDGE = len(opnames)
+opnames.append('BACK_EDGE')
+
+handlers = make_handlers()
+
 def build_class(func, name, *bases, **kwds):
     if not isinstance(func, Function):
         raise TypeError("func must be a function")
@@ -416,8 +1000,7 @@ def build_class(func, name, *bases, **kwds):
     prepare = getattr(metaclass, '__prepare__', void)
     namespace = {} if prepare is void else prepare(name, bases, **kwds)
 
-    cell = run_frame(func.__code__, func.__closure__,
-                     func.__globals__, namespace)
+    cell = func._run(namespace, [])
 
     cls = metaclass(name, bases, namespace)
     if isinstance(cell, Cell):
@@ -0,0 +1,777 @@
+"""
+Compile hot code objects to Python: a just-in-time compiler for
+byterun. To have the interpreter use it,
+
+    from byterun import interpreter, jit
+    interpreter.jit = jit.compile_code
+
+Then the interpreter counts the calls and the loops back of each code
+object, and once they reach interpreter.hot it has compile_code
+translate the code's bytecode to the source of a Python function and
+compile that with the host's compile(). From then on the code runs
+compiled, at the host's own speed, except where it deoptimizes.
+
+In the translation, each slot of the value stack becomes a variable of
+the function (_j_s0, _j_s1, ...) alongside its local variables, and
+within a basic block the stack is simulated at translation time, as in
+closures.py: the bytecode for `x = a + b` comes out as `x = (a + b)`.
+A block reached from only one place is written out in place, and an
+if-else's two ways rejoin after an `if` statement; every other block
+is a state of a dispatch loop on _j_pc, and a state looping back to
+itself gets a `while True` loop of its own.
+
+Compiled code deoptimizes -- goes back to the interpreter -- by
+storing its variables back in the fast locals and returning an
+interpreter.Deoptimized, saying where to go on interpreting from. It
+does that
+  - on starting, when compiled code is already running max_depth deep
+    on the host's stack (since a call from compiled code to a byterun
+    function nests there, where the interpreter's wouldn't);
+  - on starting, to go on with a frame from an instruction where no
+    state starts;
+  - at a tail call of a byterun function, when interpreter.tail_calls
+    is set, so the interpreter can make the call in constant space.
+Code using an instruction that the translation doesn't handle isn't
+compiled at all, and stays interpreted.
+"""
+
+import dis, keyword, sys
+from . import interpreter
+from .closures import find_leaders
+from .interpreter import Frame, Function, Method, Deoptimized, unbound
+
+# How deep runs of compiled code may nest on the host's stack before
+# code starts off interpreted instead.
+max_depth = 50
+
+# The most lines of source to translate a code object to.
+max_lines = 20000
+
+class Nesting:
+    "How many runs of compiled code are under way."
+    depth = 0
+
+nesting = Nesting()
+
+class Unsupported(Exception):
+    "Code does something the translation doesn't handle."
+
+def compile_code(code):
+    """Return a function running code compiled, taking the arguments
+    interpreter.jit's functions take, or None if it can't be compiled."""
+    try:
+        translation = Translation(code)
+        source = translation.source()
+        namespace = {}
+        exec(compile(source, '<jit %s>' % code.co_name, 'exec'), namespace)
+    except (Unsupported, SyntaxError, RuntimeError, MemoryError):
+        # (A RuntimeError or MemoryError comes from source too deeply nested.)
+        return None
+    run = namespace['_j_make'](**translation.env)
+    run.source = source
+    return run
+
+RETURN_VALUE = dis.opmap['RETURN_VALUE']
+
+def python_name(name):
+    "Is name usable as is for a variable of the compiled code?"
+    return name.isidentifier() and not keyword.iskeyword(name) and not name.startswith('_j_')
+
+class Translation:
+    """The translation of a code object: its blocks, translated, and
+    the environment of names its source refers to."""
+
+    def __init__(self, code):
+        if code.co_flags & 0x20:
+            raise Unsupported("generator")
+        self.code = code
+        self.has_cells = bool(code.co_cellvars or code.co_freevars)
+        self.local_names = [name if python_name(name) else '_j_v%d' % i
+                            for i, name in enumerate(code.co_varnames)]
+        self.env = {}
+        self.literals = {}      # id(constant) -> the name of its variable
+        for name, value in helpers.items():
+            self.env['_j_' + name] = value
+        self.env['_j_code'] = code
+        self.env['_j_names'] = tuple(self.local_names)
+        self.uses_builtins = False
+        self.instructions = interpreter.decode_instructions(code)
+        self.translate_blocks()
+        self.find_states()
+
+    def constant(self, value):
+        "The source of an expression for a constant value."
+        if value is None or value is True or value is False:
+            return repr(value)
+        if type(value) in (int, str, bytes) or (type(value) is float and value == value
+                                                and abs(value) != float('inf')):
+            text = repr(value)
+            return '(%s)' % text if text.startswith('-') else text
+        name = self.literals.get(id(value))
+        if name is None:
+            name = self.literals[id(value)] = '_j_k%d' % len(self.literals)
+            self.env[name] = value
+        return name
+
+    # Blocks and how they connect.
+
+    def translate_blocks(self):
+        leaders = find_leaders(self.instructions)
+        self.blocks = {}        # offset of a reachable block -> its BlockTranslator
+        depths = {0: 0}         # Offset of a block -> its stack depth on entry
+        pending = [0]
+        while pending:
+            start = pending.pop()
+            block = BlockTranslator(self, leaders, depths[start])
+            block.translate(start)
+            self.blocks[start] = block
+            for offset, depth in block.successors:
+                if offset in depths:
+                    if depths[offset] != depth:
+                        raise Unsupported("inconsistent stack depth")
+                else:
+                    depths[offset] = depth
+                    pending.append(offset)
+        self.depths = depths
+        self.preds = dict([(offset, []) for offset in self.blocks])
+        for start, block in self.blocks.items():
+            for offset, depth in block.successors:
+                self.preds[offset].append(start)
+
+    def find_states(self):
+        """Choose which blocks are states: the start, the blocks jumped
+        back to, and the blocks reached from more than one place --
+        except for the joins of if-else's, which are written out after
+        their `if`s."""
+        self.loop_starts = set([offset for start, block in self.blocks.items()
+                                for offset, _ in block.successors if offset <= start])
+        self.states = set([0]) | self.loop_starts | set(
+            [offset for offset, preds in self.preds.items() if 1 < len(preds)])
+        self.ipdoms = immediate_postdominators(self.blocks)
+        self.joins = {}         # Block ending in a branch -> the block its ways rejoin at
+        changed = True
+        while changed:
+            changed = False
+            for start, block in self.blocks.items():
+                join = self.ipdoms.get(start)
+                if (block.exit[0] == 'branch' and start not in self.joins
+                    and join in self.states and join not in self.loop_starts and join != 0):
+                    region = self.region(start, join)
+                    if not (region & self.states) and set(self.preds[join]) <= region | set([start]):
+                        self.joins[start] = join
+                        self.states.discard(join)
+                        changed = True
+        self.looping = set([state for state in self.states
+                            if any([state in [offset for offset, _ in self.blocks[b].successors]
+                                    for b in self.region(state, None) | set([state])])])
+
+    def region(self, start, end):
+        "The blocks reachable from start's successors without passing states or end."
+        seen = set()
+        pending = [offset for offset, _ in self.blocks[start].successors]
+        while pending:
+            offset = pending.pop()
+            if offset != end and offset not in seen and offset not in self.states:
+                seen.add(offset)
+                pending.extend([o for o, _ in self.blocks[offset].successors])
+        return seen
+
+    # Writing out the source.
+
+    def source(self):
+        self.lines = []
+        params = self.code.co_argcount + bool(self.code.co_flags & 0x04) + bool(self.code.co_flags & 0x08)
+        entries = self.constant(frozenset(self.states))
+        self.emit(0, 'def _j_make(%s):' % ', '.join(sorted(self.env)))
+        self.emit(1, 'def _j_run(_j_fast, _j_closure, _j_g, _j_ns, _j_frame):')
+        self.emit(2, 'if (_j_jit.max_depth <= _j_nesting.depth')
+        self.emit(2, '    or (_j_frame is not None and _j_frame.f_lasti not in %s)):' % entries)
+        self.emit(3, 'return _j_restart(_j_frame)')
+        self.emit(2, '_j_nesting.depth += 1')
+        self.emit(2, 'try:')
+        self.emit(3, 'if _j_frame is None:')
+        if self.has_cells:
+            self.emit(4, '_j_cells = _j_make_cells(_j_code, _j_closure, _j_fast)')
+        for i in range(params):
+            self.emit(4, '%s = _j_fast[%d]' % (self.local_names[i], i))
+        self.emit(4, '_j_pc = 0')
+        self.emit(3, 'else:')
+        if self.has_cells:
+            self.emit(4, '_j_cells = _j_frame.cells')
+        for i, name in enumerate(self.local_names):
+            self.emit(4, 'if _j_fast[%d] is not _j_unbound: %s = _j_fast[%d]' % (i, name, i))
+        self.emit(4, '_j_pc = _j_frame.f_lasti')
+        keyword_ = 'if'
+        for state in sorted(self.states):
+            if self.depths[state]:
+                self.emit(4, '%s _j_pc == %d:' % (keyword_, state))
+                slots = ['_j_s%d' % i for i in range(self.depths[state])]
+                self.emit(5, '%s = _j_frame.stack[0:%d]' % (', '.join(slots) + ',', len(slots)))
+                keyword_ = 'elif'
+        if self.uses_builtins:
+            self.emit(3, '_j_b = _j_builtins_of(_j_g)')
+        if self.states == set([0]):
+            if 0 in self.looping:
+                self.emit(3, 'while True:')
+                self.write_block(0, None, 4, 0)
+            else:
+                self.write_block(0, None, 3, None)
+        else:
+            self.emit(3, 'while True:')
+            keyword_ = 'if'
+            for state in sorted(self.states, key=lambda s: (s not in self.looping, s == 0, s)):
+                self.emit(4, '%s _j_pc == %d:' % (keyword_, state))
+                keyword_ = 'elif'
+                if state in self.looping:
+                    self.emit(5, 'while True:')
+                    self.write_block(state, None, 6, state)
+                else:
+                    self.write_block(state, None, 5, None)
+        self.emit(2, 'finally:')
+        self.emit(3, '_j_nesting.depth -= 1')
+        self.emit(1, 'return _j_run')
+        return '\n'.join(self.lines) + '\n'
+
+    def emit(self, indent, line):
+        if max_lines <= len(self.lines):
+            raise Unsupported("too long")
+        self.lines.append('    ' * indent + line)
+
+    def write_block(self, start, stop, indent, loop):
+        """Write out the block at start, then on to where it goes,
+        stopping at stop (to fall out of an `if`). loop is the state
+        whose own `while` loop this is in, if any."""
+        block = self.blocks[start]
+        for statement in block.statements:
+            for line in statement.split('\n'):
+                self.emit(indent, line)
+        kind = block.exit[0]
+        if kind == 'go':
+            self.go(block.exit[1], stop, indent, loop)
+        elif kind == 'branch':
+            _, condition, if_true, if_false = block.exit
+            join = self.joins.get(start)
+            if join is None and stop is not None and self.ipdoms.get(start) == stop:
+                join = stop
+            if join is None:
+                self.emit(indent, 'if %s:' % condition)
+                self.go(if_true, None, indent + 1, loop)
+                self.go(if_false, None, indent, loop)
+            else:
+                if if_true == join:
+                    condition, if_true, if_false = '(not %s)' % condition, if_false, if_true
+                self.emit(indent, 'if %s:' % condition)
+                if if_true == join:
+                    self.emit(indent + 1, 'pass')
+                else:
+                    self.go(if_true, join, indent + 1, loop)
+                if if_false != join:
+                    self.emit(indent, 'else:')
+                    self.go(if_false, join, indent + 1, loop)
+                self.go(join, stop, indent, loop)
+        else:
+            self.emit(indent, block.exit[1])
+
+    def go(self, offset, stop, indent, loop):
+        if offset == stop:
+            pass
+        elif offset == loop:
+            self.emit(indent, 'continue')
+        elif offset in self.states:
+            self.emit(indent, '_j_pc = %d' % offset)
+            self.emit(indent, 'break' if loop is not None else 'continue')
+        else:
+            self.write_block(offset, stop, indent, loop)
+
+def immediate_postdominators(blocks):
+    """Return a dict from each block to the nearest block that all its
+    ways out pass through, where there is one."""
+    everything = set(blocks) | set(['exit'])
+    pdoms = dict([(offset, everything) for offset in blocks])
+    pdoms['exit'] = set(['exit'])
+    changed = True
+    while changed:
+        changed = False
+        for offset, block in blocks.items():
+            succs = [o for o, _ in block.successors] or ['exit']
+            new = set([offset]) | set.intersection(*[pdoms[o] for o in succs])
+            if new != pdoms[offset]:
+                pdoms[offset] = new
+                changed = True
+    result = {}
+    for offset in blocks:
+        strict = [o for o in pdoms[offset] if o != offset and o != 'exit']
+        if strict:
+            result[offset] = max(strict, key=lambda o: len(pdoms[o]))
+    return result
+
+# At translation time, each entry of the simulated stack is a Value:
+# the source of an expression computing it, and what it is: a
+# constant, a stack variable, or the result of an expression.
+
+class Value:
+    def __init__(self, source, kind, payload):
+        self.source = source
+        self.kind = kind
+        self.payload = payload    # The slot of a stack variable, or a dict display's items
+
+def const_value(source):
+    return Value(source, 'const', None)
+
+def slot_value(i):
+    return Value('_j_s%d' % i, 'slot', i)
+
+def expr_value(source):
+    return Value(source, 'expr', None)
+
+def atom(source):
+    "source, fit to be followed by an attribute, subscript, or call."
+    return '(%s)' % source if source[0].isdigit() else source
+
+class BlockTranslator:
+    """Translate one basic block, given its stack depth on entry, to
+    statements and an exit: ('go', offset), ('branch', condition,
+    offset if true, offset if false), or ('end', a return or raise
+    statement). Its successors are the (offset, stack depth) of each
+    block it can go to next."""
+
+    def __init__(self, translation, leaders, depth):
+        self.translation = translation
+        self.code = translation.code
+        self.instructions = translation.instructions
+        self.leaders = leaders
+        self.stack = [slot_value(i) for i in range(depth)]
+        self.statements = []
+        self.exit = None
+        self.successors = []
+
+    def translate(self, offset):
+        while self.exit is None:
+            self.offset = offset
+            opcode, arguments, self.next_offset = self.instructions[offset]
+            name = dis.opname[opcode]
+            method = getattr(self, 'op_' + name, None)
+            if method is None:
+                raise Unsupported(name)
+            method(*arguments)
+            if self.exit is None and self.next_offset in self.leaders:
+                self.go_to(self.next_offset)
+            offset = self.next_offset
+
+    # The simulated stack.
+
+    def push(self, value):
+        self.stack.append(value)
+
+    def pop(self):
+        return self.stack.pop()
+
+    def popn(self, n):
+        values = self.stack[len(self.stack) - n:]
+        del self.stack[len(self.stack) - n:]
+        return values
+
+    def push_expr(self, source):
+        self.push(expr_value(source))
+
+    def emit(self, statement):
+        self.statements.append(statement)
+
+    def settled(self, i, leaving):
+        """Is the stack's entry i in its variable, so that nothing needs
+        computing or assigning before a statement (or, if leaving,
+        before leaving the block)?"""
+        value = self.stack[i]
+        return ((value.kind == 'slot' and value.payload == i)
+                or (value.kind == 'const' and not leaving))
+
+    def flush(self, leaving):
+        """Compute every unsettled entry of the stack, in order from the
+        bottom, and assign them all to their variables."""
+        slots = [i for i in range(len(self.stack)) if not self.settled(i, leaving)]
+        if slots:
+            self.emit('%s = %s' % (', '.join(['_j_s%d' % i for i in slots]),
+                                   ', '.join([self.stack[i].source for i in slots])))
+            for i in slots:
+                self.stack[i] = slot_value(i)
+
+    def operands(self, n, leaving):
+        """Pop the top n entries, for a statement (or an exit) to use,
+        after flushing the rest if they need it. (If so, the n are
+        flushed too, since they come after.)"""
+        below = len(self.stack) - n
+        if not all([self.settled(i, leaving) for i in range(below)]):
+            self.flush(leaving)
+        return self.popn(n)
+
+    # Leaving the block.
+
+    def go_to(self, offset):
+        self.flush(True)
+        self.exit = ('go', self.successor(offset, len(self.stack)))
+
+    def successor(self, offset, depth):
+        self.successors.append((offset, depth))
+        return offset
+
+    def branch(self, condition, if_true, if_false):
+        self.exit = ('branch', condition, if_true, if_false)
+
+    def op_JUMP_FORWARD(self, target):
+        self.go_to(target)
+
+    def op_JUMP_ABSOLUTE(self, target):
+        self.go_to(target)
+
+    def op_POP_JUMP_IF_FALSE(self, target):
+        [value] = self.operands(1, True)
+        depth = len(self.stack)
+        self.branch(value.source, self.successor(self.next_offset, depth),
+                    self.successor(target, depth))
+
+    def op_POP_JUMP_IF_TRUE(self, target):
+        [value] = self.operands(1, True)
+        depth = len(self.stack)
+        self.branch(value.source, self.successor(target, depth),
+                    self.successor(self.next_offset, depth))
+
+    def op_JUMP_IF_FALSE_OR_POP(self, target):
+        self.flush(True)
+        i = len(self.stack) - 1
+        self.branch('_j_s%d' % i, self.successor(self.next_offset, i),
+                    self.successor(target, i + 1))
+
+    def op_JUMP_IF_TRUE_OR_POP(self, target):
+        self.flush(True)
+        i = len(self.stack) - 1
+        self.branch('_j_s%d' % i, self.successor(target, i + 1),
+                    self.successor(self.next_offset, i))
+
+    def op_FOR_ITER(self, target):
+        self.flush(True)
+        i = len(self.stack) - 1
+        self.emit('_j_s%d = _j_next(_j_s%d, _j_unbound)' % (i + 1, i))
+        self.branch('_j_s%d is _j_unbound' % (i + 1), self.successor(target, i),
+                    self.successor(self.next_offset, i + 2))
+
+    def op_RETURN_VALUE(self):
+        [value] = self.operands(1, False)
+        self.exit = ('end', 'return ' + value.source)
+
+    def op_RAISE_VARARGS(self, argc):
+        if argc != 1:
+            raise Unsupported('RAISE_VARARGS %d' % argc)
+        [value] = self.operands(1, False)
+        self.exit = ('end', 'raise ' + value.source)
+
+    # Rearranging the stack.
+
+    def op_POP_TOP(self):
+        [value] = self.operands(1, False)
+        if value.kind == 'expr':
+            self.emit(value.source)
+
+    def op_DUP_TOP(self):
+        self.flush(False)
+        self.push(self.copy(len(self.stack) - 1))
+
+    def op_DUP_TOP_TWO(self):
+        self.flush(False)
+        n = len(self.stack)
+        self.push(self.copy(n - 2))
+        self.push(self.copy(n - 1))
+
+    def copy(self, i):
+        "A copy of settled stack entry i."
+        value = self.stack[i]
+        return value if value.kind == 'const' else slot_value(i)
+
+    def op_ROT_TWO(self):
+        self.flush(False)
+        top, second = self.pop(), self.pop()
+        self.push(top)
+        self.push(second)
+
+    def op_ROT_THREE(self):
+        self.flush(False)
+        top, second, third = self.pop(), self.pop(), self.pop()
+        self.push(top)
+        self.push(third)
+        self.push(second)
+
+    def op_SETUP_LOOP(self, dest):
+        pass
+
+    def op_POP_BLOCK(self):
+        pass
+
+    # Loading.
+
+    def op_LOAD_CONST(self, const):
+        self.push(const_value(self.translation.constant(const)))
+
+    def op_LOAD_FAST(self, i):
+        self.push_expr(self.translation.local_names[i])
+
+    def op_LOAD_DEREF(self, i):
+        self.push_expr('_j_cells[%d].contents' % i)
+
+    def op_LOAD_CLOSURE(self, i):
+        self.push_expr('_j_cells[%d]' % i)
+
+    def op_LOAD_GLOBAL(self, name):
+        self.push_expr(self.load_global(name))
+
+    def load_global(self, name):
+        self.translation.uses_builtins = True
+        return ('(_j_g[{0!r}] if {0!r} in _j_g else _j_b[{0!r}] if {0!r} in _j_b'
+                ' else _j_undefined({0!r}))'.format(name))
+
+    def op_LOAD_NAME(self, name):
+        self.push_expr('(_j_ns[{0!r}] if {0!r} in _j_ns else {1})'.format(name, self.load_global(name)))
+
+    def op_LOAD_ATTR(self, attr):
+        self.push_expr('%s.%s' % (atom(self.pop().source), self.attribute(attr)))
+
+    def attribute(self, attr):
+        if not attr.isidentifier() or keyword.iskeyword(attr):
+            raise Unsupported("attribute %r" % attr)
+        return attr
+
+    def op_LOAD_BUILD_CLASS(self):
+        self.push(const_value('_j_build_class'))
+
+    # Computing.
+
+    def unary(self, name, fn):
+        operand = self.pop().source
+        if name in unary_syntax:
+            self.push_expr('(%s%s)' % (unary_syntax[name], operand))
+        else:
+            self.push_expr('%s(%s)' % (self.translation.constant(fn), operand))
+
+    def binary(self, name, fn):
+        left, right = [value.source for value in self.popn(2)]
+        if name == 'BINARY_SUBSCR':
+            self.push_expr('%s[%s]' % (atom(left), right))
+        elif name in binary_syntax:
+            self.push_expr('(%s %s %s)' % (left, binary_syntax[name], right))
+        else:
+            self.push_expr('%s(%s, %s)' % (self.translation.constant(fn), left, right))
+
+    def op_COMPARE_OP(self, compare):
+        left, right = [value.source for value in self.popn(2)]
+        i = Frame.COMPARE_OPERATORS.index(compare)
+        if i < len(dis.cmp_op) and dis.cmp_op[i] != 'exception match':
+            self.push_expr('(%s %s %s)' % (left, dis.cmp_op[i], right))
+        else:
+            self.push_expr('%s(%s, %s)' % (self.translation.constant(compare), left, right))
+
+    def op_GET_ITER(self):
+        self.push_expr('_j_iter(%s)' % self.pop().source)
+
+    def op_BUILD_TUPLE(self, count):
+        items = [value.source for value in self.popn(count)]
+        self.push_expr('(%s%s)' % (', '.join(items), ',' if count == 1 else ''))
+
+    def op_BUILD_LIST(self, count):
+        items = [value.source for value in self.popn(count)]
+        self.push_expr('[%s]' % ', '.join(items))
+
+    def op_BUILD_MAP(self, size):
+        self.push(Value('{}', 'expr', []))
+
+    def op_STORE_MAP(self):
+        mapping, value, key = self.popn(3)
+        if mapping.kind == 'expr' and mapping.payload is not None and key.kind == 'const':
+            # Still a display: add to it. (A display computes each key
+            # before its value, which matters only if the key isn't constant.)
+            items = mapping.payload + ['%s: %s' % (key.source, value.source)]
+            self.push(Value('{%s}' % ', '.join(items), 'expr', items))
+        else:
+            self.push_expr('_j_store_map(%s, %s, %s)'
+                           % (mapping.source, value.source, key.source))
+
+    def op_MAKE_FUNCTION(self, argc):
+        parts = [value.source for value in self.popn(argc + 2)]
+        self.push_expr('_j_make_function([%s], None, %s, %s, _j_g)'
+                       % (', '.join(parts[:argc]), parts[argc], parts[argc+1]))
+
+    def op_MAKE_CLOSURE(self, argc):
+        parts = [value.source for value in self.popn(argc + 3)]
+        self.push_expr('_j_make_function([%s], %s, %s, %s, _j_g)'
+                       % (', '.join(parts[:argc]), parts[argc], parts[argc+1], parts[argc+2]))
+
+    def op_CALL_FUNCTION(self, arg):
+        self.call(arg, False, False)
+
+    def op_CALL_FUNCTION_VAR(self, arg):
+        self.call(arg, True, False)
+
+    def op_CALL_FUNCTION_KW(self, arg):
+        self.call(arg, False, True)
+
+    def op_CALL_FUNCTION_VAR_KW(self, arg):
+        self.call(arg, True, True)
+
+    def call(self, arg, has_varargs, has_kwargs):
+        len_kw, len_pos = divmod(arg, 256)
+        n = 1 + len_pos + 2*len_kw + has_varargs + has_kwargs
+        if self.code.co_code[self.next_offset] == RETURN_VALUE:
+            self.guard_tail_call(n)
+        parts = [value.source for value in self.popn(n)]
+        if n == 1 + len_pos:
+            self.push_expr('%s(%s)' % (atom(parts[0]), ', '.join(parts[1:])))
+        else:
+            i = 1 + len_pos + 2*len_kw
+            self.push_expr('_j_call(%s, [%s], [%s], %s, %s)'
+                           % (parts[0], ', '.join(parts[1:1+len_pos]),
+                              ', '.join(parts[1+len_pos:i]),
+                              parts[i] if has_varargs else 'None',
+                              parts[i + has_varargs] if has_kwargs else 'None'))
+
+    def guard_tail_call(self, n):
+        """Before a call about to be returned, deoptimize if it'd call a
+        byterun function with interpreter.tail_calls set."""
+        self.flush(False)
+        func = self.stack[len(self.stack) - n].source
+        stack = ', '.join([value.source for value in self.stack])
+        cells = '_j_cells' if self.translation.has_cells else 'None'
+        self.emit('if _j_interpreter.tail_calls and _j_is_byterun(%s):\n'
+                  '    return _j_deoptimize(%d, [%s], %s, _j_fast, _j_names, _j_locals())'
+                  % (func, self.offset, stack, cells))
+
+    def op_IMPORT_NAME(self, name):
+        level, fromlist = [value.source for value in self.popn(2)]
+        self.push_expr('_j_import_name(%r, _j_g, _j_ns, %s, %s)' % (name, level, fromlist))
+
+    def op_IMPORT_FROM(self, name):
+        self.flush(False)
+        module = self.copy(len(self.stack) - 1).source
+        self.push_expr('%s.%s' % (atom(module), self.attribute(name)))
+
+    # Storing.
+
+    def op_STORE_FAST(self, i):
+        [value] = self.operands(1, False)
+        self.emit('%s = %s' % (self.translation.local_names[i], value.source))
+
+    def op_STORE_DEREF(self, i):
+        [value] = self.operands(1, False)
+        self.emit('_j_cells[%d].contents = %s' % (i, value.source))
+
+    def op_STORE_NAME(self, name):
+        [value] = self.operands(1, False)
+        self.emit('_j_ns[%r] = %s' % (name, value.source))
+
+    def op_STORE_GLOBAL(self, name):
+        [value] = self.operands(1, False)
+        self.emit('_j_g[%r] = %s' % (name, value.source))
+
+    def op_STORE_ATTR(self, attr):
+        value, obj = self.operands(2, False)
+        self.emit('%s.%s = %s' % (atom(obj.source), self.attribute(attr), value.source))
+
+    def op_STORE_SUBSCR(self):
+        value, obj, key = self.operands(3, False)
+        self.emit('%s[%s] = %s' % (atom(obj.source), key.source, value.source))
+
+    def op_LIST_APPEND(self, count):
+        [value] = self.operands(1, False)
+        target = self.stack[len(self.stack) - count].source
+        self.emit('%s.append(%s)' % (target, value.source))
+
+    def op_UNPACK_SEQUENCE(self, count):
+        [value] = self.operands(1, False)
+        start = len(self.stack)
+        unpacked = '_j_unpacked(%s, %d)' % (value.source, count)
+        if count:
+            slots = ['_j_s%d' % i for i in range(start, start + count)]
+            self.emit('%s, = %s' % (', '.join(slots), unpacked))
+        else:
+            self.emit(unpacked)
+        for i in range(start, start + count):
+            self.push(slot_value(i))
+
+unary_syntax = {'UNARY_POSITIVE': '+', 'UNARY_NEGATIVE': '-',
+                'UNARY_NOT': 'not ', 'UNARY_INVERT': '~'}
+
+binary_syntax = {'BINARY_POWER': '**', 'BINARY_MULTIPLY': '*', 'BINARY_MODULO': '%',
+                 'BINARY_ADD': '+', 'BINARY_SUBTRACT': '-', 'BINARY_TRUE_DIVIDE': '/',
+                 'BINARY_FLOOR_DIVIDE': '//', 'BINARY_LSHIFT': '<<', 'BINARY_RSHIFT': '>>',
+                 'BINARY_AND': '&', 'BINARY_XOR': '^', 'BINARY_OR': '|'}
+
+def make_operator_methods():
+    for prefix, table, make in interpreter.operator_handlers:
+        method = 'unary' if prefix == 'UNARY_' else 'binary'
+        for name, fn in table.items():
+            setattr(BlockTranslator, 'op_' + prefix + name,
+                    operator_method(method, prefix + name, fn))
+
+def operator_method(method, name, fn):
+    return lambda translator: getattr(translator, method)(name, fn)
+
+make_operator_methods()
+
+# What compiled code calls on.
+
+def restart(frame):
+    "Deoptimize before starting: go on as the interpreter would have."
+    if frame is None:
+        return Deoptimized(0, [], None)
+    return Deoptimized(frame.f_lasti, frame.stack[0:frame.sp], None)
+
+def deoptimize(offset, stack, cells, fast, names, variables):
+    "Store the compiled code's variables back in fast, and deoptimize."
+    for i, name in enumerate(names):
+        fast[i] = variables.get(name, unbound)
+    return Deoptimized(offset, stack, cells)
+
+def is_byterun(func):
+    "Would the interpreter call func by switching to a frame of its own?"
+    return (isinstance(func, Function)
+            or isinstance(func, Method) and isinstance(func.__func__, Function))
+
+def undefined(name):
+    raise NameError("name '%s' is not defined" % name)
+
+def store_map(mapping, value, key):
+    mapping[key] = value
+    return mapping
+
+def make_function(defaults, closure, code, name, f_globals):
+    return Function(name, code, f_globals, defaults, closure)
+
+def call(func, args, pairs, varargs, kwargs):
+    "Call func with arguments given as CALL_FUNCTION_VAR_KW takes them."
+    named = dict(zip(pairs[0::2], pairs[1::2]))
+    if kwargs:
+        named.update(kwargs)
+    if varargs:
+        args.extend(varargs)
+    return func(*args, **named)
+
+def import_name(name, f_globals, namespace, level, fromlist):
+    return __import__(name, f_globals, namespace, fromlist, level)
+
+helpers = {
+    'unbound':      unbound,
+    'nesting':      nesting,
+    'jit':          sys.modules[__name__],
+    'restart':      restart,
+    'deoptimize':   deoptimize,
+    'is_byterun':   is_byterun,
+    'interpreter':  interpreter,
+    'locals':       locals,
+    'iter':         iter,
+    'next':         next,
+    'undefined':    undefined,
+    'builtins_of':  interpreter.builtins_of,
+    'make_cells':   interpreter.make_cells,
+    'unpacked':     interpreter.unpacked,
+    'build_class':  interpreter.build_class,
+    'store_map':    store_map,
+    'make_function': make_function,
+    'call':         call,
+    'import_name':  import_name,
+}
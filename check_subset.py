@@ -56,6 +56,13 @@ class Checker(ast.NodeVisitor):
         self(t.targets)
         self(t.value)
 
+    def visit_AugAssign(self, t):
+        assert type(t.op) in self.ops2, "Unsupported binary op: %r" % (t,)
+        assert isinstance(t.target, (ast.Name, ast.Attribute, ast.Subscript)), \
+            "Unsupported augmented assignment target: %r" % (t,)
+        self(t.target)
+        self(t.value)
+
     def visit_For(self, t):
         self(t.target)
         self(t.iter)
@@ -95,6 +102,11 @@ class Checker(ast.NodeVisitor):
     def visit_Pass(self, t):
         pass
 
+    def visit_Global(self, t):
+        assert self.scope_type == 'function', "global only supported in functions: %r" % (t,)
+        for name in t.names:
+            self.check_identifier(name)
+
     def visit_Break(self, t):
         assert False, "break not supported"
 
@@ -140,6 +152,15 @@ class Checker(ast.NodeVisitor):
                ast.Lt,  ast.LtE,    ast.In,  ast.NotIn,
                ast.Gt,  ast.GtE}
 
+    def visit_ListComp(self, t):
+        self(t.generators)
+        self(t.elt)
+
+    def visit_comprehension(self, t):
+        self(t.target)
+        self(t.iter)
+        self(t.ifs)
+
     def visit_Call(self, t):
         self(t.func)
         self(t.args)
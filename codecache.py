@@ -0,0 +1,140 @@
+"""
+An on-disk cache of compiled modules, so that compiling the same source
+again can skip the whole compiler pipeline.
+
+An entry is keyed by a hash of the source text, the compiler's own
+source and the Python version. Entries are written to a temporary file
+and renamed into place, so several processes can share one cache
+directory. When the directory grows past its size limit, the least
+recently used entries get evicted.
+"""
+
+import hashlib, marshal, os, sys, tempfile
+
+# The modules whose source determines what the compiler outputs.
+compiler_files = ['compiler.py', 'check_subset.py', 'fold_constants.py',
+                  'tail_calls.py']
+
+default_max_bytes = 64 * 1024 * 1024
+
+def default_cache():
+    """The cache in $TAILBITER_CACHE_DIR, by default ~/.cache/tailbiter.
+    Setting that variable to the empty string turns caching off."""
+    directory = os.environ.get('TAILBITER_CACHE_DIR')
+    if directory is None:
+        directory = os.path.join(os.path.expanduser('~'), '.cache', 'tailbiter')
+    return CodeCache(directory or None, default_max_bytes)
+
+class CodeCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory  # None means don't cache.
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+    def get_or_compile(self, module_name, filename, source, options, compile_source):
+        """Return compile_source(module_name, filename, source), which
+        must be marshallable, from the cache if it's there. options
+        should list whatever else the result depends on."""
+        if self.directory is None:
+            self.misses += 1
+            return compile_source(module_name, filename, source)
+        path = self.path_for(self.key(module_name, filename, source, options))
+        value = self.load(path)
+        if value is None:
+            self.misses += 1
+            value = compile_source(module_name, filename, source)
+            self.store(path, value)
+            self.evict()
+        else:
+            self.hits += 1
+        return value
+
+    def key(self, module_name, filename, source, options):
+        h = hashlib.sha256()
+        for part in [sys.version, compiler_fingerprint(),
+                     module_name, filename, repr(options), source]:
+            h.update(part.encode('utf-8', 'surrogatepass'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key + '.tbc')
+
+    def load(self, path):
+        try:
+            with open(path, 'rb') as f:
+                value = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        touch(path)             # Mark it as recently used.
+        return value
+
+    def store(self, path, value):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(value, f)
+            os.replace(temp_path, path)
+        except BaseException:
+            remove(temp_path)
+            raise
+
+    def entries(self):
+        "The (mtime, size, path) of each entry, oldest first."
+        result = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tbc'):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:         # Evicted by another process.
+                    continue
+                result.append((st.st_mtime, st.st_size, path))
+        result.sort()
+        return result
+
+    def evict(self):
+        "Remove the least recently used entries, down to the size limit."
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if remove(path):
+                self.evictions += 1
+            total -= size
+
+    def clear(self):
+        if self.directory is not None and os.path.isdir(self.directory):
+            for _, _, path in self.entries():
+                remove(path)
+
+def touch(path):
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+def remove(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+_fingerprint = None
+
+def compiler_fingerprint():
+    global _fingerprint
+    if _fingerprint is None:
+        here = os.path.dirname(os.path.abspath(__file__))
+        h = hashlib.sha256()
+        for name in compiler_files:
+            with open(os.path.join(here, name), 'rb') as f:
+                h.update(f.read())
+        _fingerprint = h.hexdigest()
+    return _fingerprint
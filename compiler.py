@@ -1,20 +1,77 @@
-import ast, collections, dis, types, sys
+import argparse, ast, collections, dis, types, sys
 from functools import reduce
-from itertools import chain
 from check_subset import check_conformity
-
-def assemble(assembly):
-    return bytes(iter(assembly.encode(0, dict(assembly.resolve(0)))))
-
-def plumb_depths(assembly):
-    depths = [0]
-    assembly.plumb(depths)
-    return max(depths)
-
-def make_lnotab(assembly):
+from fold_constants import fold_constants
+from tail_calls import eliminate_tail_calls
+import codecache
+
+# Set this false to skip the optimization passes, e.g. for debugging.
+optimize = True
+
+# Set this true to compile self tail calls as jumps (see tail_calls.py).
+tail_calls = False
+
+def assemble(parts, addresses):
+    "Encode parts, laid out at addresses, into bytecode."
+    positions = label_positions(parts)
+    code = bytearray(addresses[-1])
+    for i, part in enumerate(parts):
+        if isinstance(part, Instruction):
+            arg = encoded_arg(parts, i, addresses, positions)
+            address = addresses[i]
+            if addresses[i+1] - address == 6:
+                code[address]   = EXTENDED_ARG
+                code[address+1] = (arg >> 16) & 0xFF
+                code[address+2] = (arg >> 24) & 0xFF
+                address = address + 3
+            code[address] = part.opcode
+            if arg is not None:
+                code[address+1] = arg & 0xFF
+                code[address+2] = (arg >> 8) & 0xFF
+    return bytes(code)
+
+def layout(parts):
+    """Return the address of each part, and then of the end. A jump
+    starts out with a 16-bit argument; if its target turns out too far
+    for that, it gets an EXTENDED_ARG prefix and we lay out again, until
+    nothing changes."""
+    positions = label_positions(parts)
+    wide, settled = set(), False
+    while not settled:
+        addresses = place(parts, wide)
+        settled = True
+        for i, part in enumerate(parts):
+            if (is_jump(part) and i not in wide
+                and 0xFFFF < encoded_arg(parts, i, addresses, positions)):
+                wide.add(i)
+                settled = False
+    return addresses
+
+def place(parts, wide):
+    addresses, address = [], 0
+    for i, part in enumerate(parts):
+        addresses.append(address)
+        address = address + (6 if i in wide else part.length)
+    addresses.append(address)
+    return addresses
+
+def encoded_arg(parts, i, addresses, positions):
+    part = parts[i]
+    if not isinstance(part.arg, Label):
+        return part.arg
+    target = addresses[positions[part.arg]]
+    if   part.opcode in hasjrel: return target - addresses[i+1]
+    elif part.opcode in hasjabs: return target
+    else: assert False, "Not a jump: %r" % part
+
+def line_nos(parts, addresses):
+    return [(addresses[i], part.line) for i, part in enumerate(parts)
+            if isinstance(part, SetLineNo)]
+
+def make_lnotab(parts, addresses):
     firstlineno, lnotab = None, []
     byte, line = 0, None
-    for next_byte, next_line in assembly.line_nos(0):
+    for next_byte, next_line in line_nos(parts, addresses):
         if firstlineno is None:
             firstlineno = line = next_line
         elif line < next_line:
@@ -34,65 +91,235 @@ def concat(assemblies):
 
 class Assembly:
     def __add__(self, other):
-        return Chain(self, other)
+        return Chain(self.parts()) + other
+    def parts(self):
+        return [self]
     length = 0
-    def resolve(self, start):
-        return ()
-    def encode(self, start, addresses):
-        return b''
-    def line_nos(self, start):
-        return ()
-    def plumb(self, depths):
-        pass
+    def plumb(self, depth):
+        return depth
 
-no_op = Assembly()
+class NoOp(Assembly):
+    def parts(self):
+        return []
+
+no_op = NoOp()
 
 class Label(Assembly):
-    def resolve(self, start):
-        return ((self, start),)
+    pass
 
 class SetLineNo(Assembly):
     def __init__(self, line):
         self.line = line
-    def line_nos(self, start):
-        return ((start, self.line),)
 
 class Instruction(Assembly):
     def __init__(self, opcode, arg):
         self.opcode = opcode
         self.arg    = arg
-        self.length = 1 if arg is None else 3
-    def encode(self, start, addresses):
-        if   self.opcode in dis.hasjabs: arg = addresses[self.arg]
-        elif self.opcode in dis.hasjrel: arg = addresses[self.arg] - (start+3)
-        else:                            arg = self.arg
-        if arg is None: return bytes([self.opcode])
-        else:           return bytes([self.opcode, arg % 256, arg // 256])
-    def plumb(self, depths):
+        self.length = (1 if arg is None else
+                       3 if isinstance(arg, Label) or arg <= 0xFFFF else
+                       6)               # With an EXTENDED_ARG prefix
+    def plumb(self, depth):
         arg = 0 if isinstance(self.arg, Label) else self.arg
-        depths.append(depths[-1] + dis.stack_effect(self.opcode, arg))
+        return depth + dis.stack_effect(self.opcode, arg)
 
 class Chain(Assembly):
-    def __init__(self, assembly1, assembly2):
-        self.part1 = assembly1
-        self.part2 = assembly2
-        self.length = assembly1.length + assembly2.length
-    def resolve(self, start):
-        return chain(self.part1.resolve(start),
-                     self.part2.resolve(start + self.part1.length))
-    def encode(self, start, addresses):
-        return chain(self.part1.encode(start, addresses),
-                     self.part2.encode(start + self.part1.length, addresses))
-    def line_nos(self, start):
-        return chain(self.part1.line_nos(start),
-                     self.part2.line_nos(start + self.part1.length))
-    def plumb(self, depths):
-        self.part1.plumb(depths)
-        self.part2.plumb(depths)
-
-class OffsetStack(Assembly):
-    def plumb(self, depths):
-        depths.append(depths[-1] - 1)
+    """A flat run of labels, line numbers and instructions. To keep
+    assembly linear, a chain grows in place as more gets added on, so
+    (as with every assembly CodeGen produces) it must be used only once."""
+    def __init__(self, parts):
+        self.stream = parts
+    def __add__(self, other):
+        self.stream.extend(other.parts())
+        return self
+    def parts(self):
+        return self.stream
+
+class Block:
+    "A basic block: a run of parts that control enters only at the top."
+    def __init__(self):
+        self.parts    = []
+        self.last     = None    # Its last instruction, if any
+        self.jump_to  = None    # The block its last instruction may jump to
+        self.falls_to = None    # The block control may run on into
+        self.depth    = None    # The stack depth on entry, once known reachable
+
+    def exits(self, depth):
+        """Each successor, paired with the stack depth on entering it, given
+        the depth at the end of this block."""
+        result = []
+        if self.jump_to is not None:
+            result.append((self.jump_to,
+                           depth - 2 if self.last.opcode == FOR_ITER else depth))
+        if self.falls_to is not None:
+            pops = self.last is not None and self.last.opcode in or_pop_jumps
+            result.append((self.falls_to, depth - 1 if pops else depth))
+        return result
+
+def make_cfg(parts):
+    "Split parts into basic blocks, linked by where control can go next."
+    blocks, block_at = [Block()], {}
+    for part in parts:
+        block = blocks[-1]
+        if isinstance(part, Label):
+            if block.last is not None:
+                block = Block()
+                blocks.append(block)
+            block_at[part] = block
+        block.parts.append(part)
+        if isinstance(part, Instruction):
+            block.last = part
+            if is_jump(part) or part.opcode in terminators:
+                blocks.append(Block())
+    for i, block in enumerate(blocks):
+        if block.last is not None and is_jump(block.last):
+            block.jump_to = block_at[block.last.arg]
+        ends = block.last is not None and block.last.opcode in terminators
+        if not ends and i+1 < len(blocks):
+            block.falls_to = blocks[i+1]
+    return blocks
+
+def plumb_depths(blocks):
+    """Find the stack depth on entry to each block that control can reach,
+    with a worklist over the CFG's edges. Return the greatest depth."""
+    for block in blocks:
+        block.depth = None
+    blocks[0].depth = 0
+    max_depth = 0
+    agenda = [blocks[0]]
+    while agenda:
+        block = agenda.pop()
+        depth = block.depth
+        for part in block.parts:
+            depth = part.plumb(depth)
+            max_depth = max(max_depth, depth)
+        for successor, successor_depth in block.exits(depth):
+            if successor.depth is None:
+                successor.depth = successor_depth
+                agenda.append(successor)
+            else:
+                assert successor.depth == successor_depth, "Inconsistent stack depths"
+    return max_depth
+
+def peephole(blocks):
+    """Simplify jumps and drop unreachable blocks, until that stops paying
+    off. This updates the blocks and their links in place."""
+    size = None
+    while size != count_parts(blocks):
+        size = count_parts(blocks)
+        blocks = drop_unreachable(simplify_jumps(thread_jumps(blocks)))
+    return blocks
+
+def count_parts(blocks):
+    return sum([len(block.parts) for block in blocks])
+
+JUMP_ABSOLUTE, JUMP_FORWARD = dis.opmap['JUMP_ABSOLUTE'], dis.opmap['JUMP_FORWARD']
+POP_JUMP_IF_FALSE = dis.opmap['POP_JUMP_IF_FALSE']
+POP_JUMP_IF_TRUE  = dis.opmap['POP_JUMP_IF_TRUE']
+FOR_ITER          = dis.opmap['FOR_ITER']
+EXTENDED_ARG      = dis.EXTENDED_ARG
+
+hasjrel = set(dis.hasjrel)
+hasjabs = set(dis.hasjabs)
+UNARY_NOT         = dis.opmap['UNARY_NOT']
+
+unconditional_jumps = set([JUMP_ABSOLUTE, JUMP_FORWARD])
+or_pop_jumps  = set([dis.opmap['JUMP_IF_FALSE_OR_POP'], dis.opmap['JUMP_IF_TRUE_OR_POP']])
+pop_jumps     = set([POP_JUMP_IF_FALSE, POP_JUMP_IF_TRUE])
+threadable    = unconditional_jumps | or_pop_jumps | pop_jumps
+terminators   = unconditional_jumps | set([dis.opmap['RETURN_VALUE'],
+                                           dis.opmap['RAISE_VARARGS']])
+
+def is_jump(part):
+    return isinstance(part, Instruction) and isinstance(part.arg, Label)
+
+def label_positions(parts):
+    return dict([(part, i) for i, part in enumerate(parts) if isinstance(part, Label)])
+
+def entry(block):
+    """The first instruction control runs on entering block, and the block
+    it's in; or None, None."""
+    while block is not None:
+        for part in block.parts:
+            if isinstance(part, Instruction):
+                return part, block
+        block = block.falls_to
+    return None, None
+
+def thread_jumps(blocks):
+    "Send each jump that lands on another jump straight to the final target."
+    index = dict([(block, i) for i, block in enumerate(blocks)])
+    for block in blocks:
+        jump = block.last
+        if block.jump_to is not None and jump.opcode in threadable:
+            label, target = final_target(block)
+            if target is not block.jump_to:
+                opcode = jump.opcode
+                if opcode == JUMP_FORWARD and index[target] <= index[block]:
+                    opcode = JUMP_ABSOLUTE
+                replace_last(block, Instruction(opcode, label))
+                block.jump_to = target
+    return blocks
+
+def final_target(block):
+    """The label and block that block's jump ends up at, following the
+    jumps it lands on that would pass it on."""
+    jump = block.last
+    label, target, seen = jump.arg, block.jump_to, set([jump.arg])
+    landing, landing_block = entry(target)
+    while (landing is not None and passes_on(jump, landing)
+           and landing.arg not in seen):
+        label, target = landing.arg, landing_block.jump_to
+        seen.add(label)
+        landing, landing_block = entry(target)
+    return label, target
+
+def passes_on(jump, landing):
+    "Would jump, on landing at landing, go on to landing's target?"
+    return (landing.opcode in unconditional_jumps
+            or (landing.opcode == jump.opcode and jump.opcode in or_pop_jumps))
+
+def simplify_jumps(blocks):
+    """Remove unconditional jumps to the very next instruction, make
+    conditional ones into plain pops, and fold a UNARY_NOT into the
+    conditional jump after it."""
+    for i, block in enumerate(blocks):
+        if block.jump_to is not None and goes_to_next(blocks, i):
+            if block.last.opcode in unconditional_jumps:
+                block.parts.pop()
+                block.last = last_instruction(block.parts)
+                block.falls_to = blocks[i+1]
+                block.jump_to = None
+            elif block.last.opcode in pop_jumps:
+                replace_last(block, op.POP_TOP)
+                block.jump_to = None
+        parts = block.parts
+        if (block.jump_to is not None and block.last.opcode == POP_JUMP_IF_FALSE
+            and 2 <= len(parts) and isinstance(parts[-2], Instruction)
+            and parts[-2].opcode == UNARY_NOT):
+            parts.pop(-2)
+            replace_last(block, Instruction(POP_JUMP_IF_TRUE, block.last.arg))
+    return blocks
+
+def goes_to_next(blocks, i):
+    "Does blocks[i]'s jump go where control would run on to anyway?"
+    target, j = blocks[i].jump_to, i+1
+    while j < len(blocks) and blocks[j] is not target and blocks[j].last is None:
+        j = j + 1
+    return j < len(blocks) and blocks[j] is target
+
+def replace_last(block, instruction):
+    "Replace block's last instruction, which ends it."
+    block.parts[-1] = instruction
+    block.last = instruction
+
+def last_instruction(parts):
+    instructions = [part for part in parts if isinstance(part, Instruction)]
+    return instructions[-1] if instructions else None
+
+def drop_unreachable(blocks):
+    "Drop the blocks that control can't reach."
+    plumb_depths(blocks)
+    return [block for block in blocks if block.depth is not None]
 
 def denotation(opcode):
     if opcode < dis.HAVE_ARGUMENT:
@@ -104,9 +331,10 @@ op = type('op', (), dict([(name, denotation(opcode))
                           for name, opcode in dis.opmap.items()]))
 
 class CodeGen(ast.NodeVisitor):
-    def __init__(self, filename, scope):
+    def __init__(self, filename, scope, incremental):
         self.filename  = filename
         self.scope     = scope
+        self.incremental = incremental  # An Incremental, or None
         self.constants = make_table()
         self.names     = make_table()
         self.varnames  = make_table()
@@ -116,29 +344,35 @@ class CodeGen(ast.NodeVisitor):
         return self.make_code(assembly, name, 0, False, False)
 
     def make_code(self, assembly, name, argcount, has_varargs, has_varkws):
+        blocks = make_cfg(assembly.parts())
+        if optimize:
+            blocks = peephole(blocks)
+        parts = [part for block in blocks for part in block.parts]
         kwonlyargcount = 0
         nlocals = len(self.varnames)
-        stacksize = plumb_depths(assembly)
+        stacksize = plumb_depths(blocks)
         flags = (  (0x02 if nlocals                  else 0)
                  | (0x04 if has_varargs              else 0)
                  | (0x08 if has_varkws               else 0)
                  | (0x10 if self.scope.freevars      else 0)
                  | (0x40 if not self.scope.derefvars else 0))
-        firstlineno, lnotab = make_lnotab(assembly)
+        addresses = layout(parts)
+        firstlineno, lnotab = make_lnotab(parts, addresses)
         return types.CodeType(argcount, kwonlyargcount,
-                              nlocals, stacksize, flags, assemble(assembly),
+                              nlocals, stacksize, flags, assemble(parts, addresses),
                               self.collect_constants(),
                               collect(self.names), collect(self.varnames),
                               self.filename, name, firstlineno, lnotab,
                               self.scope.freevars, self.scope.cellvars)
 
     def load_const(self, constant):
-        return op.LOAD_CONST(self.constants[constant, type(constant)])
+        return op.LOAD_CONST(self.constants[constant, type_signature(constant)])
 
     def collect_constants(self):
         return tuple([constant for constant,_ in collect(self.constants)])
 
     def visit_NameConstant(self, t): return self.load_const(t.value)
+    def visit_Constant(self, t):     return self.load_const(t.value)
     def visit_Num(self, t):          return self.load_const(t.n)
     def visit_Str(self, t):          return self.load_const(t.s)
     visit_Bytes = visit_Str
@@ -150,16 +384,18 @@ class CodeGen(ast.NodeVisitor):
 
     def load(self, name):
         access = self.scope.access(name)
-        if   access == 'fast':  return op.LOAD_FAST(self.varnames[name])
-        elif access == 'deref': return op.LOAD_DEREF(self.cell_index(name))
-        elif access == 'name':  return op.LOAD_NAME(self.names[name])
+        if   access == 'fast':   return op.LOAD_FAST(self.varnames[name])
+        elif access == 'deref':  return op.LOAD_DEREF(self.cell_index(name))
+        elif access == 'global': return op.LOAD_GLOBAL(self.names[name])
+        elif access == 'name':   return op.LOAD_NAME(self.names[name])
         else: assert False
 
     def store(self, name):
         access = self.scope.access(name)
-        if   access == 'fast':  return op.STORE_FAST(self.varnames[name])
-        elif access == 'deref': return op.STORE_DEREF(self.cell_index(name))
-        elif access == 'name':  return op.STORE_NAME(self.names[name])
+        if   access == 'fast':   return op.STORE_FAST(self.varnames[name])
+        elif access == 'deref':  return op.STORE_DEREF(self.cell_index(name))
+        elif access == 'global': return op.STORE_GLOBAL(self.names[name])
+        elif access == 'name':   return op.STORE_NAME(self.names[name])
         else: assert False
 
     def cell_index(self, name):
@@ -207,7 +443,6 @@ class CodeGen(ast.NodeVisitor):
         orelse, after = Label(), Label()
         return (           self(t.test) + op.POP_JUMP_IF_FALSE(orelse)
                          + self(t.body) + op.JUMP_FORWARD(after)
-                + OffsetStack()
                 + orelse + self(t.orelse)
                 + after)
 
@@ -216,6 +451,31 @@ class CodeGen(ast.NodeVisitor):
                 + concat([self(v) + self(k) + op.STORE_MAP
                           for k, v in zip(t.keys, t.values)]))
 
+    def visit_AugAssign(self, t):
+        inplace_op = self.ops_inplace[type(t.op)]
+        target = t.target
+        if isinstance(target, ast.Name):
+            return (self.load(target.id) + self(t.value) + inplace_op
+                    + self.store(target.id))
+        elif isinstance(target, ast.Attribute):
+            attr = self.names[target.attr]
+            return (self(target.value) + op.DUP_TOP + op.LOAD_ATTR(attr)
+                    + self(t.value) + inplace_op
+                    + op.ROT_TWO + op.STORE_ATTR(attr))
+        elif isinstance(target, ast.Subscript):
+            return (self(target.value) + self(target.slice.value)
+                    + op.DUP_TOP_TWO + op.BINARY_SUBSCR
+                    + self(t.value) + inplace_op
+                    + op.ROT_THREE + op.STORE_SUBSCR)
+        else:
+            assert False
+    ops_inplace = {ast.Pow:    op.INPLACE_POWER,  ast.Add:  op.INPLACE_ADD,
+                   ast.LShift: op.INPLACE_LSHIFT, ast.Sub:  op.INPLACE_SUBTRACT,
+                   ast.RShift: op.INPLACE_RSHIFT, ast.Mult: op.INPLACE_MULTIPLY,
+                   ast.BitOr:  op.INPLACE_OR,     ast.Mod:  op.INPLACE_MODULO,
+                   ast.BitAnd: op.INPLACE_AND,    ast.Div:  op.INPLACE_TRUE_DIVIDE,
+                   ast.BitXor: op.INPLACE_XOR,    ast.FloorDiv: op.INPLACE_FLOOR_DIVIDE}
+
     def visit_Subscript(self, t):
         return self(t.value) + self(t.slice.value) + self.subscr_ops[type(t.ctx)]
     subscr_ops = {ast.Load: op.BINARY_SUBSCR, ast.Store: op.STORE_SUBSCR}
@@ -262,14 +522,32 @@ class CodeGen(ast.NodeVisitor):
         op_jump = self.ops_bool[type(t.op)]
         def compose(left, right):
             after = Label()
-            return left + op_jump(after) + OffsetStack() + right + after
+            return left + op_jump(after) + right + after
         return reduce(compose, map(self, t.values))
     ops_bool = {ast.And: op.JUMP_IF_FALSE_OR_POP,
                 ast.Or:  op.JUMP_IF_TRUE_OR_POP}
 
+    def visit_ListComp(self, t):
+        return op.BUILD_LIST(0) + self.comprehension_loops(t, 0)
+
+    def comprehension_loops(self, t, i):
+        if i == len(t.generators):
+            return self(t.elt) + op.LIST_APPEND(i + 1)
+        loop, top, end = t.generators[i], Label(), Label()
+        return (         self(loop.iter) + op.GET_ITER
+                + top  + op.FOR_ITER(end) + self(loop.target)
+                       + concat([self(test) + op.POP_JUMP_IF_FALSE(top)
+                                 for test in loop.ifs])
+                       + self.comprehension_loops(t, i + 1)
+                       + op.JUMP_ABSOLUTE(top)
+                + end)
+
     def visit_Pass(self, t):
         return no_op
 
+    def visit_Global(self, t):
+        return no_op
+
     def visit_Raise(self, t):
         return self(t.exc) + op.RAISE_VARARGS(1)
 
@@ -302,18 +580,29 @@ class CodeGen(ast.NodeVisitor):
         return (         self(t.iter) + op.GET_ITER
                 + loop + op.FOR_ITER(end) + self(t.target)
                        + self(t.body) + op.JUMP_ABSOLUTE(loop)
-                + end  + OffsetStack())
+                + end)
 
     def visit_Return(self, t):
         return ((self(t.value) if t.value else self.load_const(None))
                 + op.RETURN_VALUE)
 
+    def visit_TailCall(self, t):
+        return (self(t.args)
+                + concat([self.store(param) for param in reversed(t.params)])
+                + op.JUMP_ABSOLUTE(self.start))
+
     def visit_Function(self, t):
-        code = self.sprout(t).compile_function(t)
+        code = self.compile_nested(t, self.sprout(t).compile_function)
         return self.make_closure(code, t.name)
 
     def sprout(self, t):
-        return CodeGen(self.filename, self.scope.children[t])
+        return CodeGen(self.filename, self.scope.children[t], self.incremental)
+
+    def compile_nested(self, t, compile_it):
+        if self.incremental is None:
+            return compile_it(t)
+        return self.incremental.code_for(t, self.scope.children[t],
+                                         self.filename, compile_it)
 
     def make_closure(self, code, name):
         if code.co_freevars:
@@ -332,12 +621,14 @@ class CodeGen(ast.NodeVisitor):
             self.varnames[arg.arg]
         if t.args.vararg: self.varnames[t.args.vararg.arg]
         if t.args.kwarg:  self.varnames[t.args.kwarg.arg]
-        assembly = self(t.body) + self.load_const(None) + op.RETURN_VALUE
+        self.start = Label()
+        assembly = (self.start + self(t.body)
+                    + self.load_const(None) + op.RETURN_VALUE)
         return self.make_code(assembly, t.name,
                               len(t.args.args), t.args.vararg, t.args.kwarg)
 
     def visit_ClassDef(self, t):
-        code = self.sprout(t).compile_class(t)
+        code = self.compile_nested(t, self.sprout(t).compile_class)
         return (op.LOAD_BUILD_CLASS + self.make_closure(code, t.name)
                                     + self.load_const(t.name)
                                     + self(t.bases)
@@ -354,6 +645,13 @@ class CodeGen(ast.NodeVisitor):
                     + self.load_const(None) + op.RETURN_VALUE)
         return self.make_code(assembly, t.name, 0, False, False)
 
+def type_signature(constant):
+    # Equal constants of different types, like 1 and 1.0 or (1,) and
+    # (1.0,), must not share a slot in the constants table.
+    if type(constant) is tuple:
+        return tuple([type_signature(item) for item in constant])
+    return type(constant)
+
 def make_table():
     table = collections.defaultdict(lambda: len(table))
     return table
@@ -361,11 +659,22 @@ def make_table():
 def collect(table):
     return tuple(sorted(table, key=table.get))
 
+code_cache = codecache.default_cache()
+
 def load_file(filename, module_name):
     f = open(filename)
     source = f.read()
     f.close()
-    return module_from_ast(module_name, filename, ast.parse(source))
+    code, docstring = code_cache.get_or_compile(module_name, filename, source,
+                                                [optimize, tail_calls], compile_source)
+    module = types.ModuleType(module_name, docstring)
+    exec(code, module.__dict__)
+    return module
+
+def compile_source(module_name, filename, source):
+    t = ast.parse(source)
+    docstring = ast.get_docstring(t)
+    return code_for_module(module_name, filename, t), docstring
 
 def module_from_ast(module_name, filename, t):
     code = code_for_module(module_name, filename, t)
@@ -374,12 +683,68 @@ def module_from_ast(module_name, filename, t):
     return module
 
 def code_for_module(module_name, filename, t):
+    return code_for_module_reusing(module_name, filename, t, None)
+
+def code_for_module_reusing(module_name, filename, t, incremental):
     t = desugar(t)
     check_conformity(t)
-    return CodeGen(filename, top_scope(t)).compile_module(t, module_name)
+    scope = top_scope(t)
+    if optimize:
+        t = fold_constants(t)
+    if tail_calls:
+        t = eliminate_tail_calls(t, scope)
+    return CodeGen(filename, scope, incremental).compile_module(t, module_name)
+
+class Incremental:
+    """Compile successive versions of a module, as in a watch loop,
+    reusing the code object of each function or class whose desugared
+    AST and free/cell variables haven't changed since the last version.
+    Only the changed definitions and the ones enclosing them get rebuilt."""
+
+    def __init__(self):
+        self.previous = {}      # fingerprint -> (code, lineno)
+        self.current = {}
+        self.reused = self.compiled = 0
+
+    def code_for_module(self, module_name, filename, t):
+        self.current = {}
+        code = code_for_module_reusing(module_name, filename, t, self)
+        self.previous = self.current  # (Kept as-is if compiling failed.)
+        return code
+
+    def code_for(self, t, scope, filename, compile_it):
+        key = fingerprint(t, scope, filename)
+        if key in self.previous:
+            code, lineno = self.previous[key]
+            code = relocate(code, t.lineno - lineno)
+            self.reused = self.reused + 1
+        else:
+            code = compile_it(t)
+            self.compiled = self.compiled + 1
+        self.current[key] = (code, t.lineno)
+        return code
+
+def fingerprint(t, scope, filename):
+    "Everything the code for t depends on, except which line it starts at."
+    lines = [node.lineno - t.lineno for node in ast.walk(t) if hasattr(node, 'lineno')]
+    return (ast.dump(t), tuple(lines), filename, optimize,
+            tuple(sorted(scope.freevars)), tuple(sorted(scope.cellvars)))
+
+def relocate(code, delta):
+    "Return code with its line numbers, and its nested code's, moved by delta."
+    if delta == 0:
+        return code
+    consts = [relocate(const, delta) if isinstance(const, types.CodeType) else const
+              for const in code.co_consts]
+    return types.CodeType(code.co_argcount, code.co_kwonlyargcount,
+                          code.co_nlocals, code.co_stacksize, code.co_flags,
+                          code.co_code, tuple(consts), code.co_names,
+                          code.co_varnames, code.co_filename, code.co_name,
+                          code.co_firstlineno + delta, code.co_lnotab,
+                          code.co_freevars, code.co_cellvars)
 
 def desugar(t):
-    return ast.fix_missing_locations(Desugarer().visit(t))
+    return ast.fix_missing_locations(Desugarer(optimize).visit(t))
 
 def rewriter(rewrite):
     def visit(self, t):
@@ -387,11 +752,35 @@ def rewriter(rewrite):
                                  t)
     return visit
 
+def function_rewriter(rewrite):
+    """Like rewriter, for a node whose insides are in a function's scope
+    (all but a def's decorators, which are in the enclosing scope)."""
+    def visit(self, t):
+        decorators = []
+        if isinstance(t, ast.FunctionDef):
+            decorators = [self.visit(d) for d in t.decorator_list]
+            t.decorator_list = []
+        in_function = self.in_function
+        if not in_function:
+            self.n_hidden = 0   # Keep a function's hidden names stable when others change.
+        self.in_function = True
+        t = self.generic_visit(t)
+        self.in_function = in_function
+        if isinstance(t, ast.FunctionDef):
+            t.decorator_list = decorators
+        return ast.copy_location(rewrite(self, t), t)
+    return visit
+
 def Call(fn, args):
     return ast.Call(fn, args, [], None, None)
 
 class Desugarer(ast.NodeTransformer):
 
+    def __init__(self, inline_comprehensions):
+        self.inline_comprehensions = inline_comprehensions
+        self.in_function = False
+        self.n_hidden = 0       # For making hidden names unique within a function
+
     @rewriter
     def visit_Assert(self, t):
         return ast.If(t.test,
@@ -400,11 +789,11 @@ class Desugarer(ast.NodeTransformer):
                                       [] if t.msg is None else [t.msg]),
                                  None)])
 
-    @rewriter
+    @function_rewriter
     def visit_Lambda(self, t):
         return Function('<lambda>', t.args, [ast.Return(t.body)])
 
-    @rewriter
+    @function_rewriter
     def visit_FunctionDef(self, t):
         fn = Function(t.name, t.args, t.body)
         for d in reversed(t.decorator_list):
@@ -413,6 +802,8 @@ class Desugarer(ast.NodeTransformer):
 
     @rewriter
     def visit_ListComp(self, t):
+        if self.inline_comprehensions and self.in_function:
+            return self.hide_loop_variables(t)
         result_append = ast.Attribute(ast.Name('.0', load), 'append', load)
         body = ast.Expr(Call(result_append, [t.elt]))
         for loop in reversed(t.generators):
@@ -425,6 +816,41 @@ class Desugarer(ast.NodeTransformer):
         return Call(Function('<listcomp>', args, fn),
                     [ast.List([], load)])
 
+    def hide_loop_variables(self, t):
+        """Rename the variables t loops over to names no program can use,
+        so that, compiled inline, t won't disturb the function's own."""
+        self.n_hidden = self.n_hidden + 1
+        renames = dict([(name.id, '.%s.%d' % (name.id, self.n_hidden))
+                        for loop in t.generators
+                        for name in ast.walk(loop.target)
+                        if isinstance(name, ast.Name)])
+        renamer = Renamer(renames)
+        for i, loop in enumerate(t.generators):
+            loop.target = renamer.visit(loop.target)
+            if 0 < i:           # (The first iterable is in the outer scope.)
+                loop.iter = renamer.visit(loop.iter)
+            loop.ifs = [renamer.visit(test) for test in loop.ifs]
+        t.elt = renamer.visit(t.elt)
+        return t
+
+class Renamer(ast.NodeTransformer):
+    "Rename variables, except inside functions with parameters of the same name."
+
+    def __init__(self, renames):
+        self.renames = renames
+
+    def visit_Name(self, t):
+        if t.id in self.renames:
+            t.id = self.renames[t.id]
+        return t
+
+    def visit_Function(self, t):
+        args = list(t.args.args) + [t.args.vararg, t.args.kwarg]
+        params = set([arg.arg for arg in args if arg])
+        renames = dict([(name, hidden) for name, hidden in self.renames.items()
+                        if name not in params])
+        return Renamer(renames).generic_visit(t)
+
 class Function(ast.FunctionDef):
     _fields = ('name', 'args', 'body')
 
@@ -442,6 +868,7 @@ class Scope(ast.NodeVisitor):
         self.children = {}       # Enclosed sub-scopes
         self.defs = set(defs)    # Variables defined
         self.uses = set()        # Variables referenced
+        self.globals = set()     # Variables declared global
 
     def visit_ClassDef(self, t):
         self.defs.add(t.name)
@@ -469,8 +896,13 @@ class Scope(ast.NodeVisitor):
         elif isinstance(t.ctx, ast.Store): self.defs.add(t.id)
         else: assert False
 
+    def visit_Global(self, t):
+        self.globals.update(t.names)
+
     def analyze(self, parent_defs):
-        self.local_defs = self.defs if isinstance(self.t, Function) else set()
+        parent_defs = parent_defs - self.globals
+        self.local_defs = (self.defs - self.globals if isinstance(self.t, Function)
+                           else set())
         for child in self.children.values():
             child.analyze(parent_defs | self.local_defs)
         child_uses = set([var for child in self.children.values()
@@ -481,10 +913,35 @@ class Scope(ast.NodeVisitor):
         self.derefvars = self.cellvars + self.freevars
 
     def access(self, name):
-        return ('deref' if name in self.derefvars else
-                'fast'  if name in self.local_defs else
+        return ('deref'  if name in self.derefvars else
+                'fast'   if name in self.local_defs else
+                'global' if isinstance(self.t, Function) else
                 'name')
 
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='compiler.py',
+                                     description="Compile a program with tailbiter and run it.")
+    parser.add_argument('--tail-calls', action='store_true',
+                        help="compile self tail calls as jumps")
+    parser.add_argument('--stats', action='store_true',
+                        help="first report where the compiler spent its time, to stderr")
+    parser.add_argument('prog', help="the program to run")
+    parser.add_argument('args', nargs=argparse.REMAINDER,
+                        help="arguments to pass to the program")
+    return parser.parse_args(argv)
+
+def main(argv):
+    global tail_calls
+    args = parse_args(argv)
+    sys.argv = [args.prog] + args.args
+    if args.stats:
+        # compilestats profiles the module named compiler, which isn't
+        # this one when this one is running as __main__.
+        import compilestats
+        compilestats.run_file(args.prog, '__main__', sys.stderr, args.tail_calls)
+    else:
+        tail_calls = args.tail_calls
+        load_file(args.prog, '__main__')
+
 if __name__ == '__main__':
-    sys.argv.pop(0)
-    load_file(sys.argv[0], '__main__')
+    main(sys.argv[slice(1, None)])
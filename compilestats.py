@@ -0,0 +1,190 @@
+"""
+Profile the compiler: the time and memory blocks taken by each phase of
+the pipeline, and the size and compile time of each code object.
+
+    $ python3 compilestats.py [--json FILE] [--top N] [--tail-calls] FILE...
+    $ python3 compiler.py [--tail-calls] --stats prog.py
+
+or from code:
+
+    (code, docstring), profile = compilestats.profile_compile(module_name, filename, source)
+    profile.report(sys.stdout, 10)
+    json.dump(profile.as_dict(), f)
+
+A phase's figures don't include those of other phases it calls; the
+'CodeGen' phase, for instance, is code generation proper, without the
+peephole, assembly and so on of the code objects it makes. The blocks
+are the net change in the number of memory blocks allocated (from
+sys.getallocatedblocks). The code cache is bypassed.
+"""
+
+import argparse, ast, dis, json, sys, time, types
+import compiler
+
+# The compiler's functions to time, in pipeline order.
+phase_functions = ['desugar', 'check_conformity', 'top_scope', 'fold_constants',
+                   'peephole', 'make_cfg', 'plumb_depths', 'layout', 'make_lnotab',
+                   'assemble']
+compile_methods = ['compile_module', 'compile_function', 'compile_class']
+
+class Profile:
+    """While active, as a context manager, record the compiler's work.
+    Not reentrant."""
+
+    def __init__(self):
+        self.phases = {}            # phase name -> dict of calls, seconds, blocks
+        self.compiled = []          # (t, code, seconds) for each code object
+        self.nested = []            # Stack of [seconds, blocks] spent in inner phases
+        self.nested_code = []       # Stack of seconds spent on inner code objects
+        self.saved = []
+
+    def __enter__(self):
+        for name in phase_functions:
+            self.patch(compiler, name, self.timing(name, getattr(compiler, name)))
+        for name in compile_methods:
+            self.patch(compiler.CodeGen, name, self.compiling(getattr(compiler.CodeGen, name)))
+        return self
+
+    def __exit__(self, *exc_info):
+        for owner, name, value in reversed(self.saved):
+            setattr(owner, name, value)
+        self.saved = []
+
+    def patch(self, owner, name, value):
+        self.saved.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, value)
+
+    def timing(self, phase, fn):
+        def timed(*args):
+            return self.run_phase(phase, fn, args)
+        return timed
+
+    def run_phase(self, phase, fn, args):
+        self.nested.append([0.0, 0])
+        start, blocks = time.perf_counter(), sys.getallocatedblocks()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            allocated = sys.getallocatedblocks() - blocks
+            inner_seconds, inner_blocks = self.nested.pop()
+            stats = self.phases.setdefault(phase, dict(calls=0, seconds=0.0, blocks=0))
+            stats['calls'] += 1
+            stats['seconds'] += elapsed - inner_seconds
+            stats['blocks'] += allocated - inner_blocks
+            if self.nested:
+                self.nested[-1][0] += elapsed
+                self.nested[-1][1] += allocated
+
+    def compiling(self, method):
+        def compile_and_record(codegen, t, *rest):
+            self.nested_code.append(0.0)
+            start = time.perf_counter()
+            try:
+                code = self.run_phase('CodeGen', method, (codegen, t) + rest)
+            finally:
+                elapsed = time.perf_counter() - start
+                inner = self.nested_code.pop()
+                if self.nested_code:
+                    self.nested_code[-1] += elapsed
+            self.compiled.append((t, code, elapsed - inner))
+            return code
+        return compile_and_record
+
+    def time_parse(self, source):
+        return self.run_phase('parse', ast.parse, (source,))
+
+    def code_objects(self):
+        "A dict of statistics for each code object compiled, in order of completion."
+        return [dict(name=code.co_name, filename=code.co_filename,
+                     line=getattr(t, 'lineno', code.co_firstlineno),
+                     ast_nodes=count_nodes(t), instructions=count_instructions(code),
+                     bytes=len(code.co_code), seconds=seconds)
+                for t, code, seconds in self.compiled]
+
+    def as_dict(self):
+        return dict(phases=self.phases, code_objects=self.code_objects())
+
+    def report(self, out, top):
+        "Write a table of the phases and of the top slowest code objects."
+        total = sum(stats['seconds'] for stats in self.phases.values())
+        print('%-18s %7s %10s %7s %10s' % ('phase', 'calls', 'seconds', '%', 'blocks'), file=out)
+        for phase in ['parse', 'CodeGen'] + phase_functions:
+            if phase in self.phases:
+                stats = self.phases[phase]
+                print('%-18s %7d %10.4f %6.1f%% %10d'
+                      % (phase, stats['calls'], stats['seconds'],
+                         100.0 * stats['seconds'] / total if total else 0.0,
+                         stats['blocks']), file=out)
+        print('%-18s %7s %10.4f' % ('total', '', total), file=out)
+        code_objects = self.code_objects()
+        print('\n%d code objects, %d AST nodes, %d instructions; slowest:'
+              % (len(code_objects), sum(c['ast_nodes'] for c in code_objects),
+                 sum(c['instructions'] for c in code_objects)), file=out)
+        print('%10s %9s %8s  %s' % ('seconds', 'AST nodes', 'insns', 'code object'), file=out)
+        for c in sorted(code_objects, key=lambda c: c['seconds'], reverse=True)[:top]:
+            print('%10.4f %9d %8d  %s:%d %s' % (c['seconds'], c['ast_nodes'], c['instructions'],
+                                                c['filename'], c['line'], c['name']), file=out)
+
+def count_nodes(t):
+    "The number of AST nodes in t, not counting the bodies of nested scopes."
+    count = 1
+    for child in ast.iter_child_nodes(t):
+        if isinstance(child, (compiler.Function, ast.ClassDef)):
+            count += 1
+        else:
+            count += count_nodes(child)
+    return count
+
+def count_instructions(code):
+    "The number of instructions in code (in CPython 3.4's format)."
+    count, i = 0, 0
+    while i < len(code.co_code):
+        i += 1 if code.co_code[i] < dis.HAVE_ARGUMENT else 3
+        count += 1
+    return count
+
+def profile_compile(module_name, filename, source, tail_calls=None):
+    """Compile source while profiling. Return (code, docstring), profile.
+    tail_calls, unless None, stands in for compiler.tail_calls meanwhile."""
+    with Profile() as profile:
+        if tail_calls is not None:
+            profile.patch(compiler, 'tail_calls', tail_calls)
+        t = profile.time_parse(source)
+        code = compiler.code_for_module(module_name, filename, t)
+    return (code, ast.get_docstring(t)), profile
+
+def run_file(filename, module_name, out, tail_calls=None):
+    "Like compiler.load_file, but report the compiler's profile to out first."
+    with open(filename) as f:
+        source = f.read()
+    (code, docstring), profile = profile_compile(module_name, filename, source, tail_calls)
+    profile.report(out, 10)
+    module = types.ModuleType(module_name, docstring)
+    exec(code, module.__dict__)
+    return module
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Profile tailbiter compiling some modules.")
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('--json', metavar='FILE', help="also write the statistics to FILE")
+    parser.add_argument('--top', type=int, default=10,
+                        help="how many of the slowest code objects to list")
+    parser.add_argument('--tail-calls', action='store_true',
+                        help="compile self tail calls as jumps")
+    args = parser.parse_args(argv)
+    results = {}
+    for filename in args.files:
+        with open(filename) as f:
+            source = f.read()
+        _, profile = profile_compile(filename, filename, source, args.tail_calls)
+        print('== %s' % filename)
+        profile.report(sys.stdout, args.top)
+        print()
+        results[filename] = profile.as_dict()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,175 @@
+"""
+Fold constant expressions, after desugaring and before code generation:
+arithmetic, unary ops and comparisons on literals, tuples of literals,
+and branches on a constant test.
+"""
+
+import ast, operator
+from check_subset import has_negzero
+
+def fold_constants(t):
+    return Folder().visit(t)
+
+class Constant(ast.expr):
+    "A constant with no literal syntax of its own, such as a tuple."
+    _fields = ('value',)
+
+# Results bigger than these stay as runtime computations, so that an
+# expression like 'x' * 10**9 doesn't bloat the code object.
+max_int_bits   = 128
+max_str_size   = 4096
+max_tuple_size = 256
+
+class Folder(ast.NodeTransformer):
+
+    def visit_Module(self, t):
+        self.fold_body(t)
+        return t
+
+    def visit_Function(self, t):
+        self.fold_body(t)
+        return t
+
+    def visit_ClassDef(self, t):
+        t.bases = self.fold_list(t.bases)
+        self.fold_body(t)
+        return t
+
+    def fold_body(self, t):
+        # Keep a docstring in place, but don't let a folded-away branch
+        # leave behind a string that would be mistaken for one.
+        if ast.get_docstring(t, False) is None:
+            t.body = self.fold_list(t.body)
+        else:
+            t.body = t.body[:1] + self.fold_list(t.body[1:])
+
+    def fold_list(self, ts):
+        result = []
+        for t in ts:
+            folded = self.visit(t)
+            if isinstance(folded, list): result.extend(folded)
+            elif folded is not None:     result.append(folded)
+        return result
+
+    def visit_Expr(self, t):
+        self.generic_visit(t)
+        return None if is_constant(t.value) else t
+
+    def visit_If(self, t):
+        self.generic_visit(t)
+        if not is_constant(t.test): return t
+        return t.body if value_of(t.test) else t.orelse
+
+    def visit_While(self, t):
+        self.generic_visit(t)
+        if is_constant(t.test) and not value_of(t.test): return None
+        return t
+
+    def visit_IfExp(self, t):
+        self.generic_visit(t)
+        if not is_constant(t.test): return t
+        return t.body if value_of(t.test) else t.orelse
+
+    def visit_UnaryOp(self, t):
+        self.generic_visit(t)
+        if not is_constant(t.operand): return t
+        return fold(t, self.ops1[type(t.op)], [value_of(t.operand)])
+    ops1 = {ast.UAdd: operator.pos,  ast.Invert: operator.invert,
+            ast.USub: operator.neg,  ast.Not:    operator.not_}
+
+    def visit_BinOp(self, t):
+        self.generic_visit(t)
+        if not (is_constant(t.left) and is_constant(t.right)): return t
+        left, right = value_of(t.left), value_of(t.right)
+        if not is_safe_binop(type(t.op), left, right): return t
+        return fold(t, self.ops2[type(t.op)], [left, right])
+    ops2 = {ast.Pow:    operator.pow,    ast.Add:  operator.add,
+            ast.LShift: operator.lshift, ast.Sub:  operator.sub,
+            ast.RShift: operator.rshift, ast.Mult: operator.mul,
+            ast.BitOr:  operator.or_,    ast.Mod:  operator.mod,
+            ast.BitAnd: operator.and_,   ast.Div:  operator.truediv,
+            ast.BitXor: operator.xor,    ast.FloorDiv: operator.floordiv}
+
+    def visit_Compare(self, t):
+        self.generic_visit(t)
+        [operator_], [right] = t.ops, t.comparators
+        if type(operator_) not in self.ops_cmp: return t
+        if not (is_constant(t.left) and is_constant(right)): return t
+        return fold(t, self.ops_cmp[type(operator_)], [value_of(t.left), value_of(right)])
+    # 'is' and 'is not' depend on object identity, which folding could change.
+    ops_cmp = {ast.Eq: operator.eq,  ast.NotEq: operator.ne,
+               ast.Lt: operator.lt,  ast.LtE:   operator.le,
+               ast.Gt: operator.gt,  ast.GtE:   operator.ge,
+               ast.In: lambda x, y: x in y,
+               ast.NotIn: lambda x, y: x not in y}
+
+    def visit_Tuple(self, t):
+        self.generic_visit(t)
+        if not isinstance(t.ctx, ast.Load): return t
+        if not all(map(is_constant, t.elts)): return t
+        return make_constant(t, tuple(map(value_of, t.elts)))
+
+def fold(t, fn, args):
+    "Return a constant for fn(*args) in place of t, or t if that won't do."
+    try:
+        value = fn(*args)
+    except Exception:
+        return t
+    return make_constant(t, value)
+
+def is_safe_binop(op_type, left, right):
+    "Would folding this operation give a result of reasonable size?"
+    if op_type is ast.Pow and isinstance(left, int) and isinstance(right, int):
+        return right < 0 or left.bit_length() * right <= max_int_bits
+    if op_type is ast.LShift and isinstance(left, int) and isinstance(right, int):
+        return 0 <= right and left.bit_length() + right <= max_int_bits
+    if op_type is ast.Mult:
+        if isinstance(left, int) and isinstance(right, int):
+            return left.bit_length() + right.bit_length() <= max_int_bits
+        if isinstance(right, int):
+            return len(left) * right <= max_str_size if is_sized(left) else True
+        if isinstance(left, int):
+            return len(right) * left <= max_str_size if is_sized(right) else True
+    if op_type is ast.Mod and isinstance(left, (str, bytes)):
+        return False            # Formatting can do too much to be worth it.
+    return True
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def is_sized(value):
+    return isinstance(value, (str, bytes, tuple))
+
+def make_constant(t, value):
+    "Return a node for value in place of t, or t if value can't be a constant."
+    if not is_acceptable(value): return t
+    if   value is None or isinstance(value, bool): node = ast.NameConstant(value)
+    elif isinstance(value, (int, float, complex)): node = ast.Num(value)
+    elif isinstance(value, str):                   node = ast.Str(value)
+    elif isinstance(value, bytes):                 node = ast.Bytes(value)
+    else:                                          node = Constant(value)
+    return ast.copy_location(node, t)
+
+def is_acceptable(value):
+    if value is None or isinstance(value, bool):
+        return True
+    if is_int(value):
+        return value.bit_length() <= max_int_bits
+    if isinstance(value, (float, complex)):
+        # See check_subset.visit_Num: the compiler can't keep a -0.0
+        # constant distinct from 0.0.
+        return not has_negzero(value)
+    if isinstance(value, (str, bytes)):
+        return len(value) <= max_str_size
+    if isinstance(value, tuple):
+        return len(value) <= max_tuple_size and all(map(is_acceptable, value))
+    return False
+
+def is_constant(t):
+    return isinstance(t, (ast.Num, ast.Str, ast.Bytes, ast.NameConstant, Constant))
+
+def value_of(t):
+    if   isinstance(t, ast.Num):                      return t.n
+    elif isinstance(t, (ast.Str, ast.Bytes)):         return t.s
+    elif isinstance(t, (ast.NameConstant, Constant)): return t.value
+    else: assert False, t
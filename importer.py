@@ -0,0 +1,79 @@
+"""
+An import hook that compiles chosen packages with tailbiter, so that a
+whole application, not just its main file, runs on our code.
+
+    import importer
+    importer.install(['myapp'])
+    import myapp.main           # Compiled by tailbiter, via the code cache.
+
+Only modules named in the allow-list, and their submodules, are
+affected; everything else, such as the standard library, gets imported
+as usual. Each module is compiled when it's first imported.
+
+    $ python3 importer.py myapp,otherlib prog.py
+"""
+
+import importlib.abc, importlib.machinery, importlib.util, sys
+import compiler
+
+def install(prefixes, run=None):
+    """Compile the modules under the packages named in prefixes with
+    tailbiter from now on. If run is given, it executes each module's
+    code instead of exec, as run(code, f_globals, f_locals) (for
+    instance byterun.interpreter.run). Return the finder installed."""
+    finder = Finder(prefixes, run)
+    sys.meta_path.insert(0, finder)
+    return finder
+
+def uninstall(finder):
+    if finder in sys.meta_path:
+        sys.meta_path.remove(finder)
+
+class Finder(importlib.abc.MetaPathFinder):
+
+    def __init__(self, prefixes, run):
+        self.prefixes = list(prefixes)
+        self.run = run
+
+    def allows(self, fullname):
+        return any(fullname == prefix or fullname.startswith(prefix + '.')
+                   for prefix in self.prefixes)
+
+    def find_spec(self, fullname, path, target=None):
+        if not self.allows(fullname):
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path)
+        if spec is None or not isinstance(spec.loader, importlib.machinery.SourceFileLoader):
+            return None             # Leave extension modules and the like alone.
+        spec.loader = Loader(fullname, spec.origin, self.run)
+        return spec
+
+class Loader(importlib.machinery.SourceFileLoader):
+
+    def __init__(self, fullname, path, run):
+        super().__init__(fullname, path)
+        self.run = run
+
+    def compile(self, fullname):
+        "Return the code and docstring for the module, from the cache if possible."
+        source = importlib.util.decode_source(self.get_data(self.path))
+        return compiler.code_cache.get_or_compile(fullname, self.path, source,
+                                                  [compiler.optimize, compiler.tail_calls],
+                                                  compiler.compile_source)
+
+    def get_code(self, fullname):
+        code, _ = self.compile(fullname)
+        return code
+
+    def exec_module(self, module):
+        code, docstring = self.compile(module.__name__)
+        module.__doc__ = docstring
+        if self.run is None:
+            exec(code, module.__dict__)
+        else:
+            self.run(code, module.__dict__, None)
+
+if __name__ == '__main__':
+    sys.argv.pop(0)
+    install(sys.argv.pop(0).split(','))
+    compiler.load_file(sys.argv[0], '__main__')
@@ -4,7 +4,7 @@ byterun.interpreter.
 """
 
 import ast, sys, types
-import compiler, byterun.interpreter
+import codecache, compiler, byterun.interpreter
 #sys.setrecursionlimit(8000)
 
 def read_file(filename):
@@ -14,26 +14,36 @@ def read_file(filename):
     return text
 
 class Loader:
-    def __init__(self, piler, terp):
+    def __init__(self, piler, terp, cache):
         self.compiler = piler
         self.interpreter = terp
+        self.cache = cache
 
     def load_file(self, filename, module_name):
         source = read_file(filename)
-        return self.module_from_ast(module_name, filename, ast.parse(source))
+        code, docstring = self.cache.get_or_compile(module_name, filename, source,
+                                                    [self.compiler.optimize,
+                                                     self.compiler.tail_calls],
+                                                    self.compiler.compile_source)
+        return self.module_from_code(module_name, code, docstring)
 
     def module_from_ast(self, module_name, filename, t):
         code = self.compiler.code_for_module(module_name, filename, t)
-        module = types.ModuleType(module_name, ast.get_docstring(t))
+        return self.module_from_code(module_name, code, ast.get_docstring(t))
+
+    def module_from_code(self, module_name, code, docstring):
+        module = types.ModuleType(module_name, docstring)
         self.interpreter.run(code, module.__dict__, None)
         return module
 
-base_loader = Loader(compiler, byterun.interpreter)
+base_loader = Loader(compiler, byterun.interpreter, compiler.code_cache)
 
 meta_compiler    = base_loader.load_file('compiler.py', 'compiler')
 meta_interpreter = base_loader.load_file('byterun/interpreter.py', 'interpreter')
 
-meta_loader = Loader(meta_compiler, meta_interpreter)
+# The cache doesn't tell compilers apart, and the point here is to run
+# the meta compiler, so it always compiles afresh.
+meta_loader = Loader(meta_compiler, meta_interpreter, codecache.CodeCache(None, 0))
 
 if __name__ == '__main__':
     sys.argv.pop(0)
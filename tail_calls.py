@@ -0,0 +1,121 @@
+"""
+Eliminate self tail calls, after scope analysis and before code
+generation: in a function f, `return f(x, y)` becomes a rebinding of
+f's parameters to x and y and a jump back to the start of f, so that
+a deep self-recursion runs in constant stack, with no new frames.
+
+We do this only where f surely still denotes the function: the name
+must be bound just once in the scope defining it, by its undecorated
+def, and never declared global. (For a module-level function we also
+take it that nothing outside the module rebinds the name.) Calls with
+keyword or star arguments, or from inside a for loop, are left alone,
+as are functions taking *args or **kwargs and functions with variables
+captured by inner closures, since those need fresh cells on each call.
+So are functions with any local variables besides their parameters,
+since after the jump those would keep their values from the call
+before, instead of starting out unbound.
+"""
+
+import ast
+
+def eliminate_tail_calls(t, scope):
+    globals_declared = set([name for node in ast.walk(t) if isinstance(node, ast.Global)
+                                 for name in node.names])
+    TailCaller(scope, globals_declared).visit(t)
+    return t
+
+class TailCall(ast.stmt):
+    "A self tail call: assign args to params, then jump to the function's start."
+    _fields = ('args', 'params')
+
+class TailCaller(ast.NodeVisitor):
+    "Rewrite the self tail calls of the functions defined in one scope, and within."
+
+    def __init__(self, scope, globals_declared):
+        self.scope = scope
+        self.globals_declared = globals_declared
+
+    def visit_Module(self, t):
+        self.rewrite_defs(t, 'global')
+        self.generic_visit(t)
+
+    def visit_Function(self, t):
+        subcaller = TailCaller(self.scope.children[t], self.globals_declared)
+        subcaller.rewrite_defs(t, 'deref')
+        subcaller.generic_visit(t)
+
+    def visit_ClassDef(self, t):
+        # A def in a class body binds an attribute, not a variable the
+        # method's body could refer to; so just look deeper.
+        TailCaller(self.scope.children[t], self.globals_declared).generic_visit(t)
+
+    def rewrite_defs(self, t, access):
+        """Rewrite each function defined directly in scope t whose name
+        its body would reach with this access."""
+        binder = Binder(t)
+        for name, fn in binder.defs:
+            fn_scope = self.scope.children[fn]
+            params = [arg.arg for arg in fn.args.args]
+            if (binder.counts[name] == 1
+                and name not in self.globals_declared
+                and fn_scope.access(name) == access
+                and not fn_scope.cellvars
+                and not fn.args.vararg and not fn.args.kwarg
+                and fn_scope.local_defs <= set(params)):
+                fn.body = rewrite_returns(fn.body, name, params)
+
+def rewrite_returns(body, name, params):
+    return [rewrite_return(stmt, name, params) for stmt in body]
+
+def rewrite_return(t, name, params):
+    if isinstance(t, ast.Return) and is_call_to(t.value, name, len(params)):
+        return ast.copy_location(TailCall(t.value.args, params), t)
+    elif isinstance(t, ast.If):
+        t.body = rewrite_returns(t.body, name, params)
+        t.orelse = rewrite_returns(t.orelse, name, params)
+    elif isinstance(t, ast.While):
+        t.body = rewrite_returns(t.body, name, params)
+    return t
+
+def is_call_to(t, name, n_args):
+    return (isinstance(t, ast.Call)
+            and isinstance(t.func, ast.Name) and t.func.id == name
+            and len(t.args) == n_args
+            and not t.keywords and not t.starargs and not t.kwargs)
+
+class Binder(ast.NodeVisitor):
+    """Count the bindings of each variable in one scope, and collect the
+    plain function definitions there, as (name, function) pairs."""
+
+    def __init__(self, t):
+        self.counts = {}
+        self.defs = []
+        if isinstance(t, ast.FunctionDef):
+            all_args = list(t.args.args) + [t.args.vararg, t.args.kwarg]
+            for arg in all_args:
+                if arg: self.bind(arg.arg)
+        for stmt in t.body:
+            self.visit(stmt)
+
+    def bind(self, name):
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def visit_Assign(self, t):
+        if (len(t.targets) == 1 and isinstance(t.targets[0], ast.Name)
+            and isinstance(t.value, ast.FunctionDef)):
+            self.defs.append((t.targets[0].id, t.value))
+        self.generic_visit(t)
+
+    def visit_Function(self, t):
+        pass                    # Its insides are another scope.
+
+    def visit_ClassDef(self, t):
+        self.bind(t.name)
+        for expr in t.bases: self.visit(expr)
+
+    def visit_Name(self, t):
+        if isinstance(t.ctx, ast.Store):
+            self.bind(t.id)
+
+    def visit_alias(self, t):
+        self.bind(t.asname or t.name.split('.')[0])
@@ -0,0 +1,58 @@
+"""Test assembling bytecode, including code too big for 16-bit arguments."""
+
+import compiler
+from compiler import op, Label
+from . import vmtest
+from .vmtest import all_opnames, compile_source, function_code
+
+def long_function(n_statements):
+    body = '            total = total + n\n' * n_statements
+    return """\
+def f(n):
+    total = 0
+    while n:
+        if n < 0:
+            total = -1
+        else:
+""" + body + """\
+        n = n - 1
+    return total
+print(f(2))
+"""
+
+class TestAssembly(vmtest.VmTestCase):
+    def test_long_jumps(self):
+        code = compile_source(long_function(7000))
+        f_code = function_code(code, 'f')
+        self.assertGreater(len(f_code.co_code), 0x10000)
+        self.assertIn('EXTENDED_ARG', all_opnames(code))
+        vm_value, vm_exc, vm_stdout = self.run_in_vm(code)
+        self.assertIsNone(vm_exc)
+        self.assertEqual(vm_stdout.getvalue(), '21000\n')
+
+    def test_short_code(self):
+        self.assert_ok(long_function(3))
+        self.assertNotIn('EXTENDED_ARG', all_opnames(compile_source(long_function(3))))
+
+    def test_wide_arguments(self):
+        parts = (op.LOAD_CONST(0x12345) + op.RETURN_VALUE).parts()
+        addresses = compiler.layout(parts)
+        self.assertEqual(addresses, [0, 6, 7])
+        self.assertEqual(compiler.assemble(parts, addresses),
+                         bytes([compiler.EXTENDED_ARG, 0x01, 0x00,
+                                compiler.dis.opmap['LOAD_CONST'], 0x45, 0x23,
+                                compiler.dis.opmap['RETURN_VALUE']]))
+
+    def test_relaxation(self):
+        # A forward jump over 0x10000 bytes of padding gets widened, which
+        # pushes the jump after it out of 16-bit range too.
+        far, end = Label(), Label()
+        padding = compiler.concat([op.NOP] * 0x10000)
+        parts = (op.JUMP_FORWARD(far) + op.JUMP_ABSOLUTE(end) + padding
+                 + far + op.JUMP_ABSOLUTE(end) + end + op.RETURN_VALUE).parts()
+        addresses = compiler.layout(parts)
+        self.assertEqual(addresses[1] - addresses[0], 6)
+        self.assertEqual(addresses[2] - addresses[1], 6)
+        code = compiler.assemble(parts, addresses)
+        self.assertEqual(code[:6], bytes([compiler.EXTENDED_ARG, 1, 0,
+                                          compiler.dis.opmap['JUMP_FORWARD'], 6, 0]))
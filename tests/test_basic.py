@@ -36,6 +36,57 @@ class TestIt(vmtest.VmTestCase):
             print(l)
             """)
 
+    def test_augmented_assignment(self):
+        self.assert_ok("""\
+            x = 10
+            x += 3; x -= 1; x *= 4; x //= 5; x **= 2; x %= 7
+            x <<= 3; x >>= 1; x |= 64; x &= 0x7f; x ^= 5; x /= 2
+            print(x)
+            l = [1]
+            alias = l
+            l += [2, 3]
+            print(l, alias is l)
+            s = 'a'
+            s += 'b'
+            print(s)
+            """)
+        self.assert_ok("""\
+            class C:
+                pass
+            c = C()
+            c.n = 1
+            c.n += 41
+            d = {'k': [1]}
+            d['k'] += [2]
+            d['k'][0] -= 10
+            def f(t):
+                total = 0
+                for x in t:
+                    total += x
+                t[len(t) - 1] *= total
+                return total
+            print(c.n, d, f([1, 2, 3]))
+            """)
+
+    def test_augmented_assignment_evaluates_target_once(self):
+        self.assert_ok("""\
+            calls = []
+            def key(k):
+                calls.append(k)
+                return k
+            class C:
+                pass
+            def obj():
+                calls.append('obj')
+                return c
+            c = C()
+            c.n = 1
+            d = {'a': 1}
+            d[key('a')] += 1
+            obj().n += 1
+            print(calls, d, c.n)
+            """)
+
     def test_list_comprehension(self):
         self.assert_ok("""\
             x = [z*z for z in range(5)]
@@ -241,6 +292,20 @@ class TestIt(vmtest.VmTestCase):
             assert b == 2
             assert c == 3
             """)
+        self.assert_ok("""\
+            def f(pairs):
+                total = 0
+                for key, (x, y) in pairs:
+                    total = total + x * y
+                    x, y = y, x
+                return total, x, y
+            print(f({'a': [1, 2], 'b': (3, 4)}.items()))
+            """)
+
+    def test_unpacking_too_many(self):
+        self.assert_ok("""\
+            a, b = [1, 2, 3]
+            """, raises=ValueError)
 
     def test_exec_statement(self):
         self.assert_ok("""\
@@ -0,0 +1,63 @@
+"""Test compiling many modules in parallel."""
+
+import io, marshal, os, shutil, tempfile, unittest
+from byterun.interpreter import run
+import batchcompile
+
+class TestBatchCompile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.directory, 'src')
+        self.output_dir = os.path.join(self.directory, 'out')
+        self.write('pkg/__init__.py', '')
+        self.write('pkg/good.py', 'x = 6 * 7\n')
+        self.write('bad.py', 'with f: pass\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, relative, text):
+        filename = os.path.join(self.source_dir, relative)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'w') as f:
+            f.write(text)
+
+    def test_module_names(self):
+        modules = batchcompile.find_modules([self.source_dir])
+        self.assertEqual([name for _, name, _ in modules], ['bad', 'pkg', 'pkg.good'])
+        modules = batchcompile.find_modules([os.path.join(self.source_dir, 'pkg')])
+        self.assertEqual([(name, relative) for _, name, relative in modules],
+                         [('pkg', os.path.join('pkg', '__init__.py')),
+                          ('pkg.good', os.path.join('pkg', 'good.py'))])
+
+    def test_compile_all(self):
+        results = batchcompile.compile_all([self.source_dir], self.output_dir, 2, True, False)
+        self.assertEqual([(r['module'], r['ok']) for r in results],
+                         [('bad', False), ('pkg', True), ('pkg.good', True)])
+        self.assertIn('Unsupported syntax', results[0]['error'])
+        with open(os.path.join(self.output_dir, 'pkg', 'good.pyc'), 'rb') as f:
+            code = marshal.loads(f.read()[12:])
+        env = {}
+        run(code, env, None)
+        self.assertEqual(env['x'], 42)
+
+    def test_report(self):
+        results = batchcompile.compile_all([self.source_dir], self.output_dir, 1, True, False)
+        out = io.StringIO()
+        batchcompile.report(results, 1.0, out)
+        self.assertIn('2 compiled, 1 failed', out.getvalue())
+
+    def test_each_file_once(self):
+        good = os.path.join(self.source_dir, 'pkg', 'good.py')
+        modules = batchcompile.find_modules([good, os.path.join(self.source_dir, 'pkg'),
+                                             os.path.join(self.source_dir, 'pkg', '.', 'good.py')])
+        self.assertEqual([name for _, name, _ in modules], ['good', 'pkg'])
+
+    def test_clashing_outputs(self):
+        self.write('other/good.py', 'x = 0\n')
+        with self.assertRaises(ValueError):
+            batchcompile.find_modules([os.path.join(self.source_dir, 'pkg', 'good.py'),
+                                       os.path.join(self.source_dir, 'other', 'good.py')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+"""Test the benchmarks' synthetic modules and timing harness."""
+
+from benchmarks import compile_time, pairs, synthetic
+from . import vmtest
+
+class TestSynthetic(vmtest.VmTestCase):
+    def test_deep_nesting(self):
+        self.assert_ok(synthetic.deep_nesting(6) + """\
+f = f0(1)
+for i in range(2, 6):
+    f = f(i)
+print(f(6))
+""")
+
+    def test_huge_dict(self):
+        self.assert_ok(synthetic.huge_dict(50) + "print(len(table), table['key7'])\n")
+
+    def test_many_functions(self):
+        self.assert_ok(synthetic.many_functions(30) + "print(r0, r1)\n")
+
+class TestCompileTime(vmtest.VmTestCase):
+    def test_run(self):
+        summary = compile_time.run([('small', 'x = 1\n')], 1, 3)
+        [result] = summary['results']
+        self.assertEqual(result['tailbiter']['runs'], 3)
+        stats = result['cpython']
+        self.assertTrue(stats['min'] <= stats['p10'] <= stats['median']
+                        <= stats['p90'] <= stats['max'])
+
+    def test_percentile(self):
+        times = list(range(1, 11))
+        self.assertEqual(compile_time.percentile(times, 90), 9)
+        self.assertEqual(compile_time.percentile(times, 10), 1)
+        self.assertEqual(compile_time.percentile([5], 50), 5)
+
+class TestPairs(vmtest.VmTestCase):
+    def test_profile(self):
+        plain, plain_total = pairs.profile(['article-code/greet.py'], False)
+        fused, fused_total = pairs.profile(['article-code/greet.py'], True)
+        self.assertLess(0, plain['LOAD_FAST', 'LOAD_FAST'])
+        self.assertNotIn(('LOAD_FAST', 'LOAD_FAST'), fused)
+        self.assertLess(fused_total, plain_total)
@@ -0,0 +1,30 @@
+"""Test byterun's closure-compiling engine: the behavioral tests again,
+run by it, and some of the cases its translation has to get right."""
+
+import dis, types
+from byterun import closures
+from . import vmtest
+
+class Closures:
+    "Run a test case's code with the closure-compiling engine."
+    engine = closures
+
+globals().update(vmtest.engine_test_cases(Closures))
+
+class TestTranslation(Closures, vmtest.TranslationTests, vmtest.VmTestCase):
+    def test_unsupported_opcode(self):
+        code = types.CodeType(0, 0, 0, 1, 0x40, bytes([dis.opmap['NOP']]), (), (), (),
+                              '<test>', '<test>', 1, b'')
+        with self.assertRaises(closures.VirtualMachineError):
+            closures.run(code, {}, None)
+
+    def test_functions_made_here_run_here(self):
+        code = vmtest.compile_source("""\
+            def f(x):
+                return x + 1
+            result = list(map(f, [1, 2]))
+            """)
+        f_globals = {}
+        closures.run(code, f_globals, None)
+        self.assertIsInstance(f_globals['f'], closures.Function)
+        self.assertEqual(f_globals['result'], [2, 3])
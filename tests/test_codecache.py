@@ -0,0 +1,77 @@
+"""Test the on-disk code cache."""
+
+import marshal, os, shutil, tempfile, unittest
+import codecache, compiler
+
+def compile_stub(module_name, filename, source):
+    return (source.upper(), module_name)
+
+class TestCodeCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = codecache.CodeCache(self.directory, 10000)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fetch(self, source, options=()):
+        return self.cache.get_or_compile('m', 'm.py', source, options, compile_stub)
+
+    def test_hits_and_misses(self):
+        self.assertEqual(self.fetch('x = 1'), ('X = 1', 'm'))
+        self.assertEqual(self.fetch('x = 1'), ('X = 1', 'm'))
+        self.assertEqual(self.fetch('x = 2'), ('X = 2', 'm'))
+        self.assertEqual(self.fetch('x = 2', [False]), ('X = 2', 'm'))
+        self.assertEqual(self.cache.stats(), dict(hits=1, misses=3, evictions=0))
+
+    def test_shared_between_caches(self):
+        self.fetch('x = 1')
+        other = codecache.CodeCache(self.directory, 10000)
+        other.get_or_compile('m', 'm.py', 'x = 1', (), compile_stub)
+        self.assertEqual(other.stats()['hits'], 1)
+
+    def test_corrupt_entry_is_a_miss(self):
+        self.fetch('x = 1')
+        [(_, _, path)] = self.cache.entries()
+        with open(path, 'wb') as f:
+            f.write(b'\xff')
+        self.assertEqual(self.fetch('x = 1'), ('X = 1', 'm'))
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_least_recently_used_are_evicted(self):
+        self.cache.max_bytes = 3 * len(self.entry_bytes('a' * 100))
+        sources = ['a' * 100, 'b' * 100, 'c' * 100]
+        for source in sources:
+            self.fetch(source)
+        self.age_entries(sources)
+        self.fetch('a' * 100)           # A hit, so 'a' is recently used.
+        self.fetch('d' * 100)           # Evicts 'b', the least recently used.
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.fetch('a' * 100)
+        self.fetch('b' * 100)
+        self.assertEqual(self.cache.stats()['hits'], 2)
+
+    def test_disabled(self):
+        cache = codecache.CodeCache(None, 0)
+        cache.get_or_compile('m', 'm.py', 'x = 1', (), compile_stub)
+        cache.get_or_compile('m', 'm.py', 'x = 1', (), compile_stub)
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_compiled_module(self):
+        source = '"Doc."\nx = 6 * 7\n'
+        code, docstring = self.cache.get_or_compile('m', 'm.py', source, [True],
+                                                    compiler.compile_source)
+        cached, _ = self.cache.get_or_compile('m', 'm.py', source, [True],
+                                              compiler.compile_source)
+        self.assertEqual(docstring, 'Doc.')
+        self.assertEqual(cached.co_code, code.co_code)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def entry_bytes(self, source):
+        return marshal.dumps(compile_stub('m', 'm.py', source))
+
+    def age_entries(self, sources):
+        "Make the entries look like they were last used long ago, in order."
+        for i, source in enumerate(sources):
+            path = self.cache.path_for(self.cache.key('m', 'm.py', source, ()))
+            os.utime(path, (1000000 + i, 1000000 + i))
@@ -0,0 +1,71 @@
+"""Test the compiler profiler."""
+
+import dis, io, json, unittest
+import compiler, compilestats
+from . import vmtest
+
+source = """\
+def f(x):
+    return [y * 2 for y in x]
+
+class C:
+    def m(self):
+        return f
+"""
+
+class TestCompileStats(unittest.TestCase):
+    def test_profile(self):
+        (code, docstring), profile = compilestats.profile_compile('m', 'm.py', source)
+        self.assertEqual(code.co_name, 'm')
+        self.assertIsNone(docstring)
+        for phase in ['parse', 'CodeGen'] + compilestats.phase_functions:
+            self.assertIn(phase, profile.phases)
+        self.assertEqual(profile.phases['CodeGen']['calls'], 4)
+        self.assertEqual(profile.phases['assemble']['calls'], 4)
+        code_objects = profile.code_objects()
+        self.assertEqual([c['name'] for c in code_objects],
+                         ['f', 'm', 'C', 'm'])    # The list comprehension is inline.
+        self.assertEqual(code_objects[0]['line'], 1)
+        f_code = vmtest.function_code(code, 'f')
+        self.assertEqual(code_objects[0]['instructions'],
+                         len(list(dis.get_instructions(f_code))))
+        self.assertTrue(all(c['ast_nodes'] > 0 and c['seconds'] >= 0
+                            for c in code_objects))
+        json.loads(json.dumps(profile.as_dict()))
+
+    def test_report(self):
+        _, profile = compilestats.profile_compile('m', 'm.py', source)
+        out = io.StringIO()
+        profile.report(out, 2)
+        self.assertIn('4 code objects', out.getvalue())
+        self.assertEqual(out.getvalue().count('m.py:'), 2)
+
+    def test_compiler_is_restored(self):
+        assemble = compiler.assemble
+        compile_function = compiler.CodeGen.compile_function
+        compilestats.profile_compile('m', 'm.py', source)
+        self.assertIs(compiler.assemble, assemble)
+        self.assertIs(compiler.CodeGen.compile_function, compile_function)
+
+    def test_tail_calls(self):
+        source = "def f(n):\n    if n == 0: return n\n    return f(n - 1)\n"
+        saved = compiler.tail_calls
+        for tail_calls in [False, True]:
+            (code, _), _ = compilestats.profile_compile('m', 'm.py', source, tail_calls)
+            f_code = vmtest.function_code(code, 'f')
+            opnames = [i.opname for i in dis.get_instructions(f_code)]
+            self.assertEqual('CALL_FUNCTION' in opnames, not tail_calls)
+            self.assertIs(compiler.tail_calls, saved)
+
+    def test_command_line(self):
+        # The options go in either order, and the program gets the rest.
+        for argv in [['--tail-calls', '--stats', 'prog.py', '-x', '--stats'],
+                     ['--stats', '--tail-calls', 'prog.py', '-x', '--stats']]:
+            args = compiler.parse_args(argv)
+            self.assertTrue(args.tail_calls and args.stats)
+            self.assertEqual((args.prog, args.args), ('prog.py', ['-x', '--stats']))
+        args = compiler.parse_args(['prog.py'])
+        self.assertFalse(args.tail_calls or args.stats)
+
+if __name__ == '__main__':
+    unittest.main()
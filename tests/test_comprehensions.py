@@ -0,0 +1,81 @@
+"""Test list comprehensions, which are compiled inline in functions."""
+
+from . import vmtest
+from .vmtest import compile_source, function_code
+
+class TestComprehensions(vmtest.VmTestCase):
+    def test_loop_variables_stay_inside(self):
+        self.assert_ok("""\
+            def f(xs):
+                x = 'outer'
+                ys = [x * 2 for x in xs if x]
+                return x, ys
+            print(f([0, 1, 2]))
+            """)
+
+    def test_nested_loops(self):
+        self.assert_ok("""\
+            def f(n):
+                a = 'a'
+                pairs = [(a, b) for a in range(n) for b in range(a) if a != b if b]
+                grid = [[a * b for b in range(n)] for a in range(n)]
+                return a, pairs, grid
+            print(f(4))
+            """)
+
+    def test_closures_over_loop_variables(self):
+        self.assert_ok("""\
+            def f(xs):
+                fs = [lambda: x for x in xs]
+                gs = [lambda x: x + 1 for x in xs]
+                return [f() for f in fs], [g(10) for g in gs]
+            print(f([1, 2, 3]))
+            """)
+
+    def test_method_module_and_class(self):
+        self.assert_ok("""\
+            class C:
+                n = 3
+                squares = [n * n for n in range(3)]
+                def f(self, xs):
+                    return [self.n + x for x in xs]
+            print(C.squares, C().f([1, 2]))
+            print([c for c in 'abc'])
+            """)
+
+    def test_inline_in_functions(self):
+        opnames = vmtest.all_opnames(function_code(compile_source("""\
+            def f(xs):
+                return [x + 1 for x in xs if x]
+            """), 'f'))
+        self.assertIn('LIST_APPEND', opnames)
+        self.assertNotIn('MAKE_FUNCTION', opnames)
+
+    def test_same_names_in_nested_scopes(self):
+        self.assert_ok("""\
+            def f(xs):
+                return [[x * 2 for x in range(3)] for x in xs]
+            def g(xs):
+                return [lambda: [x for x in 'ab'] + [x] for x in xs]
+            print(f([1, 2]), [h() for h in g([2, 3])])
+            """)
+
+    def test_decorators_are_outside_the_function(self):
+        self.assert_ok("""\
+            def register(keys):
+                def decorate(f):
+                    f.keys = keys
+                    return f
+                return decorate
+            keys = 'ab'
+            @register([k for k in keys])
+            def f():
+                return [k for k in 'cd']
+            class C:
+                @register([k * 2 for k in 'ef'])
+                def m(self):
+                    return [k for k in 'gh']
+            print(f.keys, f(), C.m.keys, C().m())
+            print([name for name in f.__globals__ if name.startswith('.')],
+                  [name for name in C.__dict__ if name.startswith('.')])
+            """)
@@ -0,0 +1,79 @@
+"""Test constant folding for tailbiter."""
+
+from . import vmtest
+from .vmtest import all_opnames, compile_source
+
+class TestFolding(vmtest.VmTestCase):
+    def test_arithmetic(self):
+        self.assert_ok("""\
+            print(1 + 2 * 3, 2 ** 10, 7 // 2, 7 % 3, 1 / 4, 1 << 5, -3, ~5)
+            print('ab' * 3, b'x' + b'y', not 0, +True)
+            """)
+        code = compile_source("x = (1 + 2 * 3) << 2")
+        self.assertNotIn('BINARY_ADD', all_opnames(code))
+        self.assertIn(28, code.co_consts)
+
+    def test_comparisons(self):
+        self.assert_ok("""\
+            print(1 < 2, 'a' == 'b', 3 in (1, 2, 3), 'z' not in 'abc')
+            """)
+        self.assertNotIn('COMPARE_OP', all_opnames(compile_source("x = 1 < 2")))
+
+    def test_errors_are_left_for_runtime(self):
+        self.assert_ok("x = 1 / 0", raises=ZeroDivisionError)
+        self.assert_ok("x = 'a' + 1", raises=TypeError)
+
+    def test_size_limits(self):
+        self.assert_ok("""\
+            print(len(str(2 ** 1000)), len('x' * 10000))
+            """)
+        self.assertIn('BINARY_POWER', all_opnames(compile_source("x = 2 ** 1000")))
+
+    def test_negative_zero(self):
+        self.assert_ok("""\
+            print(-0.0, 0.0, (-0.0, 0.0), 0.0 * -1, -0j)
+            """)
+        self.assertIn('UNARY_NEGATIVE', all_opnames(compile_source("x = -0.0")))
+
+    def test_tuples(self):
+        self.assert_ok("""\
+            a, b, c = (1,), (1.0,), (True,)
+            print(a, b, c, type(b[0]), ((1, 2), 'x', None))
+            """)
+        code = compile_source("x = (1, (2, 'three'), None)")
+        self.assertNotIn('BUILD_TUPLE', all_opnames(code))
+        self.assertIn((1, (2, 'three'), None), code.co_consts)
+
+    def test_constant_branches(self):
+        self.assert_ok("""\
+            if 0:
+                print('no')
+            else:
+                print('yes')
+            print('a' if 1 else 'b')
+            while 0:
+                print('never')
+            """)
+        names = all_opnames(compile_source("if True: x = 1\nelse: x = 2"))
+        self.assertNotIn('POP_JUMP_IF_FALSE', names)
+
+    def test_dead_branch_still_makes_a_local(self):
+        self.assert_ok("""\
+            def f():
+                if 0:
+                    x = 1
+                return x
+            f()
+            """, raises=UnboundLocalError)
+
+    def test_folded_branch_is_not_a_docstring(self):
+        self.assert_ok("""\
+            def f():
+                if 1:
+                    "not a docstring"
+                return 1
+            def g():
+                "a docstring"
+                return 2
+            print(f.__doc__, g.__doc__)
+            """)
@@ -230,3 +230,50 @@ class TestClosures(vmtest.VmTestCase):
             print(f(y=183)())
             """)
 
+
+
+class TestGlobals(vmtest.VmTestCase):
+    def test_globals_and_builtins_load_as_globals(self):
+        code = vmtest.compile_source("""\
+            x = 1
+            def f(y):
+                return len([x, y])
+            print(len([x]))
+            """)
+        names = vmtest.all_opnames(code)
+        self.assertEqual(names.count('LOAD_GLOBAL'), 2)
+        self.assertEqual(names.count('LOAD_NAME'), 3)     # print, len, x
+
+    def test_global_statement(self):
+        self.assert_ok("""\
+            counter = 0
+            def bump(n):
+                global counter
+                counter = counter + n
+                return lambda: counter
+            bump(2)
+            print(bump(3)(), counter)
+            """)
+
+    def test_global_shadows_enclosing_local(self):
+        self.assert_ok("""\
+            x = 'global'
+            def f():
+                x = 'local'
+                def g():
+                    global x
+                    x = 'set by g'
+                    return lambda: x
+                return g()(), x
+            print(f(), x)
+            """)
+
+    def test_methods_see_globals(self):
+        self.assert_ok("""\
+            greeting = 'hi'
+            class C:
+                greeting = 'class attribute'
+                def greet(self):
+                    return greeting
+            print(C().greet(), C.greeting)
+            """)
@@ -0,0 +1,47 @@
+"""Test importing modules compiled by tailbiter."""
+
+import importlib, os, shutil, sys, tempfile, unittest
+from byterun.interpreter import run, Function
+import codecache, compiler, importer
+
+class TestImporter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.write('tbdemo/__init__.py', '"The demo package."\n')
+        self.write('tbdemo/mod.py', 'def double(x):\n    return 2 * x\n')
+        self.write('tbother.py', 'def double(x):\n    return 2 * x\n')
+        sys.path.insert(0, self.directory)
+        self.saved_cache = compiler.code_cache
+        compiler.code_cache = codecache.CodeCache(None, 0)
+        self.finder = importer.install(['tbdemo'], run)
+
+    def tearDown(self):
+        importer.uninstall(self.finder)
+        compiler.code_cache = self.saved_cache
+        sys.path.remove(self.directory)
+        for name in ['tbdemo', 'tbdemo.mod', 'tbother']:
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.directory)
+
+    def write(self, relative, text):
+        filename = os.path.join(self.directory, relative)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'w') as f:
+            f.write(text)
+
+    def test_allowed_modules_are_compiled(self):
+        mod = importlib.import_module('tbdemo.mod')
+        self.assertIsInstance(mod.__loader__, importer.Loader)
+        self.assertIsInstance(mod.double, Function)    # Run by byterun.
+        self.assertEqual(mod.double(21), 42)
+        self.assertEqual(sys.modules['tbdemo'].__doc__, "The demo package.")
+        self.assertEqual(compiler.code_cache.stats()['misses'], 2)
+
+    def test_other_modules_are_left_alone(self):
+        mod = importlib.import_module('tbother')
+        self.assertNotIsInstance(mod.__loader__, importer.Loader)
+        self.assertNotIsInstance(mod.double, Function)
+        self.assertFalse(self.finder.allows('tbdemox'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Test incremental recompilation."""
+
+import ast, textwrap, unittest
+from byterun.interpreter import run
+import compiler
+
+version1 = """\
+def f(x):
+    return x + 1
+
+def g(x):
+    def h():
+        return x * 2
+    return h()
+
+class C:
+    def m(self):
+        return 'm'
+"""
+
+def run_module(code):
+    env = {}
+    run(code, env, None)
+    return env['f'](1), env['g'](2), env['C']().m()
+
+def nested_codes(code):
+    return dict((const.co_name, const) for const in code.co_consts
+                if hasattr(const, 'co_code'))
+
+class TestIncremental(unittest.TestCase):
+    def setUp(self):
+        self.incremental = compiler.Incremental()
+
+    def compile(self, source):
+        return self.incremental.code_for_module('m', 'm.py', ast.parse(source))
+
+    def test_unchanged_definitions_are_reused(self):
+        code1 = self.compile(version1)
+        self.assertEqual(self.incremental.compiled, 5)
+        code2 = self.compile(version1.replace('x + 1', 'x + 10'))
+        self.assertEqual(self.incremental.reused, 2)      # g and C
+        self.assertIs(nested_codes(code1)['g'], nested_codes(code2)['g'])
+        self.assertIsNot(nested_codes(code1)['f'], nested_codes(code2)['f'])
+        self.assertEqual(run_module(code2), (11, 4, 'm'))
+
+    def test_changing_a_nested_function_rebuilds_its_enclosers(self):
+        self.compile(version1)
+        code = self.compile(version1.replace('x * 2', 'x * 3'))
+        self.assertEqual(self.incremental.compiled, 5 + 2)  # h and g
+        self.assertEqual(run_module(code), (2, 6, 'm'))
+
+    def test_moved_definitions_are_relocated(self):
+        code1 = self.compile(version1)
+        code2 = self.compile('\n\n' + version1)
+        self.assertEqual(self.incremental.reused, 3)
+        for name, code in nested_codes(code2).items():
+            old = nested_codes(code1)[name]
+            self.assertEqual(code.co_code, old.co_code)
+            self.assertEqual(code.co_firstlineno, old.co_firstlineno + 2)
+        g_code = nested_codes(code2)['g']
+        self.assertEqual(nested_codes(g_code)['h'].co_firstlineno,
+                         nested_codes(nested_codes(code1)['g'])['h'].co_firstlineno + 2)
+
+    def test_same_as_full_compile(self):
+        self.compile(version1)
+        source = textwrap.dedent(version1.replace('x + 1', 'x - 1'))
+        incremental_code = self.compile(source)
+        full_code = compiler.code_for_module('m', 'm.py', ast.parse(source))
+        self.assertEqual(run_module(incremental_code), run_module(full_code))
+
+    def test_scope_changes_are_noticed(self):
+        # h's AST is the same, but its x is now a global, not a free variable.
+        self.compile("def g(x):\n    def h(): return x\n    return h\n")
+        code = self.compile("def g(y):\n    def h(): return x\n    return h\n")
+        self.assertEqual(self.incremental.reused, 0)
+        env = {'x': 'global'}
+        run(code, env, None)
+        self.assertEqual(env['g'](1)(), 'global')
+
+if __name__ == '__main__':
+    unittest.main()
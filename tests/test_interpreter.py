@@ -0,0 +1,159 @@
+"""Test byterun's decoding and dispatch of instructions."""
+
+import dis, types, unittest
+from byterun import interpreter
+from .vmtest import compile_source, function_code
+
+def fused_names(code):
+    "The names of the instructions byterun runs for code, in order."
+    instructions = interpreter.decode(code)
+    result, i = [], 0
+    while i < len(instructions):
+        result.append(interpreter.opnames[instructions[i][0]])
+        i = instructions[i][2]
+    return result
+
+class TestDecoding(unittest.TestCase):
+    def test_decode(self):
+        code = compile_source("""\
+            def f(x):
+                while x:
+                    x = x - 1
+                return [x, 'a']
+            """)
+        f_code = function_code(code, 'f')
+        instructions = interpreter.decode(f_code)
+        self.assertIs(interpreter.decode(f_code), instructions)
+        self.assertEqual([(dis.opname[opcode], arguments, next_offset)
+                          for opcode, arguments, next_offset in filter(None, instructions)],
+                         [('LOAD_FAST', (0,), 3),
+                          ('POP_JUMP_IF_FALSE', (19,), 6),
+                          ('LOAD_FAST', (0,), 9),
+                          ('LOAD_CONST', (1,), 12),
+                          ('BINARY_SUBTRACT', (), 13),
+                          ('STORE_FAST', (0,), 16),
+                          ('JUMP_ABSOLUTE', (0,), 19),
+                          ('LOAD_FAST', (0,), 22),
+                          ('LOAD_CONST', ('a',), 25),
+                          ('BUILD_LIST', (2,), 28),
+                          ('RETURN_VALUE', (), 29)])
+
+    def test_superinstructions(self):
+        code = compile_source("""\
+            def f(xs, y):
+                for x in xs:
+                    if x == y:
+                        return 'found'
+            def g(a, b):
+                if a: b = a
+                return b
+            def h(c):
+                if c: d = 1
+                return c, d
+            """)
+        f_code, g_code, h_code = [function_code(code, name) for name in ['f', 'g', 'h']]
+        self.assertEqual(fused_names(f_code),
+                         ['LOAD_FAST', 'GET_ITER', 'FOR_ITER__STORE_FAST',
+                          'LOAD_FAST__LOAD_FAST', 'COMPARE_OP__POP_JUMP_IF_FALSE',
+                          'LOAD_CONST__RETURN_VALUE', 'LOAD_CONST__RETURN_VALUE'])
+        # The second LOAD_FAST is a jump target, so it's not fused.
+        self.assertEqual(fused_names(g_code),
+                         ['LOAD_FAST', 'POP_JUMP_IF_FALSE', 'LOAD_FAST', 'STORE_FAST',
+                          'LOAD_FAST', 'RETURN_VALUE'])
+        f_globals = {}
+        interpreter.run(code, f_globals, None)
+        self.assertEqual(f_globals['f']([3, 4, 5], 4), 'found')
+        self.assertIsNone(f_globals['f']([3], 4))
+        self.assertEqual(f_globals['h'](1), (1, 1))
+        with self.assertRaisesRegex(UnboundLocalError, "local variable 'd'"):
+            f_globals['h'](0)
+
+    def test_adaptive_calls(self):
+        code = compile_source("""\
+            def apply(f, x):
+                return f(x)
+            def inc(x):
+                return x + 1
+            class C:
+                def inc(self, x):
+                    return x + 2
+            """)
+        f_globals = {}
+        interpreter.run(code, f_globals, None)
+        apply, inc, c = f_globals['apply'], f_globals['inc'], f_globals['C']()
+        def call_site():
+            [name] = [name for name in fused_names(apply.__code__) if 'CALL' in name]
+            return name
+        self.assertEqual(call_site(), 'CALL_FUNCTION_ADAPTIVE')
+        for i in range(interpreter.warmup + 1):
+            self.assertEqual(apply(inc, i), i + 1)
+        self.assertEqual(call_site(), 'CALL_FUNCTION_EXACT_ARGS')
+        self.assertEqual(apply(abs, -3), 3)
+        self.assertEqual(call_site(), 'CALL_FUNCTION_ADAPTIVE')
+        for i in range(interpreter.cooldown + 1):
+            self.assertEqual(apply(c.inc, i), i + 2)
+        self.assertEqual(call_site(), 'CALL_FUNCTION_METHOD_EXACT_ARGS')
+        self.assertEqual(apply(inc, 1), 2)
+        for i in range(interpreter.cooldown + 1):
+            self.assertEqual(apply(abs, -i), i)
+        self.assertEqual(call_site(), 'CALL_FUNCTION_HOST')
+
+    def test_f_locals(self):
+        code = compile_source("""\
+            def f(x, y):
+                z = x
+                return lambda: y
+            """)
+        f_code = function_code(code, 'f')
+        frame = interpreter.Frame(f_code, None, {}, None,
+                                  [1, 2, interpreter.unbound])
+        self.assertEqual(frame.f_locals, {'x': 1, 'y': 2})
+        frame.fast[2] = 3
+        self.assertEqual(frame.f_locals, {'x': 1, 'y': 2, 'z': 3})
+
+    def test_binding(self):
+        code = compile_source("""\
+            def f(a, b, c, *rest, **options):
+                d = a
+            def g(a, b):
+                pass
+            """)
+        f_code, g_code = function_code(code, 'f'), function_code(code, 'g')
+        unbound = interpreter.unbound
+        f = interpreter.Function('f', f_code, {}, [30], None)
+        self.assertEqual(f.bind((1, 2, 3, 4), {'x': 5}), [1, 2, 3, (4,), {'x': 5}, unbound])
+        self.assertEqual(f.bind((1,), {'b': 2}), [1, 2, 30, (), {}, unbound])
+        g = interpreter.Function('g', g_code, {}, [], None)
+        self.assertEqual(g.bind((1, 2), {}), [1, 2])
+        self.assertEqual(g.bind((), {'b': 2, 'a': 1}), [1, 2])
+        self.assertIs(interpreter.Function('g2', g_code, {}, [], None)._plan, g._plan)
+        with self.assertRaisesRegex(TypeError, "missing 1 required positional argument: 'b'"):
+            g.bind((1,), {})
+        with self.assertRaisesRegex(TypeError, "unexpected keyword argument 'c'"):
+            g.bind((1, 2), {'c': 3})
+        with self.assertRaisesRegex(TypeError, "takes up to 2"):
+            g.bind((1, 2, 3), {})
+
+    def test_deep_recursion(self):
+        # Calls from byterun functions to byterun functions don't nest
+        # on the host's stack, so this goes deeper than its limit.
+        code = compile_source("""\
+            def depth(n):
+                return 0 if n == 0 else 1 + depth(n - 1)
+            class C:
+                def depth(self, n):
+                    return 0 if n == 0 else 1 + self.depth(n - 1)
+            result = depth(20000), C().depth(20000), list(map(depth, [1, 2]))
+            """)
+        f_globals = {}
+        interpreter.run(code, f_globals, None)
+        self.assertEqual(f_globals['result'], (20000, 20000, [1, 2]))
+
+    def test_unsupported_opcode(self):
+        code = types.CodeType(0, 0, 0, 1, 0x40, bytes([dis.opmap['NOP']]), (), (), (),
+                              '<test>', '<test>', 1, b'')
+        with self.assertRaises(interpreter.VirtualMachineError):
+            interpreter.run(code, {}, None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""Test byterun's just-in-time compiler: the behavioral tests again,
+with everything compiled the first time it runs, and its counting,
+compiling, and deoptimizing."""
+
+import dis, types, unittest
+from byterun import interpreter, jit
+from . import vmtest
+
+def compile_strictly(code):
+    "jit.compile_code, for code it ought to compile."
+    compiled = jit.compile_code(code)
+    assert compiled is not None, "Not compiled: %r" % code
+    return compiled
+
+class Jitting:
+    "Run a test case's code with the JIT on, and code hot at once."
+    jit = staticmethod(compile_strictly)
+    hot = 1
+
+    def setUp(self):
+        super().setUp()
+        self.saved = interpreter.jit, interpreter.hot, interpreter.decoded_code
+        interpreter.jit, interpreter.hot = self.jit, self.hot
+        interpreter.decoded_code = {}
+
+    def tearDown(self):
+        interpreter.jit, interpreter.hot, interpreter.decoded_code = self.saved
+        super().tearDown()
+
+globals().update(vmtest.engine_test_cases(Jitting))
+
+class TestTranslation(Jitting, vmtest.TranslationTests, vmtest.VmTestCase):
+    def test_source(self):
+        code = vmtest.compile_source("""\
+            def f(n):
+                i = total = 0
+                while i < n:
+                    total = total + i
+                    i = i + 1
+                return total
+            """)
+        source = jit.compile_code(vmtest.function_code(code, 'f')).source
+        self.assertIn('while True:', source)
+        self.assertIn('total = (total + i)', source)
+
+class TestHotness(vmtest.VmTestCase):
+    def setUp(self):
+        self.saved = (interpreter.jit, interpreter.hot, interpreter.decoded_code,
+                      interpreter.tail_calls, jit.max_depth)
+        self.compiled = []
+        def compile_code(code):
+            self.compiled.append(code.co_name)
+            return jit.compile_code(code)
+        interpreter.jit, interpreter.hot = compile_code, 5
+        interpreter.decoded_code = {}
+
+    def tearDown(self):
+        (interpreter.jit, interpreter.hot, interpreter.decoded_code,
+         interpreter.tail_calls, jit.max_depth) = self.saved
+
+    def run_source(self, source):
+        f_globals = {}
+        interpreter.run(vmtest.compile_source(source), f_globals, None)
+        return f_globals
+
+    def test_hot_calls(self):
+        f_globals = self.run_source("""\
+            def square(x):
+                return x * x
+            def cold():
+                pass
+            """)
+        square, cold = f_globals['square'], f_globals['cold']
+        cold()
+        for i in range(4):
+            self.assertEqual(square(i), i * i)
+        self.assertEqual(self.compiled, [])
+        self.assertEqual(square(5), 25)
+        self.assertEqual(self.compiled, ['square'])
+        self.assertTrue(square._heat.compiled)
+        self.assertIsNone(cold._heat.compiled)
+
+    def test_hot_loop(self):
+        # The module's loop gets hot partway through, and the rest of
+        # the module's run goes compiled.
+        f_globals = self.run_source("""\
+            total = 0
+            for i in range(10):
+                total = total + i
+            done = True
+            """)
+        self.assertEqual(self.compiled, ['<test>'])
+        self.assertEqual((f_globals['total'], f_globals['done']), (45, True))
+
+    def test_uncompilable(self):
+        interpreter.hot = 1
+        code = types.CodeType(0, 0, 0, 1, 0x40, bytes([dis.opmap['NOP']]), (), (), (),
+                              '<test>', '<test>', 1, b'')
+        with self.assertRaises(interpreter.VirtualMachineError):
+            interpreter.run(code, {}, None)
+        self.assertEqual(self.compiled, ['<test>'])
+        self.assertIsNone(jit.compile_code(code))
+
+    def test_deep_recursion(self):
+        interpreter.hot = 1
+        jit.max_depth = 20
+        f_globals = self.run_source("""\
+            def depth(n):
+                return 0 if n == 0 else 1 + depth(n - 1)
+            class C:
+                def depth(self, n):
+                    return 0 if n == 0 else 1 + self.depth(n - 1)
+            result = depth(20000), C().depth(20000), list(map(depth, [1, 2]))
+            """)
+        self.assertEqual(f_globals['result'], (20000, 20000, [1, 2]))
+        self.assertEqual(jit.nesting.depth, 0)
+
+    def test_tail_calls(self):
+        # A tail call deoptimizes, for the interpreter to make it in
+        # constant space.
+        interpreter.hot = 1
+        interpreter.tail_calls = True
+        f_globals = self.run_source("""\
+            def ping(n, log):
+                log.append(n)
+                return 'done' if n == 0 else pong(n - 1, log)
+            def pong(n, log):
+                return ping(n, log)
+            log = []
+            result = ping(100000, log)
+            """)
+        self.assertEqual(f_globals['result'], 'done')
+        self.assertEqual(len(f_globals['log']), 100001)
+
+    def test_deoptimizing_keeps_variables(self):
+        interpreter.hot = 1
+        interpreter.tail_calls = True
+        f_globals = self.run_source("""\
+            def make(k):
+                def step(n, total):
+                    while n % k:
+                        total = total + n
+                        n = n - 1
+                    return total if n <= 0 else step(n - 1, total + n)
+                return step
+            result = make(3)(10, 0)
+            """)
+        self.assertEqual(f_globals['result'], 55)
+
+if __name__ == '__main__':
+    unittest.main()
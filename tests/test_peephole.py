@@ -0,0 +1,60 @@
+"""Test the peephole optimizer for tailbiter."""
+
+from . import vmtest
+from .vmtest import all_opnames, compile_source
+
+class TestPeephole(vmtest.VmTestCase):
+    def test_jump_to_next(self):
+        self.assert_ok("""\
+            x = 3
+            if x:
+                print('yes')
+            """)
+        self.assertNotIn('JUMP_FORWARD', all_opnames(compile_source("""\
+            if x:
+                y = 1
+            """)))
+
+    def test_unreachable_code(self):
+        self.assert_ok("""\
+            def f(x):
+                if x:
+                    return 1
+                else:
+                    raise ValueError(x)
+                print('unreachable')
+            print(f(1))
+            f(0)
+            """, raises=ValueError)
+        names = all_opnames(compile_source("""\
+            def f(x):
+                return x
+                print('unreachable')
+            """))
+        self.assertNotIn('CALL_FUNCTION', names)
+        self.assertEqual(names.count('RETURN_VALUE'), 2)
+
+    def test_jump_threading(self):
+        self.assert_ok("""\
+            def f(a, b, c):
+                return a and b and c
+            print(f(1, 2, 3), f(1, 0, 3), f(0, 2, 3))
+            i = 0
+            while i < 3:
+                if i:
+                    print(i)
+                i = i + 1
+            """)
+
+    def test_not_jumps(self):
+        self.assert_ok("""\
+            for x in [0, 1]:
+                if not x:
+                    print('not', x)
+            """)
+        names = all_opnames(compile_source("""\
+            if not x:
+                y = 1
+            """))
+        self.assertNotIn('UNARY_NOT', names)
+        self.assertIn('POP_JUMP_IF_TRUE', names)
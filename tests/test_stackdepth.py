@@ -0,0 +1,71 @@
+"""Test the control-flow graph and the stack depths found over it."""
+
+import dis, textwrap
+import compiler
+from . import vmtest
+from .vmtest import compile_source, function_code
+
+class TestStackDepth(vmtest.VmTestCase):
+    def test_joins(self):
+        self.assert_ok("""\
+            def f(a, b, c):
+                x = [a and b, a or b or c, b if a else c]
+                for y in x:
+                    for z in [y, not y]:
+                        print((z if y else a) and c)
+                return x
+            print(f(1, 0, 2))
+            print(f(0, 3, 0))
+            """)
+
+    def test_depths(self):
+        self.assertEqual(function_code(compile_source("""\
+            def f(a, b):
+                return a and b
+            """), 'f').co_stacksize, 1)
+        self.assertEqual(function_code(compile_source("""\
+            def f(xs):
+                for x in xs:
+                    print(x)
+                return [1, 2]
+            """), 'f').co_stacksize, 3)
+
+    def test_unreachable_code_takes_no_stack(self):
+        source = """\
+            def f(x):
+                return x
+                print([x, x, x, x])
+            """
+        self.assertEqual(function_code(compile_source(source), 'f').co_stacksize, 1)
+        plain_code = self.compile_unoptimized(textwrap.dedent(source), 'f')
+        f_code = function_code(plain_code, 'f')
+        self.assertIn('CALL_FUNCTION', vmtest.all_opnames(f_code))
+        self.assertEqual(f_code.co_stacksize, 1)
+
+    def test_blocks(self):
+        loop, end = compiler.Label(), compiler.Label()
+        parts = (loop + compiler.op.LOAD_CONST(0) + compiler.op.POP_JUMP_IF_FALSE(end)
+                 + compiler.op.JUMP_ABSOLUTE(loop) + end
+                 + compiler.op.LOAD_CONST(0) + compiler.op.RETURN_VALUE).parts()
+        blocks = compiler.make_cfg(parts)
+        self.assertEqual(compiler.plumb_depths(blocks), 1)
+        self.assertIs(blocks[0].jump_to, blocks[2])
+        self.assertIs(blocks[0].falls_to, blocks[1])
+        self.assertIs(blocks[1].jump_to, blocks[0])
+        self.assertIsNone(blocks[1].falls_to)
+        self.assertEqual([block.depth for block in blocks[:3]], [0, 0, 0])
+
+    def test_peephole_on_blocks(self):
+        op, middle, end = compiler.op, compiler.Label(), compiler.Label()
+        parts = (op.LOAD_CONST(0) + op.POP_JUMP_IF_FALSE(middle) + op.JUMP_FORWARD(end)
+                 + middle + op.JUMP_FORWARD(end)
+                 + end + op.LOAD_CONST(0) + op.RETURN_VALUE).parts()
+        blocks = compiler.make_cfg(parts)
+        first, returning = blocks[0], blocks[3]
+        blocks = compiler.peephole(blocks)
+        self.assertIs(blocks[0], first)
+        self.assertIs(blocks[-1], returning)
+        self.assertIsNone(first.jump_to)
+        self.assertEqual([dis.opname[part.opcode] for block in blocks for part in block.parts
+                          if isinstance(part, compiler.Instruction)],
+                         ['LOAD_CONST', 'POP_TOP', 'LOAD_CONST', 'RETURN_VALUE'])
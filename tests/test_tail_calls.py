@@ -0,0 +1,164 @@
+"""Test self tail-call elimination."""
+
+from byterun import interpreter
+from byterun.interpreter import run
+import compiler
+from . import vmtest
+from .vmtest import function_code
+
+class TestTailCalls(vmtest.VmTestCase):
+    def setUp(self):
+        self.meta_compiler = self.get_meta_compiler()
+        self.saved = compiler.tail_calls, self.meta_compiler.tail_calls
+        compiler.tail_calls = self.meta_compiler.tail_calls = True
+
+    def tearDown(self):
+        compiler.tail_calls, self.meta_compiler.tail_calls = self.saved
+
+    def compile(self, source_code):
+        return vmtest.compile_source(source_code)
+
+    def is_jumping(self, code, name):
+        return 'CALL_FUNCTION' not in vmtest.all_opnames(function_code(code, name))
+
+    def test_tail_calls(self):
+        self.assert_ok("""\
+            def fact(n, acc):
+                if n <= 1:
+                    return acc
+                return fact(n - 1, acc * n)
+            def swap(a, b, n):
+                if n == 0: return a, b
+                else: return swap(b, a, n - 1)
+            def collatz(n, steps):
+                while n != 1:
+                    if n % 2: return collatz(3 * n + 1, steps + 1)
+                    n = n // 2
+                    steps = steps + 1
+                return steps
+            def outer(k):
+                def loop(i, total):
+                    return total if i == 0 else loop(i - 1, total + k)
+                return loop(10, 0)
+            print(fact(20, 1), swap(1, 2, 3), collatz(27, 0), outer(3))
+            """)
+
+    def test_deep_recursion_runs_in_constant_stack(self):
+        code = self.compile("""\
+            def count_down(n):
+                if n == 0:
+                    return 'done'
+                return count_down(n - 1)
+            result = count_down(100000)
+            """)
+        self.assertTrue(self.is_jumping(code, 'count_down'))
+        f_globals = {}
+        run(code, f_globals, None)
+        self.assertEqual(f_globals['result'], 'done')
+
+    def test_calls_left_alone(self):
+        source = """\
+            def rebound(n):
+                return n if n == 0 else rebound(n - 1)
+            other = rebound
+            def rebound(n):
+                return 'second'
+            def deco(f): return f
+            @deco
+            def decorated(n):
+                return n if n == 0 else decorated(n - 1)
+            def keywords(n):
+                return n if n == 0 else keywords(n=n - 1)
+            def in_loop(ns):
+                for n in ns:
+                    return in_loop([])
+                return 'empty'
+            def captured(n):
+                if n == 0: return lambda: n
+                return captured(n - 1)
+            def made_global(n):
+                global made_global
+                return n if n == 0 else made_global(n - 1)
+            class C:
+                def method(self, n):
+                    return method(n)
+            def method(n):
+                return n
+            print(other(3), decorated(3), keywords(3), in_loop([1]), captured(3)(),
+                  made_global(3), C().method(7))
+            """
+        self.assert_ok(source)
+        code = self.compile(source)
+        for name in ['rebound', 'decorated', 'keywords', 'in_loop', 'captured', 'made_global']:
+            self.assertFalse(self.is_jumping(code, name), name)
+        self.assertFalse(self.is_jumping(function_code(code, 'C'), 'method'))
+
+    def test_other_locals_start_unbound(self):
+        source = """\
+            def stale(n):
+                if n == 3: x = 'from before'
+                if n == 0: return x
+                return stale(n - 1)
+            stale(3)
+            """
+        self.assert_ok(source, raises=UnboundLocalError)
+        self.assertFalse(self.is_jumping(self.compile(source), 'stale'))
+
+    def test_turned_off(self):
+        compiler.tail_calls = False
+        code = self.compile("""\
+            def f(n):
+                return n if n == 0 else f(n - 1)
+            """)
+        self.assertFalse(self.is_jumping(code, 'f'))
+
+class TestTrampoline(vmtest.VmTestCase):
+    def setUp(self):
+        self.saved = interpreter.tail_calls
+        interpreter.tail_calls = True
+
+    def tearDown(self):
+        interpreter.tail_calls = self.saved
+
+    def test_tail_calls(self):
+        self.assert_ok("""\
+            def is_even(n):
+                return True if n == 0 else is_odd(n - 1)
+            def is_odd(n):
+                return False if n == 0 else is_even(n - 1)
+            class Machine:
+                def __init__(self, log):
+                    self.log = log
+                def start(self, n):
+                    self.log.append(n)
+                    return self.stop(n) if n < 0 else self.start(n - 2)
+                def stop(self, n):
+                    return len(self.log), n
+            def total(*args, **kwargs):
+                return sum(args) + sum(kwargs.values())
+            def call_total(n):
+                return total(n, n, k=n)
+            print(is_even(10), is_odd(7), Machine([]).start(5), call_total(2))
+            print(len([1, 2]))
+            """)
+
+    def test_bad_arguments(self):
+        self.assert_ok("""\
+            def f(a):
+                return a
+            def g():
+                return f()
+            g()
+            """, raises=TypeError)
+
+    def test_deep_mutual_recursion(self):
+        code = vmtest.compile_source("""\
+            def ping(n):
+                return 'done' if n == 0 else pong(n - 1)
+            def pong(n):
+                return ping(n)
+            result = ping(100000)
+            """)
+        f_globals = {}
+        interpreter.run(code, f_globals, None)
+        self.assertEqual(f_globals['result'], 'done')
@@ -2,7 +2,8 @@
 
 import ast, dis, io, sys, textwrap, types, unittest
 
-from byterun.interpreter import run, VirtualMachineError
+from byterun import interpreter
+from byterun.interpreter import VirtualMachineError
 import compiler
 
 # Make this false if you need to run the debugger inside a test.
@@ -22,8 +23,59 @@ def dis_code(code):
     dis.dis(code)
 
 
+def all_code(code):
+    """`code` and all the code it refers to, depth first."""
+    codes = [code]
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            codes.extend(all_code(const))
+    return codes
+
+
+def function_code(code, name):
+    """The code of the first function (or class) named `name` that `code`
+    defines."""
+    return [const for const in code.co_consts
+            if isinstance(const, types.CodeType) and const.co_name == name][0]
+
+
+def all_opnames(code):
+    """The names of the opcodes in `code` and all the code it refers to."""
+    return [instruction.opname for each in all_code(code)
+            for instruction in dis.get_instructions(each)]
+
+
+def has_unreachable_code(code):
+    """Whether some instruction in `code` (not the code it refers to)
+    can't be reached from the start."""
+    instructions = list(dis.get_instructions(code))
+    index = dict((instruction.offset, i) for i, instruction in enumerate(instructions))
+    reached, agenda = set(), [0]
+    while agenda:
+        i = agenda.pop()
+        if i < len(instructions) and i not in reached:
+            reached.add(i)
+            instruction = instructions[i]
+            if instruction.opcode in dis.hasjrel or instruction.opcode in dis.hasjabs:
+                agenda.append(index[instruction.argval])
+            if instruction.opname not in ending_opnames:
+                agenda.append(i + 1)
+    return len(reached) < len(instructions)
+
+ending_opnames = {'RETURN_VALUE', 'RAISE_VARARGS', 'JUMP_ABSOLUTE', 'JUMP_FORWARD'}
+
+
+def compile_source(source_code):
+    """Compile `source_code` with tailbiter."""
+    source_code = textwrap.dedent(source_code)
+    return compiler.code_for_module('<test>', '<test>', ast.parse(source_code))
+
+
 class VmTestCase(unittest.TestCase):
 
+    # The byterun engine to run code in: a module with a run function.
+    engine = interpreter
+
     def assert_ok(self, source_code, raises=None):
         """Run `code` in our VM and in real Python: they behave the same."""
 
@@ -48,13 +100,26 @@ class VmTestCase(unittest.TestCase):
             self.assertIsNone(vm_exc)
 
         # Same thing for tailbiter-compiled code run in byterun.
-        tb_code = compiler.code_for_module(filename, filename, ast.parse(source_code))
+        # Unoptimized, each code object should need just the stack that
+        # CPython's does -- unless it has code that can't run, which
+        # CPython counts and we don't. The optimizations can only make
+        # that smaller.
+        plain_code = self.compile_unoptimized(source_code, filename)
+
+        ref_codes, plain_codes = all_code(ref_code), all_code(plain_code)
+        self.assertEqual([code.co_name for code in plain_codes],
+                         [code.co_name for code in ref_codes])
+        for ref, plain in zip(ref_codes, plain_codes):
+            if (ref.co_stacksize != plain.co_stacksize
+                and not (plain.co_stacksize < ref.co_stacksize
+                         and has_unreachable_code(plain))):
+                print("Different stacksize in %s: ref %d, tb %d"
+                      % (ref.co_name, ref.co_stacksize, plain.co_stacksize))
+                print(source_code)
+                self.assertTrue(False)
 
-        if ref_code.co_stacksize != tb_code.co_stacksize:
-            print("Different stacksize: ref %d, tb %d" % (ref_code.co_stacksize,
-                                                          tb_code.co_stacksize))
-            print(source_code)
-            self.assertTrue(False)
+        tb_code = compiler.code_for_module(filename, filename, ast.parse(source_code))
+        self.assertLessEqual(tb_code.co_stacksize, ref_code.co_stacksize)
 
         if 0: dis_code(tb_code)
 
@@ -81,6 +146,14 @@ class VmTestCase(unittest.TestCase):
         else:
             self.assertIsNone(both_exc)
 
+    def compile_unoptimized(self, source_code, filename):
+        compiler.optimize = False
+        try:
+            return compiler.code_for_module(filename, filename,
+                                            ast.parse(source_code))
+        finally:
+            compiler.optimize = True
+
     def run_compiler_in_vm(self, source_code):
         "Run tailbiter on vm, compiling source_code."
         source_code = textwrap.dedent(source_code)
@@ -94,17 +167,21 @@ class VmTestCase(unittest.TestCase):
         # 2. Compile source_code by running compiler2 in the vm.
         return compiler2.code_for_module(module_name, filename, source_ast)
 
+    meta_compilers = {}         # engine's name -> compiler2 module running in it
+
     def get_meta_compiler(self):
-        if not hasattr(VmTestCase, 'meta_compiler'):
+        name = self.engine.__name__
+        if name not in VmTestCase.meta_compilers:
             with open('compiler.py') as f: # XXX needs the right pwd
                 compiler_source = f.read()
             compiler_ast = ast.parse(compiler_source)
             compiler_code = compiler.code_for_module('compiler',
                                                      'compiler.py',
                                                      compiler_ast)
-            VmTestCase.meta_compiler = types.ModuleType('compiler2')
-            run(compiler_code, VmTestCase.meta_compiler.__dict__, None)
-        return VmTestCase.meta_compiler
+            meta_compiler = types.ModuleType('compiler2')
+            self.engine.run(compiler_code, meta_compiler.__dict__, None)
+            VmTestCase.meta_compilers[name] = meta_compiler
+        return VmTestCase.meta_compilers[name]
 
     def run_in_vm(self, code):
         real_stdout = sys.stdout
@@ -117,7 +194,7 @@ class VmTestCase(unittest.TestCase):
 
         vm_value = vm_exc = None
         try:
-            vm_value = run(code, None, None)
+            vm_value = self.engine.run(code, None, None)
         except VirtualMachineError:         # pragma: no cover
             # If the VM code raises an error, show it.
             raise
@@ -165,3 +242,80 @@ class VmTestCase(unittest.TestCase):
         """Exceptions don't implement __eq__, check it ourselves."""
         self.assertEqual(str(e1), str(e2))
         self.assertIs(type(e1), type(e2))
+
+
+def engine_test_cases(engine_mixin):
+    """The behavioral test cases again, each subclassed to run with the
+    engine that `engine_mixin` sets up, by name: for the test module of
+    an engine other than byterun's interpreter to add to its globals."""
+    from . import test_basic, test_comprehensions, test_exceptions, test_functions
+    cases = [('TestBasic',          test_basic.TestIt),
+             ('TestLoops',          test_basic.TestLoops),
+             ('TestComparisons',    test_basic.TestComparisons),
+             ('TestFunctions',      test_functions.TestFunctions),
+             ('TestClosures',       test_functions.TestClosures),
+             ('TestGlobals',        test_functions.TestGlobals),
+             ('TestExceptions',     test_exceptions.TestExceptions),
+             ('TestComprehensions', test_comprehensions.TestComprehensions)]
+    return dict((name, type(name, (engine_mixin, case),
+                            {'__module__': engine_mixin.__module__}))
+                for name, case in cases)
+
+
+class TranslationTests:
+    """Cases that an engine translating bytecode into something else has
+    to get right. Mix into a VmTestCase running that engine."""
+
+    def test_order_of_evaluation(self):
+        self.assert_ok("""\
+            log = []
+            def f(x):
+                log.append(x)
+                return x
+            class C: pass
+            c = C()
+            d = {}
+            a, b = f(1), f(2)
+            a, b = b, a
+            c.x = d[f('k')] = f('v')
+            c.y, d[f(3)] = f(4), f(5)
+            print(f(6) + f(7) * f(8), [f(9), f(10)], (f(11), f(12)), {'a': f(13)})
+            print(a, b, c.x, c.y, d, log)
+            """)
+
+    def test_values_across_blocks(self):
+        self.assert_ok("""\
+            def f(xs, n):
+                total = 0
+                for x in xs:
+                    if x:
+                        for y in range(n):
+                            total = total + (x if y else -x) + (y and x or n)
+                    elif n:
+                        total = total - 1
+                    else:
+                        return 'none'
+                return total, [x for x in xs if x or n]
+            print(f([1, 0, 3], 3), f([0], 0))
+            """)
+
+    def test_statement_between_loads(self):
+        self.assert_ok("""\
+            g = 1
+            def bump():
+                global g
+                g = g + 1
+                return g
+            def f():
+                return g + bump() + g
+            print(f(), g)
+            """)
+
+    def test_unbound_local(self):
+        self.assert_ok("""\
+            def f(x):
+                if x: y = 1
+                return x, y
+            print(f(1))
+            f(0)
+            """, raises=UnboundLocalError)